@@ -2,7 +2,8 @@ import os
 import logging
 import tempfile
 from dataclasses import dataclass, asdict
-from typing import Literal, Optional, List, Tuple, Dict, Union
+from functools import partial
+from typing import Callable, Literal, Optional, List, Tuple, Dict, Union
 from json import load
 from pathlib import Path
 
@@ -13,7 +14,16 @@ from vocos.pretrained import instantiate_class
 from huggingface_hub import snapshot_download
 
 from .config import Config
-from .model import DVAE, Embed, GPT, gen_logits, Tokenizer, Speaker
+from .model import (
+    DVAE,
+    Embed,
+    GPT,
+    gen_logits,
+    Tokenizer,
+    Speaker,
+    PrefixCache,
+    PrefixEntry,
+)
 from .utils import (
     check_all_assets,
     download_all_assets,
@@ -26,6 +36,77 @@ from .utils import logger as utils_logger
 from .norm import Normalizer
 
 
+class StreamDecoder:
+    """
+    Decodes a growing sequence of GPT frames (hiddens or code ids) into audio
+    incrementally.
+
+    The DVAE decoder and Vocos are convolutional with per-frame norms only, so
+    the audio of a frame depends on a bounded number of frames around it
+    (52 GPT frames on either side with the default configs). Each call decodes
+    the frames not emitted yet plus ``context`` frames in front of them, returns
+    the audio up to ``lookahead`` frames before the current end, and keeps the
+    first ``crossfade`` samples of the held-back audio to crossfade with the
+    next call's version of the same samples. The window per call is bounded,
+    so the total decode cost is linear in the utterance length.
+
+    With ``context`` and ``lookahead`` covering the receptive field the output
+    matches decoding the whole utterance at once. A shorter ``lookahead``
+    gets to the first audio sooner but is lossy: 12 frames measured 54 dB SNR
+    against the whole decode (chattts_stream_benchmark.py), 24 frames 118 dB.
+
+    Rows may have different lengths; each row is silent after its own end.
+    """
+
+    def __init__(
+        self,
+        decode: Callable[[List[torch.Tensor]], np.ndarray],
+        samples_per_frame: int,
+        context: int = 52,
+        lookahead: int = 52,
+        crossfade: int = 1024,
+    ):
+        assert lookahead > 0, "lookahead must be at least one frame"
+        self.decode_fn = decode
+        self.samples_per_frame = samples_per_frame
+        self.context = context
+        self.lookahead = lookahead
+        self.crossfade = min(crossfade, lookahead * samples_per_frame // 2)
+        self.emitted = 0  # frames whose audio has been returned
+        self._tail: Optional[np.ndarray] = None
+
+    def decode(self, frames: List[torch.Tensor], final=False) -> np.ndarray:
+        """
+        ``frames`` holds every frame generated so far for each batch row.
+        Returns the new audio as (batch, samples); pass ``final`` with the
+        last frames to flush the held-back audio.
+        """
+        lengths = [f.size(0) for f in frames]
+        total = max(lengths)
+        end = total if final else total - self.lookahead
+        if end <= self.emitted:
+            return np.zeros((len(frames), 0), dtype=np.float32)
+        start = max(0, self.emitted - self.context)
+        wavs = self.decode_fn([f[start:] for f in frames])
+        for i, length in enumerate(lengths):
+            # decode_fn zero-pads shorter rows to the longest one (a row that
+            # ended before start is all padding); what it makes of the padding is not audio
+            if length < total:
+                wavs[i, max(0, length - start) * self.samples_per_frame :] = 0
+        offset = (self.emitted - start) * self.samples_per_frame
+        stop = wavs.shape[1] if final else (end - start) * self.samples_per_frame
+        new_wavs = wavs[:, offset:stop]
+        if self._tail is not None:
+            n = min(self._tail.shape[1], new_wavs.shape[1])
+            fade_in = 0.5 - 0.5 * np.cos(np.pi * (np.arange(n) + 0.5) / n)
+            new_wavs[:, :n] = (
+                self._tail[:, :n] * (1 - fade_in) + new_wavs[:, :n] * fade_in
+            )
+        self._tail = None if final else wavs[:, stop : stop + self.crossfade].copy()
+        self.emitted = end
+        return new_wavs
+
+
 class Chat:
     def __init__(self, logger=logging.getLogger(__name__)):
         self.logger = logger
@@ -43,6 +124,8 @@ class Chat:
             self.sha256_map: Dict[str, str] = load(f)
 
         self.context = GPT.Context()
+        # KV state of the speaker/prompt prefix, see InferCodeParams.reuse_prefix
+        self.prefix_cache = PrefixCache()
 
     def has_loaded(self, use_decoder=False):
         not_finish = False
@@ -187,6 +270,15 @@ class Chat:
         stream_batch: int = 24
         stream_speed: int = 12000
         pass_first_n_batches: int = 2
+        # decode only new frames while streaming (see StreamDecoder);
+        # stream_speed and pass_first_n_batches apply to the full re-decode only
+        stream_incremental: bool = True
+        stream_context: int = 52
+        stream_lookahead: int = 52
+        stream_crossfade: int = 1024
+        # start from the cached KV state of [Stts][spk_emb]{txt_smp}{prompt}
+        # instead of prefilling it again (see Chat.prefix_cache)
+        reuse_prefix: bool = True
 
     def infer(
         self,
@@ -306,6 +398,7 @@ class Chat:
         gpt.from_pretrained(gpt_ckpt_path, embed_path, experimental=experimental)
         gpt.prepare(compile=compile and "cuda" in str(device))
         self.gpt = gpt
+        self.prefix_cache.clear()
         self.logger.log(logging.INFO, "gpt loaded.")
 
         self.speaker = Speaker(
@@ -384,6 +477,10 @@ class Chat:
                 yield text
                 return
 
+        if stream and params_infer_code.stream_incremental:
+            yield from self._infer_stream(text, use_decoder, params_infer_code)
+            return
+
         if stream:
             length = 0
             pass_batch_count = 0
@@ -420,6 +517,44 @@ class Chat:
             # Filter both rows and columns using slicing
             yield new_wavs[:][:, keep_cols]
 
+    def _infer_stream(
+        self,
+        text: List[str],
+        use_decoder: bool,
+        params_infer_code: InferCodeParams,
+    ):
+        decoder = StreamDecoder(
+            partial(self._decode_to_wavs, use_decoder=use_decoder),
+            2 * self.config.vocos.head.init_args.hop_length,
+            context=params_infer_code.stream_context,
+            lookahead=params_infer_code.stream_lookahead,
+            crossfade=params_infer_code.stream_crossfade,
+        )
+        last = None
+        for result in self._infer_code(
+            text,
+            True,
+            self.device,
+            use_decoder,
+            params_infer_code,
+        ):
+            # keep the latest frames until the end, the final flush needs them
+            if last is not None:
+                last.destroy()
+            last = result
+            new_wavs = decoder.decode(result.hiddens if use_decoder else result.ids)
+            if new_wavs.shape[1] > 0:
+                yield new_wavs
+        if last is None:
+            return
+        # ends at the longest row; shorter rows are zeroed past their own end
+        new_wavs = decoder.decode(
+            last.hiddens if use_decoder else last.ids,
+            final=True,
+        )
+        last.destroy()
+        yield new_wavs
+
     @torch.inference_mode()
     def _vocos_decode(self, spec: torch.Tensor) -> np.ndarray:
         if "mps" in str(self.device):
@@ -478,20 +613,8 @@ class Chat:
         else:
             temperature = params.temperature
 
-        input_ids, attention_mask, text_mask = self.tokenizer.encode(
-            self.speaker.decorate_code_prompts(
-                text,
-                params.prompt,
-                params.txt_smp,
-                params.spk_emb,
-            ),
-            self.config.gpt.num_vq,
-            prompt=(
-                self.speaker.decode_prompt(params.spk_smp)
-                if params.spk_smp is not None
-                else None
-            ),
-            device=self.device_gpt,
+        input_ids, attention_mask, text_mask = self._encode_code_prompts(
+            text, params
         )
         start_idx = input_ids.shape[-2]
 
@@ -543,18 +666,9 @@ class Chat:
                 ),
             ]
 
-        emb = self.embed(input_ids, text_mask)
-
-        del text_mask
-
-        if params.spk_emb is not None:
-            self.speaker.apply(
-                emb,
-                params.spk_emb,
-                input_ids,
-                self.tokenizer.spk_emb_ids,
-                self.gpt.device_gpt,
-            )
+        emb, input_ids, attention_mask, prefix = self._embed_code_prompts(
+            input_ids, attention_mask, text_mask, params
+        )
 
         result = gpt.generate(
             emb,
@@ -573,12 +687,143 @@ class Chat:
             stream_batch=params.stream_batch,
             manual_seed=params.manual_seed,
             context=self.context,
+            prefix_cache=prefix,
         )
 
-        del emb, input_ids
+        del emb, input_ids, prefix
 
         return result
 
+    def _encode_code_prompts(
+        self, text: List[str], params: InferCodeParams
+    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        """Left padded input_ids, attention_mask and text_mask of the code prompts."""
+        return self.tokenizer.encode(
+            self.speaker.decorate_code_prompts(
+                text,
+                params.prompt,
+                params.txt_smp,
+                params.spk_emb,
+            ),
+            self.config.gpt.num_vq,
+            prompt=(
+                self.speaker.decode_prompt(params.spk_smp)
+                if params.spk_smp is not None
+                else None
+            ),
+            device=self.device_gpt,
+        )
+
+    @torch.no_grad()
+    def _embed_code_prompts(
+        self,
+        input_ids: torch.Tensor,
+        attention_mask: torch.Tensor,
+        text_mask: torch.Tensor,
+        params: InferCodeParams,
+    ):
+        """
+        Embeds the encoded code prompts with the speaker applied, for GPT.generate.
+        Returns (emb, input_ids, attention_mask, prefix KV or None); with a
+        prefix, emb starts after it (see GPT.generate's ``prefix_cache``).
+        """
+        prefix_key, prefix = None, None
+        if (
+            params.reuse_prefix
+            and self.prefix_cache.max_bytes > 0
+            and not self.gpt.is_te_llama
+        ):
+            prefix_text = self.speaker.code_prompt_prefix(
+                params.prompt, params.txt_smp, params.spk_emb
+            )
+            prefix_key = self.prefix_cache.key(params.spk_emb, prefix_text)
+            prefix = self.prefix_cache.get(prefix_key)
+            prefix_ids = (
+                prefix.ids
+                if prefix is not None
+                else self.tokenizer.encode(
+                    [prefix_text], 1, device=self.device_gpt
+                )[0][0, :, 0]
+            )
+            moved = self._move_prefix_first(
+                input_ids, attention_mask, text_mask, prefix_ids
+            )
+            if moved is None:
+                prefix_key, prefix = None, None
+            else:
+                input_ids, attention_mask, text_mask = moved
+            del moved
+
+        emb = self.embed(input_ids, text_mask)
+
+        del text_mask
+
+        if params.spk_emb is not None:
+            self.speaker.apply(
+                emb,
+                params.spk_emb,
+                input_ids,
+                self.tokenizer.spk_emb_ids,
+                self.gpt.device_gpt,
+            )
+
+        if prefix_key is not None:
+            if prefix is None:
+                prefix = PrefixEntry(
+                    ids=prefix_ids,
+                    kv=self.gpt.prefill(
+                        emb.narrow(0, 0, 1).narrow(1, 0, prefix_ids.size(0))
+                    ),
+                )
+                self.prefix_cache.put(prefix_key, prefix)
+            size = prefix.ids.size(0)
+            emb = emb.narrow(1, size, emb.size(1) - size)
+
+        return emb, input_ids, attention_mask, None if prefix is None else prefix.kv
+
+    @staticmethod
+    @torch.no_grad()
+    def _move_prefix_first(
+        input_ids: torch.Tensor,
+        attention_mask: torch.Tensor,
+        text_mask: torch.Tensor,
+        prefix_ids: torch.Tensor,
+    ) -> Optional[Tuple[torch.Tensor, torch.Tensor, torch.Tensor]]:
+        """
+        Reorders every left padded row from [padding][prefix][rest] to
+        [prefix][padding][rest], so that the prefix sits at the same positions
+        in all rows and its cached KV state can be shared. Position ids come
+        from the attention mask, so each token keeps its position.
+        Returns None if some row does not start with ``prefix_ids``.
+        """
+        size = prefix_ids.size(0)
+        total = input_ids.size(1)
+        orders = []
+        for i, length in enumerate(attention_mask.sum(1).tolist()):
+            pad = total - int(length)
+            if length <= size or not torch.equal(
+                input_ids[i, pad : pad + size, 0], prefix_ids.to(input_ids.device)
+            ):
+                return None
+            orders.append(
+                torch.cat(
+                    (
+                        torch.arange(pad, pad + size),
+                        torch.arange(0, pad),
+                        torch.arange(pad + size, total),
+                    )
+                )
+            )
+        order = torch.stack(orders).to(input_ids.device)
+        del orders
+        return (
+            input_ids.gather(
+                1, order.unsqueeze(-1).expand(-1, -1, input_ids.size(2))
+            ),
+            attention_mask.gather(1, order.to(attention_mask.device)),
+            text_mask.gather(1, order.to(text_mask.device)),
+        )
+
     @torch.no_grad()
     def _refine_text(
         self,
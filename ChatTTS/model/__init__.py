@@ -1,6 +1,7 @@
 from .dvae import DVAE
 from .embed import Embed
 from .gpt import GPT
+from .prefix_cache import PrefixCache, PrefixEntry
 from .processors import gen_logits
 from .speaker import Speaker
 from .tokenizer import Tokenizer
@@ -1,7 +1,7 @@
 import platform
 from dataclasses import dataclass
 import logging
-from typing import Union, List, Optional, Tuple, Callable
+from typing import Any, Union, List, Optional, Tuple, Callable
 import gc
 
 import torch
@@ -10,7 +10,7 @@ import torch.nn.functional as F
 import torch.nn.utils.parametrize as P
 from tqdm import tqdm
 from transformers import LlamaModel, LlamaConfig
-from transformers.cache_utils import Cache
+from transformers.cache_utils import Cache, DynamicCache
 from transformers.modeling_outputs import BaseModelOutputWithPast
 from transformers.utils import is_flash_attn_2_available
 
@@ -45,6 +45,8 @@ class GPT(nn.Module):
         self.use_flash_attn = use_flash_attn
         self.is_te_llama = False
         self.is_vllm = use_vllm
+        # drop finished rows from the batch while generating, see generate
+        self.compact_rows = True
 
         if self.is_vllm:
             return
@@ -307,6 +309,48 @@ class GPT(nn.Module):
             hiddens=hiddens,
         )
 
+    @torch.no_grad()
+    def prefill(self, emb: torch.Tensor) -> Tuple[Tuple[torch.Tensor, torch.Tensor], ...]:
+        """Runs the model over the embeddings of a 1-row prompt and returns its KV cache."""
+        outputs: BaseModelOutputWithPast = self.gpt(
+            inputs_embeds=emb.to(self.device_gpt, self.gpt.dtype),
+            position_ids=torch.arange(emb.size(1), device=self.device_gpt).unsqueeze_(0),
+            use_cache=True,
+        )
+        past_key_values = outputs.past_key_values
+        del_all(outputs)
+        if isinstance(past_key_values, Cache):
+            past_key_values = past_key_values.to_legacy_cache()
+        return past_key_values
+
+    @staticmethod
+    def _expand_prefix_cache(
+        prefix_cache: Tuple[Tuple[torch.Tensor, torch.Tensor], ...], batch_size: int
+    ) -> DynamicCache:
+        # the first update concatenates into new tensors, so the cached ones are never written
+        return DynamicCache.from_legacy_cache(
+            tuple(
+                (
+                    k.expand(batch_size, -1, -1, -1),
+                    v.expand(batch_size, -1, -1, -1),
+                )
+                for k, v in prefix_cache
+            )
+        )
+
+    @staticmethod
+    def _select_cache_rows(past_key_values, rows: torch.Tensor):
+        """Keeps only the batch rows ``rows`` of a KV cache, in that order."""
+        if past_key_values is None:
+            return None
+        if isinstance(past_key_values, Cache):
+            past_key_values.reorder_cache(rows)
+            return past_key_values
+        return tuple(
+            tuple(t.index_select(0, rows.to(t.device)) for t in layer)
+            for layer in past_key_values
+        )
+
     @torch.no_grad()
     def generate(
         self,
@@ -329,7 +373,13 @@ class GPT(nn.Module):
         stream_batch=24,
         manual_seed: Optional[int] = None,
         context=Context(),
+        prefix_cache: Optional[Tuple[Tuple[torch.Tensor, torch.Tensor], ...]] = None,
     ):
+        """
+        With ``prefix_cache`` (see ``prefill``), the first ``prefix_cache`` length
+        positions of ``inputs_ids`` are already computed for every row, and
+        ``emb`` only holds the embeddings of the positions after them.
+        """
 
         attentions: List[Optional[Tuple[torch.FloatTensor, ...]]] = []
         hiddens = []
@@ -375,6 +425,15 @@ class GPT(nn.Module):
         del inputs_ids
         inputs_ids = inputs_ids_buf.narrow(1, 0, progress)
 
+        # rows of the batch still being generated. finished rows are dropped from
+        # the KV cache, attention mask and temperature so they cost nothing more;
+        # ids, end_idx and finish stay full size and are written through this map.
+        active = torch.arange(
+            inputs_ids_buf.size(0), device=inputs_ids_buf.device, dtype=torch.long
+        )
+        compacted = False
+        compact = self.compact_rows and not return_attn
+
         pbar: Optional[tqdm] = None
 
         if show_tqdm:
@@ -384,12 +443,20 @@ class GPT(nn.Module):
                 bar_format="{l_bar}{bar}| {n_fmt}/{total_fmt}(max) [{elapsed}, {rate_fmt}{postfix}]",
             )
 
-        past_key_values = None
+        past_key_values = (
+            None
+            if prefix_cache is None
+            else self._expand_prefix_cache(prefix_cache, inputs_ids_buf.size(0))
+        )
 
         for i in range(max_new_token):
 
+            active_ids = (
+                inputs_ids.index_select(0, active) if compacted else inputs_ids
+            )
+
             model_input = self._prepare_generation_inputs(
-                inputs_ids,
+                active_ids,
                 past_key_values,
                 attention_mask_cache.narrow(1, 0, inputs_ids.shape[1]),
                 use_cache=not self.is_te_llama,
@@ -428,7 +495,12 @@ class GPT(nn.Module):
             past_key_values = outputs.past_key_values
             del_all(outputs)
             if return_hidden:
-                hiddens.append(hidden_states.narrow(1, -1, 1).squeeze_(1))
+                hidden = hidden_states.narrow(1, -1, 1).squeeze_(1)
+                if compacted:
+                    hidden = hidden.new_zeros(
+                        inputs_ids_buf.size(0), hidden.size(1)
+                    ).index_copy_(0, active.to(hidden.device), hidden)
+                hiddens.append(hidden)
 
             with P.cached():
                 if infer_text:
@@ -458,10 +530,10 @@ class GPT(nn.Module):
                 logits = logits.permute(0, 2, 1)
                 logits = logits.reshape(-1, logits.size(2))
                 # logits_token = rearrange(inputs_ids[:, start_idx:], "b c n -> (b n) c")
-                inputs_ids_sliced = inputs_ids.narrow(
+                inputs_ids_sliced = active_ids.narrow(
                     1,
                     start_idx,
-                    inputs_ids.size(1) - start_idx,
+                    active_ids.size(1) - start_idx,
                 ).permute(0, 2, 1)
                 logits_token = inputs_ids_sliced.reshape(
                     inputs_ids_sliced.size(0) * inputs_ids_sliced.size(1),
@@ -470,10 +542,10 @@ class GPT(nn.Module):
                 del inputs_ids_sliced
             else:
                 logits_token = (
-                    inputs_ids.narrow(
+                    active_ids.narrow(
                         1,
                         start_idx,
-                        inputs_ids.size(1) - start_idx,
+                        active_ids.size(1) - start_idx,
                     )
                     .narrow(2, 0, 1)
                     .to(self.device)
@@ -484,7 +556,7 @@ class GPT(nn.Module):
             for logitsProcessors in logits_processors:
                 logits = logitsProcessors(logits_token, logits)
 
-            del logits_token
+            del logits_token, active_ids
 
             if i < min_new_token:
                 logits[:, eos_token] = -torch.inf
@@ -495,6 +567,25 @@ class GPT(nn.Module):
 
             if manual_seed is None:
                 idx_next = torch.multinomial(scores, num_samples=1).to(finish.device)
+            elif compacted:
+                # sample the full batch (finished rows uniformly), so every row
+                # draws the same random numbers as it would without compaction
+                per_row = scores.size(0) // active.size(0)
+                rows = (
+                    active.to(scores.device).unsqueeze(1) * per_row
+                    + torch.arange(per_row, device=scores.device)
+                ).view(-1)
+                idx_next = (
+                    torch.multinomial(
+                        scores.new_ones(finish.size(0) * per_row, scores.size(1))
+                        .index_copy_(0, rows, scores),
+                        num_samples=1,
+                        generator=self.generator.manual_seed(manual_seed),
+                    )
+                    .index_select(0, rows)
+                    .to(finish.device)
+                )
+                del rows
             else:
                 idx_next = torch.multinomial(
                     scores,
@@ -508,15 +599,23 @@ class GPT(nn.Module):
                 # idx_next = rearrange(idx_next, "(b n) 1 -> b n", n=self.num_vq)
                 idx_next = idx_next.view(-1, self.num_vq)
                 finish_or = idx_next.eq(eos_token).any(1)
-                finish.logical_or_(finish_or)
-                del finish_or
-                inputs_ids_buf.narrow(1, progress, 1).copy_(idx_next.unsqueeze_(1))
+                finish.index_copy_(
+                    0, active, finish.index_select(0, active) | finish_or
+                )
+                inputs_ids_buf.narrow(1, progress, 1).index_copy_(
+                    0, active, idx_next.unsqueeze_(1).to(inputs_ids_buf.dtype)
+                )
             else:
                 finish_or = idx_next.eq(eos_token).any(1)
-                finish.logical_or_(finish_or)
-                del finish_or
-                inputs_ids_buf.narrow(1, progress, 1).copy_(
-                    idx_next.unsqueeze_(-1).expand(-1, -1, self.num_vq),
+                finish.index_copy_(
+                    0, active, finish.index_select(0, active) | finish_or
+                )
+                inputs_ids_buf.narrow(1, progress, 1).index_copy_(
+                    0,
+                    active,
+                    idx_next.unsqueeze_(-1)
+                    .expand(-1, -1, self.num_vq)
+                    .to(inputs_ids_buf.dtype),
                 )
 
             if i == 0 and finish.any():
@@ -534,6 +633,8 @@ class GPT(nn.Module):
                         start_idx,
                         end_idx,
                         finish,
+                        finish_or,
+                        active,
                         temperature,
                         attention_mask_cache,
                         past_key_values,
@@ -558,6 +659,7 @@ class GPT(nn.Module):
                         stream_batch,
                         manual_seed,
                         context,
+                        prefix_cache,
                     )
                     for result in new_gen:
                         yield result
@@ -587,6 +689,20 @@ class GPT(nn.Module):
             if finish.all() or context.get():
                 break
 
+            if compact and finish_or.any():
+                keep = finish_or.logical_not().nonzero().squeeze_(1)
+                active = active.index_select(0, keep)
+                past_key_values = self._select_cache_rows(past_key_values, keep)
+                attention_mask_cache = attention_mask_cache.index_select(0, keep)
+                temperature = (
+                    temperature.view(finish_or.size(0), -1)
+                    .index_select(0, keep.to(temperature.device))
+                    .view(-1, 1)
+                )
+                compacted = True
+                del keep
+            del finish_or
+
             if pbar is not None:
                 pbar.update(1)
 
@@ -611,3 +727,297 @@ class GPT(nn.Module):
             hiddens,
             infer_text,
         )
+
+    @dataclass(repr=False, eq=False)
+    class Row:
+        """A code prompt of generate_continuous, and its result once it finishes."""
+
+        # embeddings (1, length, hidden) of the prompt, after the prefix if any
+        emb: torch.Tensor
+        # (num_vq,)
+        temperature: torch.Tensor
+        # KV state of the first positions of the prompt, see prefill
+        prefix_cache: Optional[Tuple[Tuple[torch.Tensor, torch.Tensor], ...]] = None
+        # anything the caller needs to match the row with its request
+        tag: Any = None
+        # set when the row finishes, like one row of GenerationOutputs
+        ids: Optional[torch.Tensor] = None
+        hiddens: Optional[torch.Tensor] = None
+
+    @torch.no_grad()
+    def _prefill_row(self, row: "GPT.Row") -> Tuple[torch.Tensor, DynamicCache]:
+        """Runs a row's prompt alone. Returns the hidden state of its last position and its KV cache."""
+        emb = row.emb.to(self.device_gpt, self.gpt.dtype)
+        start = 0
+        past_key_values = None
+        attention_mask = None
+        if row.prefix_cache is not None:
+            start = row.prefix_cache[0][0].size(2)
+            past_key_values = self._expand_prefix_cache(row.prefix_cache, 1)
+            attention_mask = torch.ones(
+                1, start + emb.size(1), dtype=torch.long, device=self.device_gpt
+            )
+        positions = torch.arange(
+            start, start + emb.size(1), device=self.device_gpt
+        )
+        outputs: BaseModelOutputWithPast = self.gpt(
+            inputs_embeds=emb,
+            attention_mask=attention_mask,
+            position_ids=positions.unsqueeze(0),
+            past_key_values=past_key_values,
+            use_cache=True,
+            cache_position=positions,
+        )
+        hidden = outputs.last_hidden_state.narrow(1, -1, 1).squeeze_(1)
+        past_key_values = outputs.past_key_values
+        del_all(outputs)
+        if not isinstance(past_key_values, Cache):
+            past_key_values = DynamicCache.from_legacy_cache(past_key_values)
+        return hidden.to(self.device, dtype=torch.float), past_key_values
+
+    @staticmethod
+    def _pad_cache_left(past_key_values: DynamicCache, length: int) -> DynamicCache:
+        """Left pads (or, with a negative length, trims) every row of a KV cache by ``length`` positions."""
+        return DynamicCache.from_legacy_cache(
+            tuple(
+                tuple(
+                    (
+                        F.pad(t, (0, 0, length, 0))
+                        if length > 0
+                        else t.narrow(2, -length, t.size(2) + length)
+                    )
+                    for t in layer
+                )
+                for layer in past_key_values.to_legacy_cache()
+            )
+        )
+
+    @staticmethod
+    def _cat_caches(a: DynamicCache, b: DynamicCache) -> DynamicCache:
+        return DynamicCache.from_legacy_cache(
+            tuple(
+                (torch.cat((ka, kb)), torch.cat((va, vb)))
+                for (ka, va), (kb, vb) in zip(a.to_legacy_cache(), b.to_legacy_cache())
+            )
+        )
+
+    @torch.no_grad()
+    def generate_continuous(
+        self,
+        admit: Callable[[int], Optional[List["GPT.Row"]]],
+        eos_token: int,
+        max_batch: int,
+        max_new_token=2048,
+        min_new_token=0,
+        logits_processors: Tuple[
+            Callable[[torch.LongTensor, torch.FloatTensor], torch.FloatTensor]
+        ] = (),
+        ensure_non_empty=True,
+        manual_seed: Optional[int] = None,
+        context=Context(),
+    ):
+        """
+        Continuous batching form of ``generate`` for code tokens.
+
+        Up to ``max_batch`` rows generate together, one token per step. Before
+        every step ``admit(free)`` is asked for up to ``free`` (maybe 0) new rows; each is
+        prefilled alone and joins the running batch, left padded to the KV
+        length of the others (or the others to its), so a new request starts
+        at the next step instead of waiting for the batch to drain. ``free ==
+        max_batch`` means nothing is running, so ``admit`` may block until there
+        is work; it returns None to stop. Finished rows leave the KV cache at
+        once, like ``compact_rows`` in ``generate``, and free their slot.
+
+        Slots are tracked the way ``generate`` tracks its rows: ``active`` maps
+        the rows of the KV cache, attention mask and logits to the slots of the
+        full-size id buffer. Yields the list of rows that finished at a step,
+        with ``ids`` and ``hiddens`` set as ``generate`` would for that row.
+        A row ending at its first token is sampled again with ``ensure_non_empty``,
+        which is what regenerating it would give. With ``manual_seed`` the
+        generator is reseeded every step as in ``generate``, so the draws depend
+        on which rows run together.
+        """
+
+        ids_buf = torch.zeros(
+            max_batch, max_new_token, self.num_vq, dtype=torch.long, device=self.device
+        )
+        # tokens generated so far, and the temperature of each slot
+        generated = [0] * max_batch
+        temperature = torch.ones(max_batch, self.num_vq, device=self.device)
+        hiddens: List[List[torch.Tensor]] = [[] for _ in range(max_batch)]
+        rows: List[Optional[GPT.Row]] = [None] * max_batch
+        active = torch.zeros(0, dtype=torch.long, device=self.device)
+        past_key_values: Optional[DynamicCache] = None
+        attention_mask: Optional[torch.Tensor] = None
+        min_new_token = max(min_new_token, 1) if ensure_non_empty else min_new_token
+
+        while True:
+            new_rows = admit(max_batch - active.size(0))
+            if new_rows is None:
+                break
+            if active.size(0) == 0 and not new_rows:
+                continue
+
+            step_hiddens = []
+            if active.size(0) > 0:
+                # one decode step of the running rows
+                last = torch.stack(
+                    [ids_buf[slot, generated[slot] - 1] for slot in active.tolist()]
+                ).to(self.device_gpt)
+                emb = torch.stack(
+                    [self.emb_code[i](last[:, i]) for i in range(self.num_vq)], 2
+                ).sum(2).unsqueeze_(1)
+                attention_mask = F.pad(attention_mask, (0, 1), value=1)
+                length = past_key_values.get_seq_length()
+                outputs: BaseModelOutputWithPast = self.gpt(
+                    inputs_embeds=emb.to(self.gpt.dtype),
+                    attention_mask=attention_mask,
+                    position_ids=attention_mask.sum(1, keepdim=True) - 1,
+                    past_key_values=past_key_values,
+                    use_cache=True,
+                    cache_position=torch.arange(
+                        length, length + 1, device=self.device_gpt
+                    ),
+                )
+                del emb, last
+                step_hiddens.append(
+                    outputs.last_hidden_state.narrow(1, -1, 1)
+                    .squeeze_(1)
+                    .to(self.device, dtype=torch.float)
+                )
+                past_key_values = outputs.past_key_values
+                del_all(outputs)
+
+            for row in new_rows:
+                slot = rows.index(None)
+                rows[slot] = row
+                generated[slot] = 0
+                hiddens[slot] = []
+                temperature[slot] = row.temperature.to(self.device)
+                hidden, row_cache = self._prefill_row(row)
+                step_hiddens.append(hidden)
+                row_mask = torch.ones(
+                    1,
+                    row_cache.get_seq_length(),
+                    dtype=torch.long,
+                    device=self.device_gpt,
+                )
+                if past_key_values is None:
+                    past_key_values, attention_mask = row_cache, row_mask
+                else:
+                    pad = row_mask.size(1) - attention_mask.size(1)
+                    if pad > 0:
+                        past_key_values = self._pad_cache_left(past_key_values, pad)
+                        attention_mask = F.pad(attention_mask, (pad, 0))
+                    elif pad < 0:
+                        row_cache = self._pad_cache_left(row_cache, -pad)
+                        row_mask = F.pad(row_mask, (-pad, 0))
+                    past_key_values = self._cat_caches(past_key_values, row_cache)
+                    attention_mask = torch.cat((attention_mask, row_mask))
+                del row_cache, row_mask
+                active = torch.cat(
+                    (active, torch.tensor([slot], device=self.device))
+                )
+
+            hidden_states = torch.cat(step_hiddens)
+            del step_hiddens
+            slots = active.tolist()
+            for slot, hidden in zip(slots, hidden_states):
+                hiddens[slot].append(hidden)
+
+            with P.cached():
+                logits = torch.stack(
+                    [self.head_code[i](hidden_states) for i in range(self.num_vq)], 2
+                )
+            del hidden_states
+            # (b, c, n) -> (b * n, c), as in generate
+            logits = logits.permute(0, 2, 1).reshape(-1, logits.size(1)).float()
+            logits /= temperature.index_select(0, active).view(-1, 1)
+
+            # rows admitted at different steps have histories of different
+            # lengths, so the processors run per group of equal length
+            groups = {}
+            for i, slot in enumerate(slots):
+                groups.setdefault(generated[slot], []).append(i)
+            for count, group in groups.items():
+                index = torch.tensor(group, device=self.device)
+                vq_rows = (
+                    index.unsqueeze(1) * self.num_vq
+                    + torch.arange(self.num_vq, device=self.device)
+                ).view(-1)
+                group_logits = logits.index_select(0, vq_rows)
+                logits_token = (
+                    ids_buf.index_select(0, active.index_select(0, index))
+                    .narrow(1, 0, count)
+                    .permute(0, 2, 1)
+                    .reshape(len(group) * self.num_vq, count)
+                )
+                for logitsProcessors in logits_processors:
+                    group_logits = logitsProcessors(logits_token, group_logits)
+                if count < min_new_token:
+                    group_logits[:, eos_token] = -torch.inf
+                logits.index_copy_(0, vq_rows, group_logits)
+                del index, vq_rows, group_logits, logits_token
+
+            scores = F.softmax(logits, dim=-1)
+            del logits
+            idx_next = torch.multinomial(
+                scores,
+                num_samples=1,
+                generator=(
+                    None
+                    if manual_seed is None
+                    else self.generator.manual_seed(manual_seed)
+                ),
+            ).view(-1, self.num_vq)
+            del scores
+
+            interrupted = context.get()
+            if interrupted:
+                self.logger.warning("generation is interrupted")
+            finished = []
+            keep = []
+            ended = idx_next.eq(eos_token).any(1).tolist()
+            for i, slot in enumerate(slots):
+                if not ended[i]:
+                    ids_buf[slot, generated[slot]] = idx_next[i]
+                    generated[slot] += 1
+                    if generated[slot] == max_new_token:
+                        self.logger.warning(
+                            f"incomplete result. hit max_new_token: {max_new_token}"
+                        )
+                if ended[i] or generated[slot] == max_new_token or interrupted:
+                    row = rows[slot]
+                    row.ids = ids_buf[slot, : generated[slot]].clone()
+                    row.hiddens = torch.stack(hiddens[slot]).narrow(0, 0, generated[slot])
+                    rows[slot], hiddens[slot] = None, []
+                    finished.append(row)
+                else:
+                    keep.append(i)
+            del idx_next
+
+            if finished:
+                if keep:
+                    index = torch.tensor(keep, device=self.device)
+                    active = active.index_select(0, index)
+                    past_key_values = self._select_cache_rows(
+                        past_key_values, index.to(self.device_gpt)
+                    )
+                    attention_mask = attention_mask.index_select(
+                        0, index.to(self.device_gpt)
+                    )
+                    # drop the positions that were only padding for the rows left
+                    lead = int(attention_mask.any(0).int().argmax())
+                    if lead > 0:
+                        past_key_values = self._pad_cache_left(past_key_values, -lead)
+                        attention_mask = attention_mask.narrow(
+                            1, lead, attention_mask.size(1) - lead
+                        )
+                    del index
+                else:
+                    active = active.narrow(0, 0, 0)
+                    past_key_values, attention_mask = None, None
+                yield finished
+
+            if interrupted:
+                break
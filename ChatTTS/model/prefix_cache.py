@@ -0,0 +1,82 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Hashable, Optional, Tuple, Union
+
+import torch
+
+
+@dataclass(repr=False, eq=False)
+class PrefixEntry:
+    # token ids (column 0) of the prefix, used to check every row starts with it
+    ids: torch.Tensor
+    # per-layer (key, value) of a 1-row batch, shape (1, heads, len(ids), head_dim)
+    kv: Tuple[Tuple[torch.Tensor, torch.Tensor], ...]
+
+    @property
+    def nbytes(self) -> int:
+        return self.ids.numel() * self.ids.element_size() + sum(
+            t.numel() * t.element_size() for layer in self.kv for t in layer
+        )
+
+
+class PrefixCache:
+    """
+    LRU of the GPT KV state of code prompt prefixes
+    (``[Stts][spk_emb]{txt_smp}{prompt}``), bounded by ``max_bytes``.
+
+    The prefix only depends on the speaker embedding and the prompts, so
+    every utterance of the same voice can start generating from a copy of
+    it instead of prefilling those tokens again. ``max_bytes=0`` disables it.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Hashable, PrefixEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(
+        spk_emb: Optional[Union[str, torch.Tensor]], prefix: str
+    ) -> Tuple[Hashable, str]:
+        if isinstance(spk_emb, torch.Tensor):
+            spk_emb = hashlib.sha1(
+                spk_emb.detach().to("cpu", torch.float32).numpy().tobytes()
+            ).hexdigest()
+        return spk_emb, prefix
+
+    def get(self, key: Hashable) -> Optional[PrefixEntry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: Hashable, entry: PrefixEntry):
+        size = entry.nbytes
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.nbytes -= old.nbytes
+            self._entries[key] = entry
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
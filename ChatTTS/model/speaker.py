@@ -1,5 +1,8 @@
+import hashlib
 import lzma
-from typing import List, Optional, Union
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple, Union
 
 import pybase16384 as b14
 import numpy as np
@@ -8,12 +11,22 @@ import torch.nn.functional as F
 
 
 class Speaker:
-    def __init__(self, dim: int, spk_cfg: str, device=torch.device("cpu")) -> None:
+    def __init__(
+        self,
+        dim: int,
+        spk_cfg: str,
+        device=torch.device("cpu"),
+        cache_size: int = 16,
+    ) -> None:
         spk_stat = torch.from_numpy(
             np.frombuffer(b14.decode_from_string(spk_cfg), dtype=np.float16).copy()
         ).to(device=device)
         self.std, self.mean = spk_stat.requires_grad_(False).chunk(2)
         self.dim = dim
+        # normalized embeddings of encoded speakers, by (sha1 of the string, device)
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[Tuple[bytes, str], torch.Tensor]" = OrderedDict()
+        self._cache_lock = threading.Lock()
 
     def sample_random(self) -> str:
         return self._encode(self._sample_random())
@@ -28,21 +41,11 @@ class Speaker:
         device: torch.device,
         inplace: bool = True,
     ) -> torch.Tensor:
-        if isinstance(spk_emb, str):
-            spk_emb_tensor = torch.from_numpy(self._decode(spk_emb))
-        else:
-            spk_emb_tensor = spk_emb
         n = (
-            F.normalize(
-                spk_emb_tensor,
-                p=2.0,
-                dim=0,
-                eps=1e-12,
-            )
-            .to(device)
-            .unsqueeze_(0)
+            self.prepare(spk_emb, device)
+            .unsqueeze(0)
             .expand(emb.size(0), -1)
-            .unsqueeze_(1)
+            .unsqueeze(1)
             .expand(emb.shape)
         )
         cond = input_ids.narrow(-1, 0, 1).eq(spk_emb_ids).expand(emb.shape)
@@ -51,6 +54,42 @@ class Speaker:
             del cond, n
         return out
 
+    @torch.no_grad()
+    def prepare(
+        self, spk_emb: Union[str, torch.Tensor], device: torch.device
+    ) -> torch.Tensor:
+        """
+        Returns the normalized speaker embedding on ``device``.
+
+        Encoded strings are decoded once and kept in an LRU of ``cache_size``
+        entries, so repeated calls with the same speaker skip the LZMA decode.
+        Callers may also pass the returned tensor back in place of the string.
+        """
+        if not isinstance(spk_emb, str):
+            return self._normalize(spk_emb, device)
+        key = (hashlib.sha1(spk_emb.encode()).digest(), str(device))
+        with self._cache_lock:
+            n = self._cache.get(key)
+            if n is not None:
+                self._cache.move_to_end(key)
+                return n
+        n = self._normalize(torch.from_numpy(self._decode(spk_emb)), device)
+        if self.cache_size > 0:
+            with self._cache_lock:
+                self._cache[key] = n
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return n
+
+    @staticmethod
+    def _normalize(spk_emb: torch.Tensor, device: torch.device) -> torch.Tensor:
+        return F.normalize(
+            spk_emb,
+            p=2.0,
+            dim=0,
+            eps=1e-12,
+        ).to(device)
+
     @staticmethod
     @torch.no_grad()
     def decorate_code_prompts(
@@ -81,6 +120,17 @@ class Speaker:
 
         return text
 
+    @staticmethod
+    def code_prompt_prefix(
+        prompt: str,
+        txt_smp: Optional[str],
+        spk_emb: Optional[str],
+    ) -> str:
+        """The part that decorate_code_prompts puts in front of every text."""
+        txt_smp = "" if txt_smp is None else txt_smp
+        spk = "[spk_emb]" if spk_emb is not None else "[empty_spk]"
+        return f"[Stts]{spk}{txt_smp}{prompt or ''}"
+
     @staticmethod
     @torch.no_grad()
     def decorate_text_prompts(text: List[str], prompt: str) -> List[str]:
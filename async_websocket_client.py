@@ -0,0 +1,182 @@
+# async_websocket_client.py
+import asyncio
+import threading
+import aiohttp
+import config
+from websocket_client import receive_frame, build_ack, build_wss_url, build_headers
+from ingest_pipeline import IngestPipeline
+from room_resolver import get_resolver
+from frame_capture import open_capture
+from reconnect import ConnectionHealth, ReconnectBackoff, plan_reconnect
+from message_dedup import MessageDedup
+from utils import get_signer
+from logger import log
+
+class RoomSession:
+    """State for one live room watched by MultiRoomClient."""
+
+    def __init__(self, live_id, on_message_callback):
+        self.live_id = live_id
+        self.on_message_callback = on_message_callback
+        self.room_id = None
+        self.task = None
+        self.ws = None
+        self.connected = False
+        self.health = ConnectionHealth(live_id)
+        self.backoff = ReconnectBackoff()
+        self.dedup = MessageDedup()
+        self.recorder = open_capture(live_id)
+
+class MultiRoomClient:
+    """Watches many live rooms from a single asyncio event loop.
+
+    Every room runs as one coroutine that connects, acks, detects heartbeat
+    timeouts and reconnects, so the thread count does not grow with rooms.
+    """
+
+    def __init__(self, on_message_callback, pipeline=None):
+        self.on_message_callback = on_message_callback
+        self.pipeline = pipeline or IngestPipeline()
+        self.rooms = {}
+        self.loop = asyncio.new_event_loop()
+        self.thread = None
+        self._session = None
+        self._connect_semaphore = None
+
+    def start(self):
+        if self.thread and self.thread.is_alive():
+            return
+        self.pipeline.start()
+        self.thread = threading.Thread(target=self._start_event_loop, daemon=True)
+        self.thread.start()
+
+    def _start_event_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self._connect_semaphore = asyncio.Semaphore(config.MAX_CONCURRENT_CONNECTS)
+        self.loop.run_in_executor(None, get_signer().warm_up)
+        self.loop.run_forever()
+
+    def stop(self):
+        if not self.thread:
+            return
+        future = asyncio.run_coroutine_threadsafe(self._shutdown(), self.loop)
+        future.result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.thread = None
+        self.pipeline.stop()
+
+    def add_room(self, live_id, on_message_callback=None):
+        self.start()
+        callback = on_message_callback or self.on_message_callback
+        return asyncio.run_coroutine_threadsafe(self._add_room(live_id, callback), self.loop).result()
+
+    def remove_room(self, live_id):
+        if not self.thread:
+            return
+        asyncio.run_coroutine_threadsafe(self._remove_room(live_id), self.loop).result()
+
+    def remove_all_rooms(self):
+        for live_id in list(self.rooms):
+            self.remove_room(live_id)
+
+    def health(self):
+        """Returns {live_id: connection metrics} for every watched room."""
+        return {live_id: room.health.snapshot() for live_id, room in list(self.rooms.items())}
+
+    async def _add_room(self, live_id, callback):
+        if live_id in self.rooms:
+            return self.rooms[live_id]
+        room = RoomSession(live_id, callback)
+        room.task = asyncio.create_task(self._run_room(room))
+        self.rooms[live_id] = room
+        log.info(f"Watching live room {live_id} ({len(self.rooms)} rooms)")
+        return room
+
+    async def _remove_room(self, live_id):
+        room = self.rooms.pop(live_id, None)
+        if room is None:
+            return
+        room.task.cancel()
+        try:
+            await room.task
+        except asyncio.CancelledError:
+            pass
+        if room.recorder:
+            room.recorder.close()
+        log.info(f"Stopped watching live room {live_id}")
+
+    async def _shutdown(self):
+        for live_id in list(self.rooms):
+            await self._remove_room(live_id)
+        if self._session:
+            await self._session.close()
+            self._session = None
+
+    async def _get_session(self):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=0),
+                timeout=aiohttp.ClientTimeout(total=None, sock_connect=config.MESSAGE_TIMEOUT),
+            )
+        return self._session
+
+    async def _resolve(self, room):
+        loop = asyncio.get_running_loop()
+        resolver = get_resolver()
+        ttwid = await loop.run_in_executor(None, resolver.get_ttwid)
+        if not room.room_id:
+            room.room_id = await loop.run_in_executor(None, resolver.get_room_id, room.live_id)
+        if not room.room_id:
+            raise ConnectionError(f"Could not resolve room_id for live ID {room.live_id}")
+        wss_url = await loop.run_in_executor(None, build_wss_url, room.room_id)
+        return wss_url, build_headers(ttwid)
+
+    async def _run_room(self, room):
+        while True:
+            if room.backoff.attempting():
+                # The trial after a pause re-resolves the room; the broadcast may have restarted
+                get_resolver().invalidate(room.live_id)
+                room.room_id = None
+            room.health.on_attempt()
+            try:
+                async with self._connect_semaphore:
+                    wss_url, headers = await self._resolve(room)
+                    session = await self._get_session()
+                    log.info(f"[{room.live_id}] Attempting to connect to WebSocket...")
+                    room.ws = await session.ws_connect(wss_url, headers=headers)
+                room.health.on_connected()
+                log.info(f"[{room.live_id}] WebSocket connected in {room.health.connect_latency * 1000:.0f} ms.")
+                room.connected = True
+                await self._receive_loop(room)
+            except asyncio.CancelledError:
+                raise
+            except asyncio.TimeoutError:
+                log.warning(f"[{room.live_id}] No message received for {config.MESSAGE_TIMEOUT} seconds, reconnecting...")
+            except Exception as e:
+                log.error(f"[{room.live_id}] Connection failed: {e}")
+            finally:
+                room.connected = False
+                if room.ws is not None:
+                    await room.ws.close()
+                    room.ws = None
+            await asyncio.sleep(plan_reconnect(room.health, room.backoff, room.live_id))
+
+    async def _receive_loop(self, room):
+        ws = room.ws
+        while True:
+            msg = await asyncio.wait_for(ws.receive(), timeout=config.MESSAGE_TIMEOUT)
+            if msg.type == aiohttp.WSMsgType.BINARY:
+                if room.recorder:
+                    room.recorder.record(msg.data)
+                log_id, response_bytes, need_ack, internal_ext = receive_frame(msg.data)
+                if need_ack:
+                    await ws.send_bytes(build_ack(log_id, internal_ext))
+                    room.health.on_ack()
+                await self.pipeline.submit_async(response_bytes, room.on_message_callback, room.dedup)
+            elif msg.type in (aiohttp.WSMsgType.CLOSE, aiohttp.WSMsgType.CLOSING, aiohttp.WSMsgType.CLOSED):
+                log.info(f"[{room.live_id}] WebSocket connection closed.")
+                return
+            elif msg.type == aiohttp.WSMsgType.ERROR:
+                log.error(f"[{room.live_id}] WebSocket error: {ws.exception()}")
+                return
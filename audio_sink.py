@@ -0,0 +1,460 @@
+# audio_sink.py
+import io
+import os
+import threading
+import time
+import numpy as np
+import soundfile as sf
+import config
+from logger import log
+
+# MPEG audio layer III header tables, indexed by the header's version bits
+MP3_BITRATES = {
+    3: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),  # MPEG-1
+    2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),     # MPEG-2
+    0: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),     # MPEG-2.5
+}
+MP3_SAMPLERATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+# Frames decoded again in front of new ones so the bit reservoir and the
+# synthesis filterbank start from the same state as in a whole-clip decode
+MP3_CONTEXT_FRAMES = 10
+MP3_MIN_FIRST_FRAMES = 4
+
+def parse_mp3_header(buf, pos):
+    """Returns (frame length, samples per frame, samplerate, channels) or None if buf[pos:] is not a frame header."""
+    if pos + 4 > len(buf):
+        return None
+    header = int.from_bytes(buf[pos:pos + 4], 'big')
+    if header >> 21 != 0x7FF:
+        return None
+    version = (header >> 19) & 3
+    layer = (header >> 17) & 3
+    bitrate_index = (header >> 12) & 15
+    samplerate_index = (header >> 10) & 3
+    if version == 1 or layer != 1 or bitrate_index in (0, 15) or samplerate_index == 3:
+        return None
+    bitrate = MP3_BITRATES[version][bitrate_index] * 1000
+    samplerate = MP3_SAMPLERATES[version][samplerate_index]
+    padding = (header >> 9) & 1
+    channels = 1 if (header >> 6) & 3 == 3 else 2
+    if version == 3:
+        return 144 * bitrate // samplerate + padding, 1152, samplerate, channels
+    return 72 * bitrate // samplerate + padding, 576, samplerate, channels
+
+def mp3_side_info(buf, pos):
+    """Returns (offset, size) of the side info of the layer III frame at pos."""
+    header = int.from_bytes(buf[pos:pos + 4], 'big')
+    offset = pos + 4 if header >> 16 & 1 else pos + 6  # protection bit clear means a CRC follows
+    mono = (header >> 6) & 3 == 3
+    if (header >> 19) & 3 == 3:
+        return offset, 17 if mono else 32
+    return offset, 9 if mono else 17
+
+def mp3_main_data_begin(buf, pos):
+    """Returns how many bytes of earlier frames (bit reservoir) the layer III frame at pos needs."""
+    side_info, _ = mp3_side_info(buf, pos)
+    if (buf[pos + 1] >> 3) & 3 == 3:
+        return int.from_bytes(buf[side_info:side_info + 2], 'big') >> 7
+    return buf[side_info]
+
+def mp3_silent_frames(header, reservoir=b''):
+    """Builds silent layer III frames like the one whose header is given, with main data ending in ``reservoir``.
+
+    Placed in front of a frame that borrows ``len(reservoir)`` bytes from
+    earlier frames, they hand it those bytes: every granule is empty, so
+    they decode to silence and leave the bytes unread. libmpg123 only steps
+    back into the previous frame's buffer, so when the reservoir does not
+    fit in one frame each frame's main_data_begin points into the one before.
+    Without a reservoir this is a single empty frame.
+    """
+    header = bytearray(header[:4])
+    header[1] |= 1  # no CRC, the zeroed side info would not match one
+    length = parse_mp3_header(header, 0)[0]
+    _, side_size = mp3_side_info(header, 0)
+    mpeg1 = (header[1] >> 3) & 3 == 3
+    step = min(length - 4 - side_size, 511 if mpeg1 else 255)
+    pieces = [reservoir[max(0, end - step):end] for end in range(len(reservoir), 0, -step)][::-1] or [b'']
+    frames = bytearray()
+    back = 0
+    for piece in pieces:
+        side_info = bytearray(side_size)
+        if mpeg1:
+            side_info[:2] = (back << 7).to_bytes(2, 'big')
+        else:
+            side_info[0] = back
+        frames += header + side_info + bytes(length - 4 - side_size - len(piece)) + piece
+        back = len(piece)
+    return bytes(frames)
+
+def mp3_samples(buf):
+    """Returns the number of samples per channel of the MP3 frames in buf."""
+    pos = 0
+    total = 0
+    while pos + 4 <= len(buf):
+        header = parse_mp3_header(buf, pos)
+        if header is None:
+            pos += 1
+            continue
+        total += header[1]
+        pos += header[0]
+    return total
+
+def mp3_is_tag_frame(buf, pos):
+    """Whether the frame at pos is a Xing/Info (LAME) tag frame, which holds stream info instead of audio."""
+    side_info, side_size = mp3_side_info(buf, pos)
+    return buf[side_info + side_size:side_info + side_size + 4] in (b'Xing', b'Info')
+
+def decode_audio(data):
+    """Decodes a complete in-memory clip (edge-tts MP3) to (float32 samples, samplerate)."""
+    samples, samplerate = sf.read(io.BytesIO(data), dtype='float32')
+    return samples, samplerate
+
+class Mp3StreamDecoder:
+    """Decodes an MP3 byte stream as it arrives.
+
+    ``feed`` returns the PCM of every frame completed by the new bytes (or
+    None). Each batch is decoded together with ``context_frames`` frames
+    before it and only the new frames' samples are kept. The bytes the first
+    context frame borrows from the bit reservoir are handed to it in silent
+    frames (see mp3_silent_frames), so libmpg123 never decodes a frame
+    with missing data and stays quiet on stderr. A Xing/Info tag frame is
+    only decoded with the first batch, where libmpg123 drops the encoder
+    delay as it does for the whole clip; the encoder padding at the end is
+    kept. For constant bitrate streams such as edge-tts output this matches
+    decoding the whole clip at once to within float rounding. Only CBR is
+    sample-exact: libsndfile guesses the length of a segment from its size
+    and first bitrate, so VBR segments are cut short and diverge.
+    ``flush`` decodes whatever is left at the end of the stream.
+    """
+
+    def __init__(self, context_frames=MP3_CONTEXT_FRAMES, min_first_frames=MP3_MIN_FIRST_FRAMES):
+        self.context_frames = context_frames
+        self.min_first_frames = min_first_frames
+        self.samplerate = None
+        self.channels = None
+        self._buf = bytearray()
+        self._frames = []  # (offset, length, samples, main_data_begin) of complete frames in _buf
+        self._scan = 0
+        self._decoded = 0  # number of leading entries in _frames already returned
+        self._started = False
+        self._tag = False  # _frames[0] is a Xing/Info tag frame
+
+    def feed(self, data):
+        self._buf += data
+        self._find_frames()
+        if not self._started and len(self._frames) < self.min_first_frames:
+            return None
+        return self._decode_new()
+
+    def flush(self):
+        self._find_frames()
+        return self._decode_new()
+
+    def _find_frames(self):
+        buf = self._buf
+        pos = self._scan
+        if pos == 0 and buf[:3] == b'ID3':
+            if len(buf) < 10:
+                return
+            pos = 10 + (buf[6] << 21 | buf[7] << 14 | buf[8] << 7 | buf[9])
+        while pos + 4 <= len(buf):
+            header = parse_mp3_header(buf, pos)
+            if header is None:
+                pos += 1
+                continue
+            length, samples, samplerate, channels = header
+            if pos + length > len(buf):
+                break
+            if self.samplerate is None:
+                self.samplerate, self.channels = samplerate, channels
+            if not self._started and not self._frames and mp3_is_tag_frame(buf, pos):
+                self._tag = True
+                samples = 0
+            self._frames.append((pos, length, samples, mp3_main_data_begin(buf, pos)))
+            pos += length
+        self._scan = pos
+
+    def _decode_new(self):
+        new = len(self._frames) - self._decoded
+        if new <= 0:
+            return None
+        first = max(0, self._decoded - self.context_frames)
+        if self._tag and self._started:
+            # a decode that includes the tag frame drops the encoder delay, so
+            # only the first one does; later ones start at the first audio frame
+            first = max(first, 1)
+        start = self._frames[first][0]
+        last_offset, last_length = self._frames[-1][:2]
+        if self._tag and first == 0:
+            # the tag gives libsndfile the length, and every sample is new
+            segment = bytearray(self._buf[start:last_offset + last_length])
+            side_info, side_size = mp3_side_info(segment, 0)
+            xing = side_info + side_size
+            flags = int.from_bytes(segment[xing + 4:xing + 8], 'big')
+            if flags & 2:
+                # the stream size in the tag is the whole clip's; libmpg123 warns when it is off
+                size = xing + (12 if flags & 1 else 8)
+                segment[size:size + 4] = len(segment).to_bytes(4, 'big')
+            samples, _ = sf.read(io.BytesIO(bytes(segment)), dtype='float32')
+        else:
+            reservoir = self._reservoir(first)
+            # libsndfile guesses the length of a headerless segment from its size and
+            # stops reading there; a trailing empty frame keeps the guess past the real frames
+            end = mp3_silent_frames(self._buf[last_offset:last_offset + 4])
+            segment = reservoir + self._buf[start:last_offset + last_length] + end
+            samples, _ = sf.read(io.BytesIO(segment), dtype='float32')
+            skip = mp3_samples(reservoir) + sum(frame[2] for frame in self._frames[first:self._decoded])
+            wanted = sum(frame[2] for frame in self._frames[self._decoded:])
+            samples = samples[skip:skip + wanted]
+        self._started = True
+        self._decoded = len(self._frames)
+        self._trim()
+        return samples
+
+    def _reservoir(self, first):
+        """Silent frames carrying the bit reservoir that frame ``first`` borrows from the frames before it."""
+        offset, _, _, backlog = self._frames[first]
+        main_data = bytearray()
+        index = first
+        while len(main_data) < backlog and index > 0:
+            index -= 1
+            pos, length = self._frames[index][:2]
+            side_info, side_size = mp3_side_info(self._buf, pos)
+            main_data[:0] = self._buf[side_info + side_size:pos + length]
+        if not backlog or len(main_data) < backlog:
+            return b''
+        return mp3_silent_frames(self._buf[offset:offset + 4], bytes(main_data[-backlog:]))
+
+    def _trim(self):
+        keep = max(0, self._decoded - 2 * self.context_frames)
+        if keep == 0:
+            return
+        cut = self._frames[keep][0] if keep < len(self._frames) else self._scan
+        del self._buf[:cut]
+        self._tag = False
+        self._frames = [(frame[0] - cut,) + frame[1:] for frame in self._frames[keep:]]
+        self._decoded -= keep
+        self._scan -= cut
+
+class RingBuffer:
+    """Fixed-size float32 FIFO between a writer thread and an audio callback.
+
+    ``write`` blocks while the buffer is full; ``read_into`` never blocks and
+    returns how many frames it copied.
+    """
+
+    def __init__(self, frames, channels):
+        self.capacity = frames
+        self._data = np.zeros((frames, channels), dtype='float32')
+        self._read = 0
+        self._size = 0
+        self._cond = threading.Condition()
+
+    def __len__(self):
+        return self._size
+
+    def write(self, samples):
+        capacity = len(self._data)
+        samples = samples.reshape(len(samples), -1)
+        offset = 0
+        while offset < len(samples):
+            with self._cond:
+                self._cond.wait_for(lambda: self._size < capacity)
+                count = min(len(samples) - offset, capacity - self._size)
+                start = (self._read + self._size) % capacity
+                head = min(count, capacity - start)
+                self._data[start:start + head] = samples[offset:offset + head]
+                self._data[:count - head] = samples[offset + head:offset + count]
+                self._size += count
+            offset += count
+
+    def read_into(self, out):
+        capacity = len(self._data)
+        with self._cond:
+            count = min(len(out), self._size)
+            head = min(count, capacity - self._read)
+            out[:head] = self._data[self._read:self._read + head]
+            out[head:count] = self._data[:count - head]
+            self._read = (self._read + count) % capacity
+            self._size -= count
+            self._cond.notify_all()
+        return count
+
+class BufferedStream:
+    """Streaming interface for sinks that can only play whole clips."""
+
+    def __init__(self, sink, samplerate):
+        self.sink = sink
+        self.samplerate = samplerate
+        self._blocks = []
+
+    def write(self, samples):
+        self._blocks.append(samples)
+
+    def finish(self):
+        if self._blocks:
+            self.sink.play(np.concatenate(self._blocks), self.samplerate)
+            self._blocks = []
+
+    def close(self):
+        self._blocks = []
+
+class SoundDeviceStream:
+    """PortAudio output stream fed from a RingBuffer while the clip is still being decoded."""
+
+    def __init__(self, sd, samplerate, channels, device=None, buffer_seconds=None):
+        self._sd = sd
+        buffer_seconds = buffer_seconds or config.AUDIO_RING_SECONDS
+        self._ring = RingBuffer(int(samplerate * buffer_seconds), channels)
+        self._eof = False
+        self._done = threading.Event()
+        self.underruns = 0
+        self._stream = sd.OutputStream(
+            samplerate=samplerate, channels=channels, dtype='float32', device=device,
+            callback=self._callback, finished_callback=self._done.set,
+        )
+        self._started = False
+
+    def _callback(self, outdata, frames, time_info, status):
+        count = self._ring.read_into(outdata)
+        if count < frames:
+            outdata[count:] = 0
+            if self._eof:
+                raise self._sd.CallbackStop
+            self.underruns += 1
+
+    def write(self, samples):
+        if not self._started:
+            # Prime the buffer before starting so playback does not begin with an underrun
+            head = samples[:self._ring.capacity]
+            self._ring.write(head)
+            self._started = True
+            self._stream.start()
+            samples = samples[len(head):]
+        if len(samples):
+            self._ring.write(samples)
+
+    def finish(self):
+        """Blocks until everything written so far has been played."""
+        self._eof = True
+        if self._started:
+            self._done.wait()
+        self.close()
+        if self.underruns:
+            log.warning(f"Audio stream ran dry {self.underruns} times")
+
+    def close(self):
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+
+class AudioSink:
+    """Destination for decoded PCM. ``play`` blocks until the clip is done.
+
+    ``open_stream`` returns an object with ``write(samples)``, ``finish()``
+    and ``close()`` for clips that are played while they are still being
+    decoded; by default the blocks are collected and played whole.
+    """
+
+    def play(self, samples, samplerate):
+        raise NotImplementedError
+
+    def open_stream(self, samplerate, channels):
+        return BufferedStream(self, samplerate)
+
+    def close(self):
+        pass
+
+class SoundDeviceSink(AudioSink):
+    """Plays through PortAudio, the same path as ``txt_speak.play_audio``."""
+
+    def __init__(self, device=None):
+        # Imported here so the other sinks work on machines without PortAudio
+        import sounddevice as sd
+        self._sd = sd
+        self.device = device
+
+    def play(self, samples, samplerate):
+        self._sd.play(samples, samplerate, device=self.device)
+        self._sd.wait()
+
+    def open_stream(self, samplerate, channels):
+        return SoundDeviceStream(self._sd, samplerate, channels, self.device)
+
+class NullSink(AudioSink):
+    """Discards audio and only counts it.
+
+    With ``realtime`` it takes as long as a device would to play the audio,
+    which keeps playback pacing realistic in load tests.
+    """
+
+    def __init__(self, realtime=False):
+        self.realtime = realtime
+        self.clips = 0
+        self.seconds = 0.0
+        self.underruns = 0
+
+    def play(self, samples, samplerate):
+        self.clips += 1
+        self.seconds += len(samples) / samplerate
+        if self.realtime:
+            time.sleep(len(samples) / samplerate)
+
+    def open_stream(self, samplerate, channels):
+        if self.realtime:
+            return ClockStream(self, samplerate)
+        return BufferedStream(self, samplerate)
+
+class ClockStream:
+    """Stream of a realtime NullSink: audio "plays" at real-time speed from the first write."""
+
+    def __init__(self, sink, samplerate):
+        self.sink = sink
+        self.samplerate = samplerate
+        self._end = None
+
+    def write(self, samples):
+        now = time.monotonic()
+        if self._end is None:
+            self._end = now
+        elif now > self._end:
+            self.sink.underruns += 1
+            self._end = now
+        duration = len(samples) / self.samplerate
+        self._end += duration
+        self.sink.seconds += duration
+
+    def finish(self):
+        if self._end is not None:
+            time.sleep(max(0.0, self._end - time.monotonic()))
+            self.sink.clips += 1
+
+    def close(self):
+        pass
+
+class WavWriterSink(AudioSink):
+    """Writes every clip to ``<directory>/clip_<n>.wav`` instead of playing it."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.clips = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def play(self, samples, samplerate):
+        with self._lock:
+            self.clips += 1
+            path = os.path.join(self.directory, f"clip_{self.clips:05d}.wav")
+        sf.write(path, samples, samplerate)
+        log.info(f"Wrote {len(samples) / samplerate:.2f} s of audio to {path}")
+
+def create_sink(name=None):
+    """Builds the sink named by ``name`` or AUDIO_SINK: sounddevice, null or wav."""
+    name = name or config.AUDIO_SINK
+    if name == 'sounddevice':
+        return SoundDeviceSink(config.AUDIO_OUTPUT_DEVICE)
+    if name == 'null':
+        return NullSink()
+    if name == 'wav':
+        return WavWriterSink(config.AUDIO_OUTPUT_DIR)
+    raise ValueError(f"Unknown audio sink: {name}")
@@ -0,0 +1,185 @@
+# benchmark.py
+"""Ingest throughput benchmark driven by synthetic PushFrames.
+
+Pushes generated frames through the same stages a live connection uses
+(frame + gzip decompress, Response decode, MessageHandler dispatch) into a
+counting TTS stand-in, and reports throughput and p50/p99 per-stage
+latency. Memory is measured in a separate pass over ``--memory-frames``
+frames with a fresh handler: peak traced memory per message and
+tracemalloc blocks still held afterwards. tracemalloc never runs during
+the timed loop; it slows every allocation down.
+
+The full and lazy modes decode each message payload with betterproto in
+the handler, about 2.5 ms per message here, so the defaults keep the
+frame counts small; raise ``--frames`` for steadier percentiles.
+
+    python benchmark.py --mix chat=70,member=20,gift=5,like=5 --room-sizes 5,20,80 --frames 30
+"""
+import argparse
+import gzip
+import logging
+import time
+import tracemalloc
+import config
+from frame_capture import CountingTTS
+from message_handler import MessageHandler
+from protobuf.douyin import PushFrame, Response
+from protobuf.synthetic import build_frame, make_rng
+from protobuf.wire import scan_push_frame, scan_response
+from logger import log
+
+# name -> (LAZY_DECODE, FAST_DECODE)
+MODES = {
+    'full': (False, False),
+    'lazy': (True, False),
+    'fast': (True, True),
+}
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        kind, weight = part.split('=')
+        mix[kind.strip()] = float(weight)
+    return mix
+
+
+def build_frames(mix, messages_per_frame, count, seed=0):
+    rng = make_rng(seed)
+    kinds = list(mix)
+    weights = [mix[kind] for kind in kinds]
+    return [
+        build_frame(rng.choices(kinds, weights, k=messages_per_frame), rng, log_id=i)
+        for i in range(count)
+    ]
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def make_handler():
+    tts = CountingTTS()
+    handler = MessageHandler(tts, lambda count: None)
+    handler.speech_enabled = handler.gift_enabled = handler.follow_enabled = handler.welcome_enabled = True
+    return handler, tts
+
+
+def process_frame(frame, handler, lazy, timings):
+    t0 = time.perf_counter()
+    if lazy:
+        payload = gzip.decompress(scan_push_frame(frame).payload)
+    else:
+        payload = gzip.decompress(PushFrame().parse(frame).payload)
+    t1 = time.perf_counter()
+    response = scan_response(payload) if lazy else Response().parse(payload)
+    t2 = time.perf_counter()
+    for message in response.messages_list:
+        handler.handle_message(message.method, message.payload)
+    t3 = time.perf_counter()
+    timings['decompress'].append(t1 - t0)
+    timings['decode'].append(t2 - t1)
+    timings['dispatch'].append(t3 - t2)
+    timings['total'].append(t3 - t0)
+    return len(response.messages_list)
+
+
+def new_timings():
+    return {name: [] for name in ('decompress', 'decode', 'dispatch', 'total')}
+
+
+def warm_up(mode, frames):
+    """Selects ``mode`` and returns a handler that has already processed a few frames."""
+    config.LAZY_DECODE, config.FAST_DECODE = MODES[mode]
+    handler, tts = make_handler()
+    for frame in frames[:min(len(frames), 5)]:
+        process_frame(frame, handler, config.LAZY_DECODE, new_timings())
+    return handler, tts
+
+
+def run_mode(mode, frames, iterations):
+    handler, tts = warm_up(mode, frames)
+    if tracemalloc.is_tracing():
+        # e.g. started by PYTHONTRACEMALLOC; it would be timed along with the frames
+        log.warning("Stopping tracemalloc for the timed loop")
+        tracemalloc.stop()
+
+    timings = new_timings()
+    messages = 0
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for frame in frames:
+            messages += process_frame(frame, handler, config.LAZY_DECODE, timings)
+    elapsed = time.perf_counter() - start
+
+    return {
+        'mode': mode,
+        'frames_per_s': len(timings['total']) / elapsed,
+        'messages_per_s': messages / elapsed,
+        'stages': {name: (percentile(values, 0.5), percentile(values, 0.99)) for name, values in timings.items()},
+        'tts_tasks': tts.tasks,
+    }
+
+
+def measure_memory(mode, frames):
+    """Separate traced pass: peak KiB and retained tracemalloc blocks per message."""
+    handler, _ = warm_up(mode, frames)
+    tracemalloc.start()
+    messages = 0
+    scratch = new_timings()
+    for frame in frames:
+        messages += process_frame(frame, handler, config.LAZY_DECODE, scratch)
+    _, peak = tracemalloc.get_traced_memory()
+    snapshot = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    blocks = sum(stat.count for stat in snapshot.statistics('filename'))
+    return {
+        'peak_kib_per_message': peak / 1024 / max(messages, 1),
+        'retained_blocks_per_message': blocks / max(messages, 1),
+    }
+
+
+def print_result(room_size, result):
+    memory = ''
+    if 'peak_kib_per_message' in result:
+        memory = (f", peak {result['peak_kib_per_message']:.2f} KiB/message, "
+                  f"{result['retained_blocks_per_message']:.1f} retained blocks/message")
+    print(f"\n[{result['mode']}] {room_size} messages/frame: "
+          f"{result['frames_per_s']:.0f} frames/s, {result['messages_per_s']:.0f} messages/s{memory}")
+    for name, (p50, p99) in result['stages'].items():
+        print(f"    {name:<10} p50 {p50 * 1e6:9.1f} us   p99 {p99 * 1e6:9.1f} us")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mix', default='chat=70,member=20,gift=5,like=5')
+    parser.add_argument('--room-sizes', default='5,20,80', help="messages per frame to benchmark")
+    parser.add_argument('--frames', type=int, default=20, help="distinct frames generated per room size")
+    parser.add_argument('--iterations', type=int, default=1)
+    parser.add_argument('--memory-frames', type=int, default=5,
+                        help="frames of the separate tracemalloc pass, 0 to skip it")
+    parser.add_argument('--modes', default=','.join(MODES))
+    parser.add_argument('--log', action='store_true', help="keep MessageHandler logging enabled")
+    args = parser.parse_args()
+
+    if not args.log:
+        logging.getLogger().setLevel(logging.WARNING)
+    mix = parse_mix(args.mix)
+    saved = config.LAZY_DECODE, config.FAST_DECODE
+    try:
+        for room_size in (int(size) for size in args.room_sizes.split(',')):
+            frames = build_frames(mix, room_size, args.frames)
+            for mode in args.modes.split(','):
+                result = run_mode(mode, frames, args.iterations)
+                if args.memory_frames:
+                    result.update(measure_memory(mode, frames[:args.memory_frames]))
+                print_result(room_size, result)
+    finally:
+        config.LAZY_DECODE, config.FAST_DECODE = saved
+        log.setLevel(logging.INFO)
+
+
+if __name__ == '__main__':
+    main()
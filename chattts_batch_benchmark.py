@@ -0,0 +1,127 @@
+# chattts_batch_benchmark.py
+"""CPU benchmark of ChatTTSServer throughput by batch size.
+
+Builds a Chat around a small random-weight GPT (``--layers`` Llama layers
+at the real hidden size, so Speaker and the prompts work unchanged), a
+tokenizer over the characters of the test sentences and the random DVAE
+decoder and Vocos of chattts_stream_benchmark.py. Random logits end an
+utterance at a random length, so every batch mixes short and long rows.
+For each ``--batch`` value, ``--utterances`` requests of one speaker are
+submitted ``--interval`` seconds apart and the server generates up to
+that many at once, admitting queued requests as rows finish. Reports
+utterances/s, the mean rows per decode step, the mean latency from
+submit to result and the time until the last result, against max_batch 1.
+
+    python chattts_batch_benchmark.py --batch 1,2,4,8 --utterances 16 --layers 2 --interval 0.2
+"""
+import argparse
+import logging
+import os
+import tempfile
+import time
+import torch
+from transformers import BertTokenizerFast, LlamaModel
+from ChatTTS.core import Chat
+from ChatTTS.model import GPT, Embed, Speaker, Tokenizer
+from chattts_server import ChatTTSServer
+from chattts_stream_benchmark import build_chat
+
+SENTENCES = [
+    "欢迎来到直播间", "谢谢老板送的礼物", "主播今天唱什么歌", "大家晚上好",
+    "点点关注不迷路", "这个游戏好难啊", "感谢家人们的支持", "明天见",
+]
+SPECIAL_TOKENS = ["[Stts]", "[Ptts]", "[spk_emb]", "[empty_spk]", "[speed_5]", "[break_0]", "[Ebreak]"]
+
+
+def build_tokenizer(directory):
+    """A BertTokenizerFast over the special tokens and the characters of SENTENCES, saved for Tokenizer."""
+    characters = sorted(set(''.join(SENTENCES)))
+    vocab_path = os.path.join(directory, 'vocab.txt')
+    with open(vocab_path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + characters) + '\n')
+    tokenizer = BertTokenizerFast(vocab_file=vocab_path, do_lower_case=False)
+    tokenizer.add_tokens(SPECIAL_TOKENS, special_tokens=True)
+    tokenizer.save_pretrained(directory)
+    return Tokenizer(directory)
+
+
+def build_tiny_chat(layers=2, intermediate_size=1024, seed=0):
+    """A Chat with random weights and ``layers`` GPT layers, able to run _infer_code and _decode_to_wavs."""
+    decoding = build_chat(torch.get_num_threads())
+    torch.manual_seed(seed)
+    chat = Chat(logging.getLogger("chattts-tiny"))
+    chat.device = chat.device_gpt = torch.device("cpu")
+    chat.decoder, chat.vocos = decoding.decoder, decoding.vocos
+    chat.tokenizer = build_tokenizer(tempfile.mkdtemp())
+    config = chat.config
+    config.gpt.num_hidden_layers = layers
+    config.gpt.intermediate_size = intermediate_size
+    config.gpt.num_text_tokens = config.embed.num_text_tokens = chat.tokenizer.len
+    chat.embed = Embed(
+        config.embed.hidden_size,
+        config.embed.num_audio_tokens,
+        config.embed.num_text_tokens,
+        config.embed.num_vq,
+    ).eval()
+    gpt = GPT(gpt_config=vars(config.gpt), embed=chat.embed, logger=chat.logger).eval()
+    gpt.gpt = LlamaModel(gpt.llama_config).eval()
+    del gpt.gpt.embed_tokens
+    chat.gpt = gpt
+    chat.speaker = Speaker(config.gpt.hidden_size, config.spk_stat, chat.device)
+    return chat
+
+
+def run(server, texts, spk_emb, interval=0.0):
+    """Submits texts ``interval`` apart. Returns the elapsed time, the waveforms and the mean latency."""
+    start = time.monotonic()
+    done = {}
+    futures = []
+    for i, text in enumerate(texts):
+        if i:
+            time.sleep(interval)
+        future = server.submit(text, spk_emb)
+        submitted = time.monotonic()
+        future.add_done_callback(lambda f, submitted=submitted: done.setdefault(f, time.monotonic() - submitted))
+        futures.append(future)
+    wavs = [future.result() for future in futures]
+    latency = sum(done[future] for future in futures) / len(futures)
+    return time.monotonic() - start, wavs, latency
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--batch', default='1,2,4,8', help="max_batch values to compare")
+    parser.add_argument('--utterances', type=int, default=16)
+    parser.add_argument('--layers', type=int, default=2)
+    parser.add_argument('--max-new-token', type=int, default=120, help="caps the random utterance length")
+    parser.add_argument('--interval', type=float, default=0.0, help="seconds between two submits")
+    parser.add_argument('--threads', type=int, default=torch.get_num_threads())
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.ERROR)
+    torch.set_num_threads(args.threads)
+    chat = build_tiny_chat(args.layers)
+    spk_emb = chat.sample_random_speaker()
+    texts = [SENTENCES[i % len(SENTENCES)] for i in range(args.utterances)]
+
+    warmup = ChatTTSServer(chat, max_batch=2, max_new_token=args.max_new_token)
+    warmup.start()
+    run(warmup, texts[:2], spk_emb)
+    warmup.stop()
+
+    print(f"{'batch':>5} {'utt/s':>7} {'speedup':>8} {'mean batch':>11} {'latency':>10} {'last result':>12} {'audio':>8}")
+    baseline = None
+    for max_batch in (int(batch) for batch in args.batch.split(',')):
+        server = ChatTTSServer(chat, max_batch=max_batch, max_new_token=args.max_new_token)
+        server.start()
+        elapsed, wavs, latency = run(server, texts, spk_emb, args.interval)
+        server.stop()
+        rate = len(texts) / elapsed
+        baseline = baseline or rate
+        seconds = sum(len(wav) for wav in wavs) / 24000
+        print(f"{max_batch:5d} {rate:7.2f} {rate / baseline:7.2f}x {server.mean_batch:11.1f} "
+              f"{latency * 1000:7.0f} ms {elapsed * 1000:9.0f} ms {seconds:6.1f} s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+# chattts_continuous_check.py
+"""Checks GPT.generate_continuous and ChatTTSServer on a random-weight Chat.
+
+Uses the tiny Chat of chattts_batch_benchmark.py. Rows of three speakers
+are admitted at different steps, so they join a running batch at other
+KV lengths and leave it when they end. The hiddens of every row must
+match one forward pass over its own prompt and generated ids (teacher
+forcing), with and without the cached prefix. A single row under
+manual_seed must give exactly what GPT.generate gives. The server must
+run requests of different speakers together, start a queued request
+when a slot frees, and fail a bad request alone.
+
+    python chattts_continuous_check.py --layers 2
+"""
+import argparse
+import logging
+import torch
+from chattts_batch_benchmark import SENTENCES, build_tiny_chat
+from chattts_server import ChatTTSServer, SynthesisRequest
+
+
+def teacher_forced(chat, text, spk_emb, ids):
+    """Hiddens of one forward pass over the full prompt and ``ids``, for the positions generate_continuous returns."""
+    params = chat.InferCodeParams(spk_emb=spk_emb, reuse_prefix=False)
+    emb, _, _, _ = chat._embed_code_prompts(*chat._encode_code_prompts([text], params), params)
+    gpt = chat.gpt
+    code = ids.narrow(0, 0, ids.size(0) - 1)
+    code_emb = torch.stack([gpt.emb_code[i](code[:, i]) for i in range(gpt.num_vq)], 2).sum(2)
+    emb = torch.cat((emb, code_emb.unsqueeze(0)), 1)
+    hidden = gpt.gpt(inputs_embeds=emb, position_ids=torch.arange(emb.size(1)).unsqueeze(0)).last_hidden_state
+    return hidden[0, -ids.size(0):]
+
+
+def run_schedule(server, schedule, reuse, max_new_token):
+    """Queues the (text, spk_emb) requests of ``schedule[step]`` at that step and admits them while rows are free.
+
+    Returns {request: (row, step admitted, step finished)} and the rows running before each step.
+    """
+    server.params = dict(server.params, reuse_prefix=reuse)
+    steps = []
+    admitted = {}
+    queued = []
+
+    def admit(free):
+        step = len(steps)
+        steps.append(server.max_batch - free)
+        queued.extend(schedule.get(step, ()))
+        if step > max(schedule) and not queued and free == server.max_batch:
+            return None
+        rows = [server._row(SynthesisRequest(text, spk_emb, 0.3)) for text, spk_emb in queued[:free]]
+        del queued[:free]
+        for row in rows:
+            admitted[row.tag] = step
+        return rows
+
+    finished = {}
+    for rows in server.chat.gpt.generate_continuous(admit, server.eos_token, server.max_batch,
+                                                    max_new_token=max_new_token, min_new_token=1,
+                                                    logits_processors=server.logits_processors):
+        for row in rows:
+            finished[row.tag] = (row, admitted[row.tag], len(steps) - 1)
+    return finished, steps
+
+
+def check(name, condition):
+    print(f"    {'ok  ' if condition else 'FAIL'} {name}")
+    return condition
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--layers', type=int, default=2)
+    parser.add_argument('--max-new-token', type=int, default=40)
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.ERROR)
+    torch.set_grad_enabled(False)
+
+    chat = build_tiny_chat(args.layers)
+    speakers = [chat.sample_random_speaker() for _ in range(3)]
+    server = ChatTTSServer(chat, max_batch=3)
+    schedule = {
+        0: [(SENTENCES[0], speakers[0]), (SENTENCES[7], speakers[1])],
+        3: [(SENTENCES[1], speakers[2])],
+        9: [(SENTENCES[3], speakers[0]), (SENTENCES[6], speakers[1])],
+    }
+    results = []
+
+    for reuse in (False, True):
+        print(f"generate_continuous, reuse_prefix {'on' if reuse else 'off'}")
+        finished, steps = run_schedule(server, schedule, reuse, args.max_new_token)
+        results.append(check(f"every row finished, {len(steps)} steps of up to {max(steps)} rows", len(finished) == 5))
+        joined = sorted(step for _, step, _ in finished.values() if step > 0 and steps[step] > 0)
+        results.append(check(f"rows joined a running batch at steps {joined}", len(joined) >= 3))
+        waited = sorted(step for _, step, _ in finished.values() if step > 9)
+        results.append(check(f"rows queued at step 9 started when a slot freed, at {waited}",
+                             all(step - 1 in {end for _, _, end in finished.values()} for step in waited)))
+        spans = sorted((step, end) for _, step, end in finished.values())
+        results.append(check(f"rows ran over steps {spans}", len({end for _, end in spans}) > 1))
+        results.append(check("hiddens match a teacher-forced pass over each row", all(
+            torch.allclose(row.hiddens, teacher_forced(chat, request.text, request.spk_emb, row.ids), rtol=1e-4, atol=1e-4)
+            for request, (row, _, _) in finished.items()
+        )))
+
+    print("single row against generate, manual_seed")
+    for reuse in (False, True):
+        params = chat.InferCodeParams(spk_emb=speakers[0], manual_seed=0, min_new_token=1,
+                                      max_new_token=args.max_new_token, show_tqdm=False, reuse_prefix=reuse)
+        reference = next(iter(chat._infer_code([SENTENCES[2]], False, chat.device, True, params)))
+        server.params = dict(reuse_prefix=reuse)
+        row = server._row(SynthesisRequest(SENTENCES[2], speakers[0], params.temperature))
+        rows = iter([[row]])
+        out = next(iter(chat.gpt.generate_continuous(
+            lambda free: next(rows, None) if free == 1 else [], server.eos_token, 1,
+            max_new_token=args.max_new_token, min_new_token=1,
+            logits_processors=server.logits_processors, manual_seed=0,
+        )))[0]
+        results.append(check(f"reuse_prefix {'on' if reuse else 'off'}: same {out.ids.size(0)} ids and hiddens",
+                             torch.equal(out.ids, reference.ids[0]) and
+                             torch.allclose(out.hiddens, reference.hiddens[0], rtol=1e-4, atol=1e-4)))
+
+    print("ChatTTSServer")
+    server = ChatTTSServer(chat, max_batch=2, max_new_token=args.max_new_token)
+    server.start()
+    futures = [server.submit(SENTENCES[i], speakers[i % 3]) for i in range(5)]
+    bad = server.submit(SENTENCES[0], "not a speaker")
+    wavs = [future.result(timeout=600) for future in futures]
+    results.append(check(f"5 requests of 3 speakers in 2 rows, max {server.stats['max_batch']} at once, "
+                         f"mean {server.mean_batch:.2f}",
+                         len(wavs) == 5 and all(len(wav) > 0 for wav in wavs) and server.stats['max_batch'] == 2))
+    results.append(check("a bad speaker fails its request alone", bad.exception(timeout=60) is not None))
+    results.append(check("the server keeps serving", len(server.synthesize(SENTENCES[4], speakers[1])) > 0))
+    server.stop()
+
+    print(f"{sum(results)}/{len(results)} checks passed")
+    raise SystemExit(0 if all(results) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+# chattts_prefix_check.py
+"""Checks that reusing the cached speaker/prompt prefix does not change ChatTTS generation.
+
+Runs Chat._infer_code on the random-weight Chat of
+chattts_batch_benchmark.py for a batch of sentences of different lengths
+(so the prompts are left padded) under manual_seed: once with
+``reuse_prefix`` off, once on a cold prefix cache and once on a warm
+one. The ids and the code logits of every generated step (the heads
+applied to the returned hiddens) must match. Then times the prefill of
+one short sentence with and without the cached prefix on a GPT with
+``--timing-layers`` full-size layers.
+
+    python chattts_prefix_check.py --layers 2 --timing-layers 20
+"""
+import argparse
+import logging
+import statistics
+import time
+import torch
+from ChatTTS.config import Config
+from chattts_batch_benchmark import SENTENCES, build_tiny_chat
+
+SHORT_SENTENCE = "明天见"
+
+
+def infer(chat, texts, spk_emb, reuse, max_new_token=40):
+    params = chat.InferCodeParams(
+        spk_emb=spk_emb,
+        manual_seed=0,
+        min_new_token=1,  # with manual_seed an end at the first step yields nothing
+        max_new_token=max_new_token,
+        show_tqdm=False,
+        reuse_prefix=reuse,
+    )
+    return next(iter(chat._infer_code(texts, False, chat.device, True, params)))
+
+
+def logits(chat, hidden):
+    return torch.stack([head(hidden) for head in chat.gpt.head_code], 2)
+
+
+def same(chat, a, b):
+    return len(a.ids) == len(b.ids) and all(
+        torch.equal(x, y) for x, y in zip(a.ids, b.ids)
+    ) and all(
+        # the prefix is attended in another layout, so logits match to rounding only
+        torch.allclose(logits(chat, x), logits(chat, y), rtol=1e-4, atol=1e-4)
+        for x, y in zip(a.hiddens, b.hiddens)
+    )
+
+
+def check(name, condition):
+    print(f"    {'ok  ' if condition else 'FAIL'} {name}")
+    return condition
+
+
+def time_prefill(chat, spk_emb, reuse, repeats):
+    """Median time of _infer_code for SHORT_SENTENCE generating one token, i.e. the prefill."""
+    infer(chat, [SHORT_SENTENCE], spk_emb, reuse, max_new_token=1)  # warm up, fills the cache
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        infer(chat, [SHORT_SENTENCE], spk_emb, reuse, max_new_token=1)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--layers', type=int, default=2, help="GPT layers of the equivalence check")
+    parser.add_argument('--batch', type=int, default=3)
+    parser.add_argument('--timing-layers', type=int, default=20, help="GPT layers of the prefill timing, 0 to skip")
+    parser.add_argument('--repeats', type=int, default=10)
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.ERROR)
+    torch.set_grad_enabled(False)
+
+    chat = build_tiny_chat(args.layers)
+    spk_emb = chat.sample_random_speaker()
+    texts = sorted(SENTENCES, key=len)[::max(1, len(SENTENCES) // args.batch)][:args.batch]
+    results = []
+
+    print(f"equivalence, {len(texts)} rows of {[len(text) for text in texts]} characters")
+    reference = infer(chat, texts, spk_emb, reuse=False)
+    chat.prefix_cache.clear()
+    cold = infer(chat, texts, spk_emb, reuse=True)
+    results.append(check("prefix stored on a cold cache", len(chat.prefix_cache) == 1))
+    warm = infer(chat, texts, spk_emb, reuse=True)
+    results.append(check("prefix reused on a warm cache", chat.prefix_cache.hits >= 1))
+    generated = [len(ids) for ids in reference.ids]
+    results.append(check(f"cold cache matches reuse_prefix off, generated {generated}", same(chat, cold, reference)))
+    results.append(check("warm cache matches reuse_prefix off", same(chat, warm, reference)))
+
+    if args.timing_layers:
+        chat = build_tiny_chat(args.timing_layers, Config().gpt.intermediate_size)
+        spk_emb = chat.sample_random_speaker()
+        prefix = chat.speaker.code_prompt_prefix(chat.InferCodeParams.prompt, None, spk_emb)
+        print(f"prefill of {SHORT_SENTENCE!r}, {args.timing_layers} layers, median of {args.repeats}")
+        full = time_prefill(chat, spk_emb, False, args.repeats)
+        reused = time_prefill(chat, spk_emb, True, args.repeats)
+        size = chat.tokenizer.encode([prefix], 1)[0].size(1)
+        total = chat.tokenizer.encode(chat.speaker.decorate_code_prompts(
+            [SHORT_SENTENCE], chat.InferCodeParams.prompt, None, spk_emb), 1)[0].size(1)
+        print(f"    reuse_prefix off {full * 1000:7.1f} ms, on {reused * 1000:7.1f} ms "
+              f"({full / reused:.2f}x), prefix {size} of {total} tokens")
+
+    print(f"{sum(results)}/{len(results)} checks passed")
+    raise SystemExit(0 if all(results) else 1)
+
+
+if __name__ == '__main__':
+    main()
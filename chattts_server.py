@@ -0,0 +1,183 @@
+# chattts_server.py
+import threading
+import time
+from concurrent.futures import Future
+import torch
+import config
+from ChatTTS.model import GPT, gen_logits
+from logger import log
+
+class SynthesisRequest:
+    __slots__ = ('text', 'spk_emb', 'temperature', 'future', 'queued')
+
+    def __init__(self, text, spk_emb, temperature):
+        self.text = text
+        self.spk_emb = spk_emb
+        self.temperature = temperature
+        self.future = Future()
+        self.queued = time.monotonic()
+
+class ChatTTSServer:
+    """Runs concurrent ChatTTS requests as one continuously batched generation through one Chat.
+
+    ``submit`` queues a text and returns a Future of its float32 waveform.
+    A worker thread runs GPT.generate_continuous with up to ``max_batch``
+    rows. Before every decode step the queued requests are prefilled into
+    the free rows, and a row that ends leaves the batch at once, is decoded
+    to audio and resolves its Future. A request arriving mid-batch starts
+    at the next step instead of waiting for the longest row of a batch.
+    Every row has its own speaker and temperature, since the speaker is
+    applied to each request's prompt when it is admitted.
+
+    Finished rows are decoded on the worker between two steps, so a decode
+    holds up the running rows for its duration. Throughput by batch size is
+    measured by chattts_batch_benchmark.py.
+    """
+
+    def __init__(self, chat, max_batch=None, **params):
+        self.chat = chat
+        self.max_batch = max_batch or config.CHATTTS_MAX_BATCH
+        self.params = params  # further InferCodeParams fields for every request, e.g. max_new_token
+        self.defaults = chat.InferCodeParams(**params)
+        self.eos_token = chat.config.gpt.num_audio_tokens - 1
+        logits_warpers, logits_processors = gen_logits(
+            num_code=self.eos_token,
+            top_P=self.defaults.top_P,
+            top_K=self.defaults.top_K,
+            repetition_penalty=self.defaults.repetition_penalty,
+        )
+        self.logits_processors = (*logits_processors, *logits_warpers)
+        self.samples_per_frame = 2 * chat.config.vocos.head.init_args.hop_length
+        self._pending = []
+        self._active = set()  # requests with a row in the batch, only used by the worker
+        self._cond = threading.Condition()
+        self._thread = None
+        self._running = False
+        self.stats = {'steps': 0, 'rows': 0, 'utterances': 0, 'max_batch': 0, 'errors': 0}
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name="chattts-server", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Cancels the queued requests and waits for the ones in the batch to finish."""
+        with self._cond:
+            self._running = False
+            pending, self._pending = self._pending, []
+            self._cond.notify_all()
+        for request in pending:
+            request.future.cancel()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def submit(self, text, spk_emb=None, temperature=0.3):
+        request = SynthesisRequest(text, spk_emb, temperature)
+        with self._cond:
+            if not self._running:
+                raise RuntimeError("ChatTTS server is not running")
+            self._pending.append(request)
+            self._cond.notify_all()
+        return request.future
+
+    def synthesize(self, text, spk_emb=None, temperature=0.3):
+        """Blocking form of ``submit``."""
+        return self.submit(text, spk_emb, temperature).result()
+
+    @property
+    def mean_batch(self):
+        """Mean number of rows per decode step."""
+        return self.stats['rows'] / self.stats['steps'] if self.stats['steps'] else 0.0
+
+    def _admit(self, free):
+        """The ``admit`` of GPT.generate_continuous: up to ``free`` queued requests as rows."""
+        idle = free == self.max_batch
+        with self._cond:
+            if idle:
+                self._cond.wait_for(lambda: self._pending or not self._running)
+                if not self._running:
+                    return None
+            taken, self._pending = self._pending[:free], self._pending[free:]
+        rows = []
+        for request in taken:
+            if not request.future.set_running_or_notify_cancel():
+                continue
+            try:
+                rows.append(self._row(request))
+            except Exception as e:
+                # a request that cannot be prepared fails alone
+                self.stats['errors'] += 1
+                log.error(f"ChatTTS request failed: {e}")
+                request.future.set_exception(e)
+                continue
+            self._active.add(request)
+        running = self.max_batch - free + len(rows)
+        if running:
+            self.stats['steps'] += 1
+            self.stats['rows'] += running
+            self.stats['max_batch'] = max(self.stats['max_batch'], running)
+        return rows
+
+    def _row(self, request):
+        """Same prompt as Chat.infer(skip_refine_text=True) gives the request, as a GPT.Row."""
+        chat = self.chat
+        params = chat.InferCodeParams(
+            spk_emb=request.spk_emb,
+            temperature=request.temperature,
+            show_tqdm=False,
+            **self.params,
+        )
+        text = chat.normalizer(request.text, True, True, None)
+        emb, _, _, prefix = chat._embed_code_prompts(*chat._encode_code_prompts([text], params), params)
+        return GPT.Row(
+            emb=emb,
+            temperature=torch.tensor([request.temperature] * chat.config.gpt.num_vq),
+            prefix_cache=prefix,
+            tag=request,
+        )
+
+    def _run(self):
+        defaults = self.defaults
+        while True:
+            try:
+                for rows in self.chat.gpt.generate_continuous(
+                    self._admit,
+                    eos_token=self.eos_token,
+                    max_batch=self.max_batch,
+                    max_new_token=defaults.max_new_token,
+                    min_new_token=defaults.min_new_token,
+                    logits_processors=self.logits_processors,
+                    ensure_non_empty=defaults.ensure_non_empty,
+                    manual_seed=defaults.manual_seed,
+                ):
+                    self._finish(rows)
+                return
+            except Exception as e:
+                # an error of the batch fails the requests in it, not the worker
+                self.stats['errors'] += 1
+                log.error(f"ChatTTS server error: {e}")
+                for request in self._active:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+                self._active.clear()
+
+    def _finish(self, rows):
+        requests = [row.tag for row in rows]
+        self._active.difference_update(requests)
+        lengths = [row.hiddens.size(0) * self.samples_per_frame for row in rows]
+        try:
+            # _decode_to_wavs zero-pads every row to the longest one
+            wavs = self.chat._decode_to_wavs([row.hiddens for row in rows], True)
+        except Exception as e:
+            self.stats['errors'] += 1
+            log.error(f"ChatTTS decode of {len(rows)} utterances failed: {e}")
+            for request in requests:
+                request.future.set_exception(e)
+            return
+        self.stats['utterances'] += len(rows)
+        for i, (request, length) in enumerate(zip(requests, lengths)):
+            request.future.set_result(wavs[i, :length])
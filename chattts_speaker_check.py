@@ -0,0 +1,159 @@
+# chattts_speaker_check.py
+"""Checks that Speaker.prepare and its LRU do not change the speaker embedding.
+
+Builds a Speaker from the stock spk_stat and compares prepare() and
+apply() with the decode path apply used before the cache: base16384 and
+LZMA decode of the string, F.normalize, then .to(device), on every call.
+Covers a cold call, a cached call, a device change (cpu and meta, and
+back) and a tensor passed instead of the string. Then fills an LRU of
+``--cache-size`` entries with more speakers than it holds, from one
+thread and from several, and times apply before and with the cache.
+
+    python chattts_speaker_check.py --cache-size 4
+"""
+import argparse
+import statistics
+import threading
+import time
+import torch
+import torch.nn.functional as F
+from ChatTTS.config import Config
+from ChatTTS.model import Speaker
+
+SPK_EMB_ID = 21143
+
+
+def decode(spk_emb, device):
+    """The embedding as apply computed it before Speaker.prepare."""
+    if isinstance(spk_emb, str):
+        spk_emb = torch.from_numpy(Speaker._decode(spk_emb))
+    return F.normalize(spk_emb, p=2.0, dim=0, eps=1e-12).to(device)
+
+
+def old_apply(emb, spk_emb, input_ids, device):
+    n = decode(spk_emb, device).unsqueeze_(0).expand(emb.size(0), -1).unsqueeze_(1).expand(emb.shape)
+    cond = input_ids.narrow(-1, 0, 1).eq(SPK_EMB_ID).expand(emb.shape)
+    return torch.where(cond, n, emb)
+
+
+def prompt(dim, batch=3, length=12):
+    """Embeddings and ids of ``batch`` prompts with the speaker token at a few positions."""
+    input_ids = torch.randint(0, 1000, (batch, length, 4))
+    input_ids[:, 2, :] = SPK_EMB_ID
+    input_ids[1, 7, :] = SPK_EMB_ID
+    return torch.randn(batch, length, dim), input_ids
+
+
+def same(a, b):
+    return a.device == b.device and a.dtype == b.dtype and torch.equal(a, b)
+
+
+def same_meta(a, b):
+    return a.device == b.device and a.dtype == b.dtype and a.shape == b.shape
+
+
+def check(name, condition):
+    print(f"    {'ok  ' if condition else 'FAIL'} {name}")
+    return condition
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cache-size', type=int, default=4)
+    parser.add_argument('--calls', type=int, default=200)
+    args = parser.parse_args()
+    if args.cache_size < 2:
+        parser.error("--cache-size must be at least 2 to check the eviction order")
+    torch.manual_seed(0)
+
+    config = Config()
+    dim = config.gpt.hidden_size
+    speaker = Speaker(dim, config.spk_stat)
+    spk_emb = speaker.sample_random()
+    results = []
+
+    print("prepare against the old decode path")
+    cold = speaker.prepare(spk_emb, "cpu")
+    results.append(check(f"cold call: same {cold.dtype} values on {cold.device}", same(cold, decode(spk_emb, "cpu"))))
+    warm = speaker.prepare(spk_emb, "cpu")
+    results.append(check("cached call: the cached tensor, same values",
+                         warm is cold and same(warm, decode(spk_emb, "cpu"))))
+    results.append(check("torch.device('cpu') hits the same entry",
+                         speaker.prepare(spk_emb, torch.device("cpu")) is cold))
+    meta = speaker.prepare(spk_emb, "meta")
+    results.append(check("device change to meta: own entry, same dtype and shape on meta",
+                         meta is not cold and same_meta(meta, decode(spk_emb, "meta")) and len(speaker._cache) == 2))
+    results.append(check("back on cpu: still the cpu entry", speaker.prepare(spk_emb, "cpu") is cold))
+    tensor = torch.from_numpy(Speaker._decode(spk_emb))
+    results.append(check("tensor instead of the string: same values, not cached",
+                         same(speaker.prepare(tensor, "cpu"), decode(tensor, "cpu")) and len(speaker._cache) == 2))
+    results.append(check("prepared tensor passed back in: same values",
+                         same(speaker.prepare(cold, "cpu"), decode(spk_emb, "cpu"))))
+
+    print("apply against the old apply")
+    emb, input_ids = prompt(dim)
+    other = speaker.sample_random()
+    for name, value, reference in (("cached string", spk_emb, spk_emb), ("prepared tensor", cold, spk_emb),
+                                   ("new string", other, other)):
+        out = speaker.apply(emb.clone(), value, input_ids, SPK_EMB_ID, "cpu")
+        results.append(check(f"{name}: same output", same(out, old_apply(emb.clone(), reference, input_ids, "cpu"))))
+    out = speaker.apply(emb.clone(), spk_emb, input_ids, SPK_EMB_ID, "cpu", inplace=False)
+    results.append(check("the cached tensor is left as it was",
+                         same(out, old_apply(emb.clone(), spk_emb, input_ids, "cpu")) and cold.dim() == 1
+                         and same(cold, decode(spk_emb, "cpu"))))
+
+    print(f"LRU of {args.cache_size} entries")
+    speaker = Speaker(dim, config.spk_stat, cache_size=args.cache_size)
+    speakers = [speaker.sample_random() for _ in range(2 * args.cache_size - 1)]
+    first = speaker.prepare(speakers[0], "cpu")
+    second = speaker.prepare(speakers[1], "cpu")
+    for spk in speakers[2:args.cache_size]:
+        speaker.prepare(spk, "cpu")
+    speaker.prepare(speakers[0], "cpu")  # now the most recent, so the others go first
+    for spk in speakers[args.cache_size:]:
+        speaker.prepare(spk, "cpu")
+    results.append(check(f"{len(speakers)} speakers leave {len(speaker._cache)} entries",
+                         len(speaker._cache) == args.cache_size))
+    results.append(check("a recently used entry survives", speaker.prepare(speakers[0], "cpu") is first))
+    evicted = speaker.prepare(speakers[1], "cpu")
+    results.append(check("the least recently used entry was evicted and decodes the same again",
+                         evicted is not second and same(evicted, decode(speakers[1], "cpu"))
+                         and len(speaker._cache) == args.cache_size))
+    threads = [
+        threading.Thread(target=lambda i=i: [speaker.prepare(speakers[(i + j) % len(speakers)], "cpu")
+                                             for j in range(50)])
+        for i in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.append(check(f"8 threads leave {len(speaker._cache)} entries, all correct",
+                         len(speaker._cache) == args.cache_size and all(
+                             same(speaker.prepare(spk, "cpu"), decode(spk, "cpu")) for spk in speakers)))
+    uncached = Speaker(dim, config.spk_stat, cache_size=0)
+    results.append(check("cache_size 0 keeps nothing and decodes the same",
+                         same(uncached.prepare(spk_emb, "cpu"), decode(spk_emb, "cpu")) and not uncached._cache))
+
+    print(f"apply, {args.calls} calls")
+    speaker = Speaker(dim, config.spk_stat, cache_size=args.cache_size)
+    emb, input_ids = prompt(dim, batch=2)
+    timings = {}
+    for name, fn in (
+        ("old", lambda: old_apply(emb, spk_emb, input_ids, "cpu")),
+        ("cached", lambda: speaker.apply(emb, spk_emb, input_ids, SPK_EMB_ID, "cpu", inplace=False)),
+    ):
+        samples = []
+        for _ in range(args.calls):
+            start = time.perf_counter()
+            fn()
+            samples.append(time.perf_counter() - start)
+        timings[name] = statistics.median(samples) * 1000
+    print(f"    median {timings['old']:.3f} ms before, {timings['cached']:.3f} ms with the cache")
+
+    print(f"{sum(results)}/{len(results)} checks passed")
+    raise SystemExit(0 if all(results) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+# chattts_stream_benchmark.py
+"""CPU benchmark of ChatTTS streaming decode: full re-decode vs StreamDecoder.
+
+Builds the DVAE decoder and Vocos from the ChatTTS configs with random
+weights (decode cost does not depend on the weights, and layer scales at 1
+reach as far as trained ones) and feeds them GPT hiddens the way
+Chat._infer(stream=True) receives them, ``stream_batch`` frames more per
+step. The old path re-decodes every frame so far on each
+step and slices ``stream_speed`` samples off; the incremental path decodes
+only the new frames plus a fixed context. Generation is simulated at
+``--token-rate`` frames per second and, as in _infer, decoding blocks it.
+Reports total decode time, time to first audio, wall time and the error
+against one decode of the whole utterance.
+
+    python chattts_stream_benchmark.py --frames 100,200,400,800 --token-rate 50
+"""
+import argparse
+import time
+from dataclasses import asdict
+import numpy as np
+import torch
+from vocos import Vocos
+from vocos.pretrained import instantiate_class
+from ChatTTS.config import Config
+from ChatTTS.core import Chat, StreamDecoder
+from ChatTTS.model import DVAE
+
+
+def build_chat(threads):
+    """A Chat with only the random-weight decoder and vocoder, enough for _decode_to_wavs."""
+    torch.set_num_threads(threads)
+    torch.manual_seed(0)
+    config = Config()
+    chat = Chat.__new__(Chat)
+    chat.config = config
+    chat.device = torch.device("cpu")
+    chat.decoder = DVAE(
+        decoder_config=asdict(config.decoder), dim=config.decoder.idim
+    ).eval()
+    chat.vocos = Vocos(
+        feature_extractor=instantiate_class(args=(), init=asdict(config.vocos.feature_extractor)),
+        backbone=instantiate_class(args=(), init=asdict(config.vocos.backbone)),
+        head=instantiate_class(args=(), init=asdict(config.vocos.head)),
+    ).eval()
+    # ConvNeXt layer scales start at 1e-6, so distant frames barely reach the
+    # output; at 1 the error of a short lookahead shows as with trained weights
+    for module in [*chat.decoder.modules(), *chat.vocos.modules()]:
+        if getattr(module, "gamma", None) is not None:
+            torch.nn.init.ones_(module.gamma)
+    return chat
+
+
+def stream_steps(total, stream_batch):
+    """Frame counts at which GPT.generate yields while streaming: every stream_batch frames, then the end."""
+    steps = list(range(stream_batch, total, stream_batch))
+    return steps + [total]
+
+
+def decode(chat, frames):
+    return chat._decode_to_wavs([frames], use_decoder=True)
+
+
+class FullRedecode:
+    """The stream=True branch of Chat._infer before incremental decoding."""
+
+    def __init__(self, chat, params):
+        self.chat = chat
+        self.params = params
+        self.length = 0
+        self.batches = 0
+
+    def __call__(self, frames, final):
+        wavs = decode(self.chat, frames)
+        self.batches += 1
+        chunks = []
+        if self.batches > self.params.pass_first_n_batches:
+            b = min(self.length + self.params.stream_speed, wavs.shape[1])
+            chunks.append(wavs[:, self.length:b])
+            self.length = b
+        if final:
+            chunks.append(wavs[:, self.length:])
+        return np.concatenate(chunks, 1) if chunks else wavs[:, :0]
+
+
+class Incremental:
+    def __init__(self, chat, params):
+        self.decoder = StreamDecoder(
+            lambda frames: chat._decode_to_wavs(frames, use_decoder=True),
+            2 * chat.config.vocos.head.init_args.hop_length,
+            context=params.stream_context,
+            lookahead=params.stream_lookahead,
+            crossfade=params.stream_crossfade,
+        )
+
+    def __call__(self, frames, final):
+        new_wavs = self.decoder.decode([frames])
+        if final:
+            new_wavs = np.concatenate([new_wavs, self.decoder.decode([frames], final=True)], 1)
+        return new_wavs
+
+
+def run(path, hiddens, params, token_rate):
+    clock = decode_time = 0.0
+    first_audio = None
+    produced = 0
+    chunks = []
+    steps = stream_steps(hiddens.size(0), params.stream_batch)
+    for n in steps:
+        clock += (n - produced) / token_rate
+        produced = n
+        start = time.perf_counter()
+        chunk = path(hiddens[:n], n == steps[-1])
+        elapsed = time.perf_counter() - start
+        clock += elapsed
+        decode_time += elapsed
+        if first_audio is None and chunk.shape[1]:
+            first_audio = clock
+        chunks.append(chunk)
+    return decode_time, first_audio, clock, np.concatenate(chunks, 1)
+
+
+def snr(reference, audio):
+    length = min(reference.shape[1], audio.shape[1])
+    error = reference[:, :length] - audio[:, :length]
+    return 10 * np.log10(np.sum(reference[:, :length] ** 2) / max(np.sum(error ** 2), 1e-20))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--frames', default='100,200,400,800', help="utterance lengths in GPT frames (~21 ms each)")
+    parser.add_argument('--token-rate', type=float, default=50.0, help="simulated GPT frames per second")
+    parser.add_argument('--stream-batch', type=int, default=Chat.InferCodeParams.stream_batch)
+    parser.add_argument('--lookahead', type=int, default=Chat.InferCodeParams.stream_lookahead)
+    parser.add_argument('--context', type=int, default=Chat.InferCodeParams.stream_context)
+    parser.add_argument('--crossfade', type=int, default=Chat.InferCodeParams.stream_crossfade)
+    parser.add_argument('--threads', type=int, default=torch.get_num_threads())
+    args = parser.parse_args()
+
+    chat = build_chat(args.threads)
+    params = Chat.InferCodeParams(
+        stream_batch=args.stream_batch,
+        stream_context=args.context,
+        stream_lookahead=args.lookahead,
+        stream_crossfade=args.crossfade,
+    )
+    hidden_size = chat.config.gpt.hidden_size
+    decode(chat, torch.randn(params.stream_batch, hidden_size))  # warm up
+
+    print(f"{'frames':>7} {'path':<12} {'decode':>9} {'per frame':>10} {'1st audio':>10} {'wall':>9} {'SNR':>8}")
+    for total in (int(frames) for frames in args.frames.split(',')):
+        hiddens = torch.randn(total, hidden_size)
+        reference = decode(chat, hiddens)
+        for name, path in (('full', FullRedecode(chat, params)), ('incremental', Incremental(chat, params))):
+            decode_time, first_audio, wall, audio = run(path, hiddens, params, args.token_rate)
+            print(f"{total:7d} {name:<12} {decode_time * 1000:7.0f} ms {decode_time / total * 1000:7.2f} ms "
+                  f"{first_audio * 1000:7.0f} ms {wall * 1000:6.0f} ms {snr(reference, audio):6.1f} dB")
+
+
+if __name__ == '__main__':
+    main()
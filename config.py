@@ -7,6 +7,11 @@ USER_AGENT = (
     "Chrome/120.0.0.0 Safari/537.36"
 )
 DOUYIN_LIVE_URL = "https://live.douyin.com/"
+HTTP_TIMEOUT = 10  # in seconds
+HTTP_POOL_SIZE = 8  # keep-alive connections shared by room resolution
+TTWID_TTL = 3600  # in seconds
+ROOM_ID_CACHE_FILE = "room_ids.json"
+ROOM_ID_CACHE_TTL = 6 * 3600  # in seconds, room ids change between broadcasts
 WSS_URL_TEMPLATE = (
     "wss://webcast5-ws-web-hl.douyin.com/webcast/im/push/v2/?"
     "app_name=douyin_web&version_code=180800&webcast_sdk_version=1.0.14-beta.0"
@@ -35,11 +40,36 @@ TTS_VOICES = [
     "zh-CN-YunxiaNeural",
     "zh-CN-YunyangNeural",
 ]
+TTS_BACKEND = "edge"  # edge (Microsoft edge-tts) or local (offline stand-in, see tts_backend.py)
+LOCAL_TTS_LATENCY = 0.3  # in seconds, local backend time before the first chunk
+LOCAL_TTS_JITTER = 0.1  # in seconds, +/- around LOCAL_TTS_LATENCY
+LOCAL_TTS_FAILURE_RATE = 0.0  # fraction of local backend requests that fail
 TTS_PROXY = "http://192.168.10.66:10707"
 USE_TTS_PROXY = False
 TTS_MAX_RETRIES = 3
 TTS_RETRY_DELAY = 1  # in seconds
-AUDIO_OUTPUT_DIR = "msic"
+AUDIO_OUTPUT_DIR = "msic"  # where the wav sink writes clips
+AUDIO_SINK = "sounddevice"  # sounddevice, null or wav
+AUDIO_OUTPUT_DEVICE = None  # sounddevice device id, None = system default
+AUDIO_RING_SECONDS = 2.0  # decoded audio buffered ahead of the output device when streaming
+TTS_STREAMING = True  # start playing while edge-tts is still sending the utterance
+TTS_CACHE_ENABLED = True  # reuse audio of phrases that were already synthesized
+TTS_CACHE_MAX_BYTES = 32 * 1024 * 1024  # MP3 bytes held in memory
+TTS_CACHE_DIR = None  # e.g. "tts_cache" to keep cached phrases across restarts
+TTS_CACHE_MAX_TEXT = 12  # whole utterances up to this many characters are cached (e.g. short chat lines)
+TTS_SEGMENT_CACHE = True  # speak announcements as cached fixed fragments spliced around the user name
+TTS_PIPELINE_DEPTH = 4  # utterances in flight, counting the one playing (1 = strictly serial)
+TTS_CONCURRENCY = 3  # TTS requests running at the same time across all voices
+TTS_REORDER_PLAYBACK = True  # play whichever utterance is ready first, keeping each voice in order
+TTS_PRIORITIES = ["gift", "follow", "chat", "welcome"]  # highest priority first
+TTS_CLASS_CAPACITY = {"gift": 50, "follow": 20, "chat": 30, "welcome": 20}
+TTS_MAX_AGE = {"gift": 120, "follow": 30, "chat": 20, "welcome": 10}  # in seconds, older items are skipped
+TTS_COALESCE = {  # categories whose queued items are merged into one announcement
+    "welcome": "欢迎 {names} 进入直播间！",
+    "follow": "感谢 {names} 关注主播！",
+}
+TTS_COALESCE_MAX = 3  # names per merged announcement
+CHATTTS_MAX_BATCH = 8  # ChatTTS utterances generated together, new ones join as others finish (txt_chat.py)
 
 # GUI Configuration
 WINDOW_TITLE = "抖音直播信息"
@@ -52,3 +82,52 @@ FONT_SIZE_LARGE = 16
 
 # WebSocket Connection
 MESSAGE_TIMEOUT = 10  # in seconds
+RECONNECT_DELAY = 1  # in seconds, first backoff step
+RECONNECT_MAX_DELAY = 60  # in seconds, backoff ceiling
+RECONNECT_MULTIPLIER = 2
+RECONNECT_STABLE_AFTER = 30  # in seconds a connection must last before the backoff resets
+CIRCUIT_BREAKER_THRESHOLD = 6  # failed attempts in a row before a room pauses reconnecting
+CIRCUIT_BREAKER_COOLDOWN = 120  # in seconds, then one trial attempt with a freshly resolved room
+# Opt in to watch rooms from one asyncio loop (async_websocket_client.MultiRoomClient) instead of a
+# thread per room (websocket_client.WebSocketClient); needed for MainController.start_rooms
+USE_ASYNC_CLIENT = False
+MAX_CONCURRENT_CONNECTS = 10  # rooms resolving/connecting at the same time
+SIGNER_POOL_SIZE = 2  # warm sign.js V8 contexts shared by all rooms
+SIGNATURE_CACHE_TTL = 60  # in seconds, reuse a signature for reconnects within this window
+
+# Message Decoding
+LAZY_DECODE = True  # scan frames for method only, decode payloads on demand
+FAST_DECODE = True  # use protobuf.fast decoders for chat/gift/member/like/viewer messages
+INGEST_WORKERS = 1  # decode/dispatch threads; 0 dispatches on the receive thread, >1 may reorder frames
+INGEST_QUEUE_SIZE = 500  # decompressed frames waiting for a worker
+INGEST_DROP_POLICY = "drop_oldest"  # drop_oldest, drop_newest or block
+DEDUP_CAPACITY = 4096  # message ids remembered per room to drop messages re-sent after a reconnect
+AGGREGATION_WINDOW = 0.5  # in seconds; likes and viewer counts are logged/shown once per window, 0 = every message
+# Message types decoded and logged even when no speech toggle or subscriber needs them.
+# The GUI only shows the viewer count (always decoded), so by default a message is
+# decoded only when a toggle or subscriber wants it; add e.g. 'WebcastChatMessage' to log it.
+LOGGED_MESSAGES = set()
+
+# Frame Capture
+CAPTURE_DIR = None  # e.g. "captures" to record every room's raw frames for replay
+CAPTURE_COMPRESS = True
+
+# Danmaku Archive
+ARCHIVE_PATH = None  # e.g. "danmaku.db" to store chat/gift/member/social/like events in SQLite
+ARCHIVE_BATCH_SIZE = 1000  # rows per transaction at most
+ARCHIVE_FLUSH_INTERVAL = 1.0  # in seconds, commit at least this often while events arrive
+ARCHIVE_QUEUE_SIZE = 100000  # rows waiting for the writer; further events are dropped and counted
+
+# Logging
+LOG_FILE = "app.log"
+LOG_ASYNC = True  # format and write log records on a background thread in batches
+LOG_QUEUE_SIZE = 10000  # records waiting for the writer; further records are dropped and counted
+LOG_BATCH_SIZE = 500  # records written per flush at most
+LOG_MAX_BYTES = 10 * 1024 * 1024  # rotate the log file at this size, 0 = never
+LOG_BACKUP_COUNT = 3  # rotated files kept as app.log.1 ... app.log.N
+# Keep only 1 in N lines of a category (the 【...】 prefix of the message).
+# Off by default, every line is logged; e.g. {'【成员】': 10} keeps 1 in 10 member lines
+LOG_SAMPLING = {}
+# At most N lines per second of a category; the rest are dropped and counted.
+# Off by default; e.g. {'【聊天】': 50} caps chat lines at 50 per second
+LOG_RATE_LIMITS = {}
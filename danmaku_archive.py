@@ -0,0 +1,279 @@
+# danmaku_archive.py
+"""SQLite archive of chat, gift, member, social and like events.
+
+MessageHandler subscribers only normalize a decoded message into a row
+tuple and put it on a bounded queue; a writer thread inserts queued rows
+with one prepared ``executemany`` per transaction. The database runs in
+WAL mode, so queries can read while the writer appends. The same
+transaction folds the batch into per-minute counts and per-user gift
+totals, so the usual reports read a few hundred rows instead of scanning
+every event.
+
+    python danmaku_archive.py danmaku.db --room 7392091211001140287 --since 120
+"""
+import argparse
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+import config
+from logger import log
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    room_id INTEGER NOT NULL,
+    time INTEGER NOT NULL,      -- milliseconds since the epoch
+    kind TEXT NOT NULL,         -- chat, gift, member, social or like
+    msg_id INTEGER,
+    user_id INTEGER,
+    user_name TEXT,
+    content TEXT,               -- chat text or gift name
+    count INTEGER,              -- gifts the event adds (see GiftCombos) or likes in the message
+    diamonds INTEGER            -- diamond value of those gifts
+);
+CREATE INDEX IF NOT EXISTS events_room_kind_time ON events (room_id, kind, time);
+CREATE INDEX IF NOT EXISTS events_user_time ON events (user_id, time);
+CREATE INDEX IF NOT EXISTS events_time ON events (time);
+CREATE TABLE IF NOT EXISTS minute_counts (
+    room_id INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    minute INTEGER NOT NULL,    -- start of the minute in milliseconds
+    events INTEGER NOT NULL,
+    PRIMARY KEY (room_id, kind, minute)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS gift_totals (
+    room_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    user_name TEXT,
+    diamonds INTEGER NOT NULL,
+    gifts INTEGER NOT NULL,
+    PRIMARY KEY (room_id, user_id)
+);
+CREATE INDEX IF NOT EXISTS gift_totals_room_diamonds ON gift_totals (room_id, diamonds);
+"""
+INSERT = ("INSERT INTO events (room_id, time, kind, msg_id, user_id, user_name, content, count, diamonds) "
+          "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)")
+UPSERT_MINUTE = ("INSERT INTO minute_counts (room_id, kind, minute, events) VALUES (?, ?, ?, ?) "
+                 "ON CONFLICT (room_id, kind, minute) DO UPDATE SET events = events + excluded.events")
+UPSERT_GIFTS = ("INSERT INTO gift_totals (room_id, user_id, user_name, diamonds, gifts) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (room_id, user_id) DO UPDATE SET user_name = excluded.user_name, "
+                "diamonds = diamonds + excluded.diamonds, gifts = gifts + excluded.gifts")
+
+ARCHIVED_METHODS = {
+    'WebcastChatMessage': 'chat',
+    'WebcastGiftMessage': 'gift',
+    'WebcastMemberMessage': 'member',
+    'WebcastSocialMessage': 'social',
+    'WebcastLikeMessage': 'like',
+}
+
+class GiftCombos:
+    """Turns the running counts of Douyin gift combos into the gifts each message adds.
+
+    A combo arrives as several GiftMessages of one ``group_id`` whose
+    ``repeat_count`` grows to the combo's total (the last one has
+    ``repeat_end``), and a count may be sent more than once. Each message
+    adds ``group_count`` gifts per repeat since the highest count seen for
+    its group. The last ``capacity`` groups are remembered.
+    """
+
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self._counts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def gifts(self, message):
+        group_count = message.group_count or 1
+        if not message.group_id:
+            return group_count
+        key = (message.common.room_id, message.user.id, message.group_id)
+        repeat_count = message.repeat_count or 1
+        with self._lock:
+            seen = self._counts.pop(key, 0)
+            self._counts[key] = max(seen, repeat_count)
+            if len(self._counts) > self.capacity:
+                self._counts.popitem(last=False)
+        return max(0, repeat_count - seen) * group_count
+
+def to_row(method, message, combos=None):
+    """Flattens a decoded (fast or betterproto) message into an events row.
+
+    Gift counts go through ``combos`` (a GiftCombos) when given, so that a
+    combo is counted once; without it every message counts its group.
+    """
+    kind = ARCHIVED_METHODS[method]
+    common = message.common
+    created = common.create_time or int(time.time() * 1000)
+    content = None
+    count = None
+    diamonds = None
+    if kind == 'chat':
+        content = message.content
+    elif kind == 'gift':
+        content = message.gift.name
+        count = combos.gifts(message) if combos is not None else message.group_count or 1
+        diamonds = message.gift.diamond_count * count
+    elif kind == 'like':
+        count = message.count
+    return (common.room_id, created, kind, common.msg_id, message.user.id, message.user.nick_name,
+            content, count, diamonds)
+
+def connect(path):
+    connection = sqlite3.connect(path, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.executescript(SCHEMA)
+    return connection
+
+class DanmakuArchive:
+    """Batched, non-blocking writer of message events into a SQLite database.
+
+    Rows are committed once ``batch_size`` are waiting or ``flush_interval``
+    seconds have passed. When ``queue_size`` rows are already waiting, new
+    ones are dropped and counted rather than stalling the ingest threads.
+    """
+
+    def __init__(self, path=None, batch_size=None, flush_interval=None, queue_size=None):
+        self.path = path or config.ARCHIVE_PATH
+        self.batch_size = batch_size or config.ARCHIVE_BATCH_SIZE
+        self.flush_interval = flush_interval or config.ARCHIVE_FLUSH_INTERVAL
+        self._queue = queue.Queue(queue_size or config.ARCHIVE_QUEUE_SIZE)
+        self._connection = connect(self.path)
+        self._thread = None
+        self._handlers = []
+        self.combos = GiftCombos()
+        self.stats = {'queued': 0, 'written': 0, 'dropped': 0, 'batches': 0, 'errors': 0}
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="archive-writer", daemon=True)
+        self._thread.start()
+
+    def attach(self, message_handler):
+        """Subscribes to every archived message type of ``message_handler``."""
+        for method in ARCHIVED_METHODS:
+            message_handler.subscribe(method, self.add)
+        self._handlers.append(message_handler)
+        self.start()
+
+    def add(self, method, message):
+        try:
+            self._queue.put_nowait(to_row(method, message, self.combos))
+            self.stats['queued'] += 1
+        except queue.Full:
+            self.stats['dropped'] += 1
+            dropped = self.stats['dropped']
+            if dropped == 1 or dropped % 1000 == 0:
+                log.warning(f"Archive queue full, dropped {dropped} events so far")
+
+    def close(self):
+        for message_handler in self._handlers:
+            for method in ARCHIVED_METHODS:
+                message_handler.unsubscribe(method, self.add)
+        self._handlers = []
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        self._connection.close()
+        log.info(f"Archived {self.stats['written']} events to {self.path} ({self.stats['dropped']} dropped)")
+
+    def _run(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                row = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                row = ()
+            if row is None:
+                self._write(batch)
+                return
+            if row:
+                batch.append(row)
+            if len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                self._write(batch)
+                batch = []
+                deadline = time.monotonic() + self.flush_interval
+
+    def _write(self, batch):
+        if not batch:
+            return
+        minutes = {}
+        gifts = {}
+        for room_id, created, kind, _, user_id, user_name, _, count, diamonds in batch:
+            key = (room_id, kind, created // 60000 * 60000)
+            minutes[key] = minutes.get(key, 0) + 1
+            if kind == 'gift':
+                total = gifts.get((room_id, user_id))
+                if total is None:
+                    total = gifts[(room_id, user_id)] = [room_id, user_id, user_name, 0, 0]
+                total[2] = user_name
+                total[3] += diamonds
+                total[4] += count
+        try:
+            with self._connection:
+                self._connection.executemany(INSERT, batch)
+                self._connection.executemany(UPSERT_MINUTE, [key + (events,) for key, events in minutes.items()])
+                self._connection.executemany(UPSERT_GIFTS, gifts.values())
+            self.stats['written'] += len(batch)
+            self.stats['batches'] += 1
+        except sqlite3.Error as e:
+            self.stats['errors'] += 1
+            log.error(f"Error archiving {len(batch)} events: {e}")
+
+def top_gifters(connection, room_id, since=None, limit=10):
+    """Returns [(user_id, user_name, diamonds, gifts)] for the biggest gifters since ``since`` (ms).
+
+    Without ``since`` this reads the running totals; with it, the gift events of that time range.
+    """
+    if not since:
+        return connection.execute(
+            "SELECT user_id, user_name, diamonds, gifts FROM gift_totals "
+            "WHERE room_id = ? ORDER BY diamonds DESC LIMIT ?",
+            (room_id, limit),
+        ).fetchall()
+    return connection.execute(
+        "SELECT user_id, MAX(user_name), SUM(diamonds) AS total, SUM(count) FROM events "
+        "WHERE room_id = ? AND kind = 'gift' AND time >= ? "
+        "GROUP BY user_id ORDER BY total DESC LIMIT ?",
+        (room_id, since, limit),
+    ).fetchall()
+
+def messages_per_minute(connection, room_id, since=None, kind='chat'):
+    """Returns [(minute start in ms, events)] for one kind of event since ``since`` (ms)."""
+    return connection.execute(
+        "SELECT minute, events FROM minute_counts "
+        "WHERE room_id = ? AND kind = ? AND minute >= ? ORDER BY minute",
+        (room_id, kind, (since or 0) // 60000 * 60000),
+    ).fetchall()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', nargs='?', default=config.ARCHIVE_PATH)
+    parser.add_argument('--room', type=int, required=True, help="room_id to report on")
+    parser.add_argument('--since', type=float, help="only the last N minutes")
+    parser.add_argument('--limit', type=int, default=10)
+    args = parser.parse_args()
+
+    connection = connect(args.path)
+    since = int((time.time() - args.since * 60) * 1000) if args.since else None
+    start = time.perf_counter()
+    gifters = top_gifters(connection, args.room, since, args.limit)
+    minutes = messages_per_minute(connection, args.room, since)
+    elapsed = time.perf_counter() - start
+    print(f"Top gifters of room {args.room}:")
+    for user_id, user_name, diamonds, gifts in gifters:
+        print(f"    {user_name:<20} {diamonds:10d} diamonds  {gifts:6d} gifts  (user {user_id})")
+    print("Chat messages per minute:")
+    for minute, count in minutes:
+        print(f"    {time.strftime('%Y-%m-%d %H:%M', time.localtime(minute / 1000))}  {count:6d}")
+    print(f"({elapsed * 1000:.1f} ms)")
+    connection.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+# frame_capture.py
+import gzip
+import os
+import struct
+import threading
+import time
+import config
+from logger import log
+
+MAGIC = b'DYCAP\x01'
+HEADER = struct.Struct('<6sd')   # magic, wall-clock start time
+RECORD = struct.Struct('<QI')    # nanoseconds since capture start, frame length
+GZIP_MAGIC = b'\x1f\x8b'
+
+class FrameRecorder:
+    """Appends raw PushFrame bytes with monotonic timestamps to a capture file.
+
+    The file is a header followed by length-prefixed records. With
+    ``compress`` the whole stream is gzip-compressed; readers detect that
+    from the first bytes.
+    """
+
+    def __init__(self, path, compress=False, flush_interval=1.0):
+        self.path = path
+        self.compress = compress
+        self.flush_interval = flush_interval
+        self.frames = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = gzip.open(path, 'wb', compresslevel=6) if compress else open(path, 'wb')
+        self._start = time.monotonic_ns()
+        self._last_flush = time.monotonic()
+        self._file.write(HEADER.pack(MAGIC, time.time()))
+
+    def record(self, frame):
+        elapsed = time.monotonic_ns() - self._start
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(RECORD.pack(elapsed, len(frame)))
+            self._file.write(frame)
+            self.frames += 1
+            self.bytes += len(frame)
+            now = time.monotonic()
+            if now - self._last_flush >= self.flush_interval:
+                self._file.flush()
+                self._last_flush = now
+
+    def close(self):
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.close()
+            self._file = None
+        log.info(f"Captured {self.frames} frames ({self.bytes} bytes) to {self.path}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def open_capture(live_id):
+    """Returns a FrameRecorder for live_id when CAPTURE_DIR is configured, else None."""
+    if not config.CAPTURE_DIR:
+        return None
+    suffix = '.dycap.gz' if config.CAPTURE_COMPRESS else '.dycap'
+    filename = f"{live_id}_{time.strftime('%Y%m%d_%H%M%S')}{suffix}"
+    return FrameRecorder(os.path.join(config.CAPTURE_DIR, filename), compress=config.CAPTURE_COMPRESS)
+
+def _open_for_read(path):
+    with open(path, 'rb') as f:
+        compressed = f.read(2) == GZIP_MAGIC
+    return gzip.open(path, 'rb') if compressed else open(path, 'rb')
+
+def read_frames(path):
+    """Yields (seconds since capture start, frame bytes) from a capture file."""
+    with _open_for_read(path) as f:
+        header = f.read(HEADER.size)
+        if len(header) < HEADER.size or HEADER.unpack(header)[0] != MAGIC:
+            raise ValueError(f"{path} is not a frame capture file")
+        while True:
+            record = f.read(RECORD.size)
+            if len(record) < RECORD.size:
+                return
+            elapsed, length = RECORD.unpack(record)
+            frame = f.read(length)
+            if len(frame) < length:
+                log.warning(f"Capture {path} ends with a truncated frame")
+                return
+            yield elapsed / 1e9, frame
+
+class FrameReplayer:
+    """Feeds captured frames through the same path live frames take.
+
+    ``speed`` scales the recorded pacing: 1 is real time, 10 is ten times
+    faster and 0 replays as fast as possible. ``on_done`` runs after the
+    last frame and counts towards the duration, e.g. to drain a pipeline.
+    """
+
+    def __init__(self, path, on_frame, speed=1.0, on_done=None):
+        self.path = path
+        self.on_frame = on_frame
+        self.speed = speed
+        self.on_done = on_done
+        self.frames = 0
+        self.errors = 0
+        self._stop = threading.Event()
+
+    def run(self):
+        start = time.monotonic()
+        for elapsed, frame in read_frames(self.path):
+            if self._stop.is_set():
+                break
+            if self.speed > 0:
+                delay = elapsed / self.speed - (time.monotonic() - start)
+                if delay > 0 and self._stop.wait(delay):
+                    break
+            try:
+                self.on_frame(frame)
+            except Exception as e:
+                self.errors += 1
+                log.error(f"Error replaying frame {self.frames}: {e}")
+            self.frames += 1
+        if self.on_done:
+            self.on_done()
+        duration = time.monotonic() - start
+        log.info(f"Replayed {self.frames} frames in {duration:.2f} s ({self.errors} errors)")
+        return duration
+
+    def start(self):
+        thread = threading.Thread(target=self.run, daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self._stop.set()
+
+def replay_to_callback(path, on_message_callback, speed=1.0, pipeline=None):
+    """Builds a FrameReplayer that hands each message to on_message_callback(method, payload) like a live room.
+
+    Frames go through receive_frame and ``pipeline.submit`` with a msg_id
+    dedup index for the capture, as in WebSocketClient, so duplicates are
+    skipped and the drop policy applies. Without ``pipeline`` the replay
+    starts its own IngestPipeline and stops it, dispatching what is still
+    queued, when the last frame is fed.
+    """
+    from websocket_client import receive_frame
+    from ingest_pipeline import IngestPipeline
+    from message_dedup import MessageDedup
+    owns_pipeline = pipeline is None
+    pipeline = pipeline or IngestPipeline()
+    pipeline.start()
+    dedup = MessageDedup()
+
+    def on_frame(frame):
+        response_bytes = receive_frame(frame)[1]
+        pipeline.submit(response_bytes, on_message_callback, dedup)
+
+    return FrameReplayer(path, on_frame, speed, on_done=pipeline.stop if owns_pipeline else None)
+
+class CountingTTS:
+    """Stand-in for TTSManager that only counts what would have been spoken."""
+
+    def __init__(self):
+        self.tasks = 0
+
+    def add_task(self, text, voice_index, **kwargs):
+        self.tasks += 1
+
+if __name__ == '__main__':
+    # Replay a capture offline: python frame_capture.py <file> [--speed N] [--tts] [--enable chat,gift,...]
+    import argparse
+    from message_handler import MessageHandler
+
+    parser = argparse.ArgumentParser(description="Replay a captured live room through MessageHandler")
+    parser.add_argument('path')
+    parser.add_argument('--speed', type=float, default=1.0, help="1 = real time, 0 = as fast as possible")
+    parser.add_argument('--tts', action='store_true', help="speak through the real TTSManager")
+    parser.add_argument('--enable', default='chat,gift,follow,welcome', help="speech toggles to turn on")
+    args = parser.parse_args()
+
+    if args.tts:
+        from tts_manager import TTSManager, consumer_thread_worker
+        from tts_scheduler import TTSScheduler
+        task_queue = TTSScheduler()
+        tts = TTSManager(task_queue)
+        threading.Thread(target=consumer_thread_worker, args=(task_queue,), daemon=True).start()
+    else:
+        tts = CountingTTS()
+    handler = MessageHandler(tts, lambda count: None)
+    toggles = {'chat': 'speech_enabled', 'gift': 'gift_enabled', 'follow': 'follow_enabled', 'welcome': 'welcome_enabled'}
+    for name in filter(None, args.enable.split(',')):
+        setattr(handler, toggles[name], True)
+
+    replayer = replay_to_callback(args.path, handler.handle_message, args.speed)
+    duration = replayer.run()
+    if isinstance(tts, CountingTTS):
+        log.info(f"{replayer.frames / max(duration, 1e-9):.0f} frames/s, {tts.tasks} TTS tasks")
@@ -0,0 +1,152 @@
+# ingest_pipeline.py
+import asyncio
+import threading
+import time
+from collections import deque
+from protobuf.douyin import Response
+from protobuf.wire import scan_response
+import config
+from logger import log
+
+DROP_NEWEST = 'drop_newest'
+DROP_OLDEST = 'drop_oldest'
+BLOCK = 'block'
+
+class IngestPipeline:
+    """Decodes and dispatches decompressed Response buffers off the receive thread.
+
+    The receive thread only acks the frame and calls ``submit``. A pool of
+    worker threads scans the messages and runs the handlers. The queue is
+    bounded; when it is full ``drop_policy`` decides whether the new buffer
+    (``drop_newest``), the oldest queued one (``drop_oldest``) is dropped, or
+    the receive thread waits up to ``block_timeout`` (``block``).
+    With more than one worker, frames may be dispatched out of order; with
+    zero workers ``submit`` dispatches inline on the caller's thread.
+    Messages whose id the frame's ``dedup`` index has already seen are
+    skipped before any handler decodes their payload. An event loop calls
+    ``submit_async``, so a ``block`` wait does not stall its other rooms.
+    ``stop`` dispatches what is still queued before the workers exit.
+    """
+
+    def __init__(self, workers=None, max_queue=None, drop_policy=None, block_timeout=0.1):
+        self.workers = workers if workers is not None else config.INGEST_WORKERS
+        self.max_queue = max_queue or config.INGEST_QUEUE_SIZE
+        self.drop_policy = drop_policy or config.INGEST_DROP_POLICY
+        self.block_timeout = block_timeout
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._threads = []
+        self._running = False
+        self.stats = {
+            'submitted': 0,
+            'processed': 0,
+            'dropped': 0,
+            'duplicates': 0,
+            'errors': 0,
+            'max_depth': 0,
+            'wait_total': 0.0,
+            'wait_max': 0.0,
+        }
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"ingest-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """Stops accepting frames and waits until the workers have dispatched the queued ones."""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    @property
+    def depth(self):
+        return len(self._queue)
+
+    def submit(self, response_bytes, on_message_callback, dedup=None, block=True):
+        """Queues a frame; returns whether it was accepted.
+
+        With ``block=False`` a full queue under the ``block`` policy returns
+        None instead of waiting, and nothing is counted.
+        """
+        if self.workers == 0:
+            self._dispatch(response_bytes, on_message_callback, dedup)
+            return True
+        item = (response_bytes, on_message_callback, dedup, time.monotonic())
+        with self._cond:
+            if not self._running:
+                return False
+            full = len(self._queue) >= self.max_queue
+            if full and self.drop_policy == BLOCK and not block:
+                return None
+            self.stats['submitted'] += 1
+            if full:
+                if self.drop_policy == DROP_OLDEST:
+                    self._queue.popleft()
+                    self._record_drop()
+                elif self.drop_policy == BLOCK and self._cond.wait_for(
+                        lambda: len(self._queue) < self.max_queue or not self._running, self.block_timeout):
+                    if not self._running:
+                        self._record_drop()
+                        return False
+                else:
+                    self._record_drop()
+                    return False
+            self._queue.append(item)
+            self.stats['max_depth'] = max(self.stats['max_depth'], len(self._queue))
+            self._cond.notify()
+        return True
+
+    async def submit_async(self, response_bytes, on_message_callback, dedup=None):
+        """``submit`` from an event loop: a ``block`` wait runs on an executor thread."""
+        accepted = self.submit(response_bytes, on_message_callback, dedup, block=False)
+        if accepted is None:
+            accepted = await asyncio.get_running_loop().run_in_executor(
+                None, self.submit, response_bytes, on_message_callback, dedup)
+        return accepted
+
+    def _record_drop(self):
+        self.stats['dropped'] += 1
+        dropped = self.stats['dropped']
+        if dropped == 1 or dropped % 100 == 0:
+            log.warning(f"Ingest queue full ({self.max_queue}), dropped {dropped} frames so far")
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._queue or not self._running)
+                if not self._queue:
+                    return
+                response_bytes, on_message_callback, dedup, enqueued = self._queue.popleft()
+                self._cond.notify_all()
+                wait = time.monotonic() - enqueued
+                self.stats['wait_total'] += wait
+                self.stats['wait_max'] = max(self.stats['wait_max'], wait)
+            self._dispatch(response_bytes, on_message_callback, dedup)
+            with self._cond:
+                self.stats['processed'] += 1
+
+    def _dispatch(self, response_bytes, on_message_callback, dedup=None):
+        try:
+            if config.LAZY_DECODE:
+                response = scan_response(response_bytes)
+            else:
+                response = Response().parse(response_bytes)
+            for msg in response.messages_list:
+                if dedup is not None and dedup.seen(msg):
+                    with self._cond:
+                        self.stats['duplicates'] += 1
+                    continue
+                on_message_callback(msg.method, msg.payload)
+        except Exception as e:
+            with self._cond:
+                self.stats['errors'] += 1
+            log.error(f"Error dispatching frame: {e}")
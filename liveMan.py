@@ -6,25 +6,19 @@
 # @Author:      bubu
 # @Project:     douyinLiveWebFetcher
 
-import codecs
 import gzip
-import hashlib
-import os
 import random
 import re
 import string
 import subprocess
-import sys
 import queue
-import urllib.parse
 from contextlib import contextmanager
 import tkinter as tk
-from py_mini_racer import MiniRacer
+from utils import get_signer
 from unittest.mock import patch
 import requests
 import websocket
 from protobuf.douyin import *
-import uuid
 import threading
 from txt_speak import play_speech_thread
 
@@ -45,37 +39,9 @@ def generateSignature(wss, script_file='sign.js'):
     """
     出现gbk编码问题则修改 python模块subprocess.py的源码中Popen类的__init__函数参数encoding值为 "utf-8"
     """
-    # 获取运行路径
-    if getattr(sys, 'frozen', False):
-        # PyInstaller 打包后的路径
-        base_path = sys._MEIPASS
-    else:
-        # 脚本直接运行时的路径
-        base_path = os.path.dirname(__file__)
-
-    # 获取sign.js的完整路径
-    script_path = os.path.join(base_path, script_file)
-    params = ("live_id,aid,version_code,webcast_sdk_version,"
-              "room_id,sub_room_id,sub_channel_id,did_rule,"
-              "user_unique_id,device_platform,device_type,ac,"
-              "identity").split(',')
-    wss_params = urllib.parse.urlparse(wss).query.split('&')
-    wss_maps = {i.split('=')[0]: i.split("=")[-1] for i in wss_params}
-    tpl_params = [f"{i}={wss_maps.get(i, '')}" for i in params]
-    param = ','.join(tpl_params)
-    md5 = hashlib.md5()
-    md5.update(param.encode())
-    md5_param = md5.hexdigest()
-
-    with codecs.open(script_path, 'r', encoding='utf8') as f:
-        script = f.read()
-
-    ctx = MiniRacer()
-    ctx.eval(script)
-
+    # 复用已加载 sign.js 的 V8 上下文，重连时不再重复启动 MiniRacer
     try:
-        signature = ctx.call("get_sign", md5_param)
-        return signature
+        return get_signer(script_file).sign(wss)
     except Exception as e:
         print(e)
 
@@ -501,10 +467,8 @@ class DouyinLiveWebFetcher:
 
     def handle_chat_message(self, user_name, content):
         def task():
-            unique_id = str(uuid.uuid4())
-            output_file = f"msic/MemberMsg_{unique_id}.mp3"
             text = f"{user_name}说：{content}。"
-            play_speech_thread(text, output_file, v_num=0)
+            play_speech_thread(text, v_num=0)
 
         try:
             self.task_queue.put(task, timeout=1)  # 等待 1 秒尝试放入队列
@@ -531,10 +495,8 @@ class DouyinLiveWebFetcher:
     def handle_gift_message(self, user_name, gift_name):
         # 生成唯一的语音文件名
         def task():
-            unique_id = str(uuid.uuid4())
-            output_file = f"msic/GiftMsg_{unique_id}.mp3"
             text = f"超级感谢 {user_name} 送出的 {gift_name}！"
-            play_speech_thread(text, output_file, v_num=1)
+            play_speech_thread(text, v_num=1)
 
         try:
             self.task_queue.put(task, timeout=1)  # 等待 1 秒尝试放入队列
@@ -574,10 +536,8 @@ class DouyinLiveWebFetcher:
     def handle_welcome_message(self, user_name):
         # 生成唯一的语音文件名
         def task():
-            unique_id = str(uuid.uuid4())
-            output_file = f"msic/WelcomeMsg_{unique_id}.mp3"
             text = f"欢迎 {user_name} 进入直播间！"
-            play_speech_thread(text, output_file, v_num=random.randint(0, 5))
+            play_speech_thread(text, v_num=random.randint(0, 5))
 
         # 将任务加入队列
         try:
@@ -603,10 +563,8 @@ class DouyinLiveWebFetcher:
     def handle_follow_message(self, user_name):
         # 生成唯一的语音文件名
         def task():
-            unique_id = str(uuid.uuid4())
-            output_file = f"msic/FollowMsg_{unique_id}.mp3"
             text = f"感谢 {user_name} 关注主播！"
-            play_speech_thread(text, output_file, v_num=3)
+            play_speech_thread(text, v_num=3)
 
         # 将任务加入队列
         try:
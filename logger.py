@@ -1,24 +1,212 @@
 # logger.py
+import atexit
 import logging
+import os
+import queue
 import sys
+import threading
+import time
+import config
+
+FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+def record_category(record):
+    """Returns the 【...】 prefix of a message, or None."""
+    message = record.msg if isinstance(record.msg, str) else ''
+    if message.startswith('【'):
+        end = message.find('】')
+        if end > 0:
+            return message[:end + 1]
+    return None
+
+class CategoryFilter(logging.Filter):
+    """Samples (1 in N) and rate-limits (N per second) lines per message category.
+
+    Only INFO and below are thinned out; warnings and errors always pass.
+    """
+
+    def __init__(self, sampling=None, rate_limits=None):
+        super().__init__()
+        self.sampling = config.LOG_SAMPLING if sampling is None else sampling
+        self.rate_limits = config.LOG_RATE_LIMITS if rate_limits is None else rate_limits
+        self._seen = {}
+        self._windows = {}
+        self._lock = threading.Lock()
+        self.sampled_out = {}
+        self.rate_limited = {}
+
+    def filter(self, record):
+        if record.levelno > logging.INFO:
+            return True
+        category = record_category(record)
+        if category is None:
+            return True
+        with self._lock:
+            every = self.sampling.get(category)
+            if every and every > 1:
+                seen = self._seen.get(category, 0)
+                self._seen[category] = seen + 1
+                if seen % every:
+                    self.sampled_out[category] = self.sampled_out.get(category, 0) + 1
+                    return False
+            limit = self.rate_limits.get(category)
+            if limit:
+                second = int(time.monotonic())
+                window, count = self._windows.get(category, (second, 0))
+                if window != second:
+                    window, count = second, 0
+                if count >= limit:
+                    self.rate_limited[category] = self.rate_limited.get(category, 0) + 1
+                    return False
+                self._windows[category] = (window, count + 1)
+        return True
+
+class AsyncQueueHandler(logging.Handler):
+    """Hands records to a BatchWriter without formatting or blocking; drops them when its queue is full."""
+
+    def __init__(self, writer):
+        super().__init__()
+        self.writer = writer
+
+    def emit(self, record):
+        if record.args or record.exc_info:
+            # Resolve everything that refers to caller state before crossing threads
+            record.msg = record.getMessage()
+            record.args = None
+            if record.exc_info:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+                record.exc_info = None
+        self.writer.put(record)
+
+class BatchWriter:
+    """Background thread that formats queued records and writes them in batches.
+
+    Each batch is written to stdout and to ``path`` with one write and one
+    flush per stream. The file is rotated to ``path.1`` ... ``path.N`` once it
+    grows past ``max_bytes``.
+    """
+
+    def __init__(self, path=None, max_bytes=None, backup_count=None, queue_size=None, batch_size=None, stream=None):
+        self.path = path or config.LOG_FILE
+        self.max_bytes = config.LOG_MAX_BYTES if max_bytes is None else max_bytes
+        self.backup_count = config.LOG_BACKUP_COUNT if backup_count is None else backup_count
+        self.batch_size = batch_size or config.LOG_BATCH_SIZE
+        self.stream = stream or sys.stdout
+        self.formatter = logging.Formatter(FORMAT)
+        self._queue = queue.Queue(queue_size or config.LOG_QUEUE_SIZE)
+        self._file = open(self.path, 'a', encoding='utf-8')
+        self._size = os.path.getsize(self.path)
+        self._thread = None
+        self.stats = {'queued': 0, 'written': 0, 'dropped': 0, 'batches': 0, 'rotations': 0}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def put(self, record):
+        try:
+            self._queue.put_nowait(record)
+            self.stats['queued'] += 1
+        except queue.Full:
+            self.stats['dropped'] += 1
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        self._file.close()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stopping = batch[-1] is None
+            records = [record for record in batch if record is not None]
+            if records:
+                self._write(records)
+            if stopping:
+                return
+
+    def _write(self, records):
+        lines = []
+        for record in records:
+            try:
+                lines.append(self.formatter.format(record) + '\n')
+            except Exception:
+                self.stats['dropped'] += 1
+        text = ''.join(lines)
+        size = len(text.encode('utf-8'))
+        try:
+            self.stream.write(text)
+            self.stream.flush()
+            if self.max_bytes and self._size and self._size + size > self.max_bytes:
+                self._rotate()
+            self._file.write(text)
+            self._file.flush()
+            self._size += size
+        except (OSError, ValueError) as e:
+            self.stats['dropped'] += len(lines)
+            sys.stderr.write(f"Log writer failed: {e}\n")
+            return
+        self.stats['written'] += len(lines)
+        self.stats['batches'] += 1
+
+    def _rotate(self):
+        self._file.close()
+        for index in range(self.backup_count - 1, 0, -1):
+            source = f"{self.path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index + 1}")
+        if self.backup_count > 0:
+            os.replace(self.path, f"{self.path}.1")
+        self._file = open(self.path, 'w', encoding='utf-8')
+        self._size = 0
+        self.stats['rotations'] += 1
+
+def log_stats():
+    """Counters of the logging backend: writer throughput/drops and per-category filtering."""
+    stats = {}
+    if writer is not None:
+        stats.update(writer.stats)
+    stats['sampled_out'] = dict(category_filter.sampled_out)
+    stats['rate_limited'] = dict(category_filter.rate_limited)
+    return stats
 
 def setup_logger():
+    global writer
     logger = logging.getLogger()
     logger.setLevel(logging.INFO)
 
-    # Create handlers
-    stream_handler = logging.StreamHandler(sys.stdout)
-    file_handler = logging.FileHandler('app.log', encoding='utf-8')
+    if config.LOG_ASYNC:
+        # One background thread formats and writes for both outputs
+        writer = BatchWriter()
+        writer.start()
+        atexit.register(writer.stop)
+        handlers = [AsyncQueueHandler(writer)]
+    else:
+        # Create handlers
+        stream_handler = logging.StreamHandler(sys.stdout)
+        file_handler = logging.FileHandler(config.LOG_FILE, encoding='utf-8')
 
-    # Create formatters and add it to handlers
-    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-    stream_handler.setFormatter(formatter)
-    file_handler.setFormatter(formatter)
+        # Create formatters and add it to handlers
+        formatter = logging.Formatter(FORMAT)
+        stream_handler.setFormatter(formatter)
+        file_handler.setFormatter(formatter)
+        handlers = [stream_handler, file_handler]
 
     # Add handlers to the logger
-    logger.addHandler(stream_handler)
-    logger.addHandler(file_handler)
+    for handler in handlers:
+        logger.addHandler(handler)
+    logger.addFilter(category_filter)
 
     return logger
 
+writer = None
+category_filter = CategoryFilter()
 log = setup_logger()
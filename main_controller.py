@@ -1,18 +1,27 @@
 # main_controller.py
-import queue
 import threading
 from gui import AppGUI
 from websocket_client import WebSocketClient
+from async_websocket_client import MultiRoomClient
+import config
+from room_resolver import get_resolver
 from message_handler import MessageHandler
+from danmaku_archive import DanmakuArchive
 from tts_manager import TTSManager, consumer_thread_worker
+from tts_scheduler import TTSScheduler
 from logger import log
 
 class MainController:
     def __init__(self):
-        self.task_queue = queue.Queue(maxsize=100)
+        self.task_queue = TTSScheduler()
         self.tts_manager = TTSManager(self.task_queue)
         self.message_handler = MessageHandler(self.tts_manager, self.update_gui_viewers)
         self.ws_client = None
+        self.room_client = MultiRoomClient(self.message_handler.handle_message) if config.USE_ASYNC_CLIENT else None
+        self.archive = None
+        if config.ARCHIVE_PATH:
+            self.archive = DanmakuArchive()
+            self.archive.attach(self.message_handler)
         
         toggle_callbacks = {
             "chat": self.toggle_speech,
@@ -22,10 +31,19 @@ class MainController:
         }
         self.gui = AppGUI(self.start, self.stop, toggle_callbacks)
         
-        self.consumer_thread = threading.Thread(target=consumer_thread_worker, args=(self.task_queue,), daemon=True)
-        self.consumer_thread.start()
+        if config.TTS_PIPELINE_DEPTH > 1:
+            self.tts_manager.start_pipeline()
+        else:
+            self.consumer_thread = threading.Thread(target=consumer_thread_worker, args=(self.task_queue,), daemon=True)
+            self.consumer_thread.start()
 
     def start(self, live_id):
+        if self.room_client:
+            self.room_client.remove_all_rooms()
+            self.room_client.add_room(live_id)
+            log.info(f"Started connection for live ID: {live_id}")
+            return
+
         if self.ws_client:
             self.ws_client.stop()
         
@@ -33,14 +51,27 @@ class MainController:
         self.ws_client.start()
         log.info(f"Started connection for live ID: {live_id}")
 
+    def start_rooms(self, live_ids):
+        if not self.room_client:
+            raise RuntimeError("Watching several rooms requires USE_ASYNC_CLIENT")
+        get_resolver().resolve_many(live_ids)
+        for live_id in live_ids:
+            self.room_client.add_room(live_id)
+        log.info(f"Started connections for {len(live_ids)} live IDs")
+
     def stop(self):
+        if self.room_client and self.room_client.rooms:
+            self.room_client.remove_all_rooms()
+            log.info("Stopped connection.")
+
         if self.ws_client:
             self.ws_client.stop()
             self.ws_client = None
             log.info("Stopped connection.")
         
-        with self.task_queue.mutex:
-            self.task_queue.queue.clear()
+        self.message_handler.aggregator.close()
+        self.task_queue.clear()
+        self.tts_manager.report_cache()
 
     def update_gui_viewers(self, count):
         self.gui.after(0, self.gui.update_viewers_count, count)
@@ -63,3 +94,5 @@ class MainController:
 
     def run(self):
         self.gui.run()
+        if self.archive:
+            self.archive.close()
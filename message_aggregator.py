@@ -0,0 +1,126 @@
+# message_aggregator.py
+import threading
+import time
+import config
+
+LIKE_SUMMARY = 'LikeSummary'
+VIEWER_SUMMARY = 'ViewerSummary'
+
+class LikeSummary:
+    """Likes of one room folded over a window: {user_id: [nick_name, likes]} plus totals."""
+
+    def __init__(self, room_id, start):
+        self.room_id = room_id
+        self.start = start
+        self.end = start
+        self.users = {}
+        self.count = 0
+        self.messages = 0
+        self.room_total = 0
+
+    def add(self, message):
+        entry = self.users.get(message.user.id)
+        if entry is None:
+            entry = self.users[message.user.id] = [message.user.nick_name, 0]
+        entry[1] += message.count
+        self.count += message.count
+        self.messages += 1
+        self.room_total = max(self.room_total, message.total)
+
+    def top(self, n=3):
+        return sorted(self.users.values(), key=lambda entry: entry[1], reverse=True)[:n]
+
+class ViewerSummary:
+    """Viewer-count updates of one room folded over a window; ``total`` is the latest count."""
+
+    def __init__(self, room_id, start):
+        self.room_id = room_id
+        self.start = start
+        self.end = start
+        self.total = 0
+        self.low = None
+        self.high = None
+        self.messages = 0
+
+    def add(self, message):
+        self.total = message.total
+        self.low = message.total if self.low is None else min(self.low, message.total)
+        self.high = message.total if self.high is None else max(self.high, message.total)
+        self.messages += 1
+
+class WindowAggregator:
+    """Folds high-rate messages into one summary per room and kind every ``window`` seconds.
+
+    ``add`` only updates the open summary; the first message of a window
+    sets its deadline, and one long-lived flusher thread hands all
+    summaries of that window to ``on_flush`` (kind, summary) once it
+    passes. With ``window`` 0 every message is flushed immediately, which
+    keeps the old per-message behaviour. ``close`` stops the flusher and
+    flushes what is left; a later ``add`` starts a new one.
+    """
+
+    def __init__(self, on_flush, window=None):
+        self.on_flush = on_flush
+        self.window = config.AGGREGATION_WINDOW if window is None else window
+        self._open = {}
+        self._cond = threading.Condition()
+        self._deadline = None  # time.monotonic() at which the open window is flushed
+        self._thread = None
+
+    def add(self, kind, message):
+        summary_class = LikeSummary if kind == LIKE_SUMMARY else ViewerSummary
+        room_id = message.common.room_id
+        now = time.time()
+        with self._cond:
+            summary = self._open.get((kind, room_id))
+            if summary is None:
+                summary = self._open[(kind, room_id)] = summary_class(room_id, now)
+            summary.add(message)
+            summary.end = now
+            if self.window <= 0:
+                pending = self._take()
+            else:
+                pending = None
+                if self._deadline is None:
+                    self._deadline = time.monotonic() + self.window
+                    self._cond.notify()
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="aggregator-flush", daemon=True)
+                    self._thread.start()
+        if pending:
+            self._emit(pending)
+
+    def flush(self):
+        with self._cond:
+            self._deadline = None
+            pending = self._take()
+        self._emit(pending)
+
+    def close(self):
+        with self._cond:
+            thread, self._thread = self._thread, None
+            self._cond.notify_all()
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+        self.flush()
+
+    def _run(self):
+        current = threading.current_thread()
+        while True:
+            with self._cond:
+                while self._thread is current and (self._deadline is None or self._deadline > time.monotonic()):
+                    self._cond.wait(None if self._deadline is None else self._deadline - time.monotonic())
+                if self._thread is not current:
+                    return
+                self._deadline = None
+                pending = self._take()
+            self._emit(pending)
+
+    def _take(self):
+        pending = self._open
+        self._open = {}
+        return pending
+
+    def _emit(self, pending):
+        for (kind, _), summary in pending.items():
+            self.on_flush(kind, summary)
@@ -0,0 +1,41 @@
+# message_dedup.py
+import threading
+import config
+from protobuf.wire import scan_common_msg_id
+
+class MessageDedup:
+    """Remembers the last ``capacity`` message ids of one room.
+
+    A fixed ring of ids plus a set over the same ids gives O(1) lookups in
+    constant memory; the oldest id is forgotten when the ring wraps. Douyin
+    re-sends recent messages after a reconnect (``need_persist_msg_count``),
+    so a room keeps one instance for as long as it is watched.
+    """
+
+    def __init__(self, capacity=None):
+        self.capacity = capacity or config.DEDUP_CAPACITY
+        self._ring = [None] * self.capacity
+        self._next = 0
+        self._seen = set()
+        self._lock = threading.Lock()
+        self.duplicates = 0
+
+    def seen(self, msg):
+        """Records ``msg`` and returns True if a message with the same id was already seen."""
+        msg_id = msg.msg_id or scan_common_msg_id(msg.payload)
+        if not msg_id:
+            return False
+        with self._lock:
+            if msg_id in self._seen:
+                self.duplicates += 1
+                return True
+            oldest = self._ring[self._next]
+            if oldest is not None:
+                self._seen.discard(oldest)
+            self._ring[self._next] = msg_id
+            self._next = (self._next + 1) % self.capacity
+            self._seen.add(msg_id)
+        return False
+
+    def __len__(self):
+        return len(self._seen)
@@ -4,6 +4,9 @@ from protobuf.douyin import (
     RoomUserSeqMessage, FansclubMessage, ControlMessage, EmojiChatMessage,
     RoomMessage, RoomStatsMessage, RoomRankMessage
 )
+import config
+from protobuf.fast import FAST_DECODERS
+from message_aggregator import WindowAggregator, LIKE_SUMMARY, VIEWER_SUMMARY
 from logger import log
 
 class MessageHandler:
@@ -28,83 +31,159 @@ class MessageHandler:
             'WebcastRoomStatsMessage': self._parse_room_stats_msg,
             'WebcastRoomRankMessage': self._parse_rank_msg,
         }
+        # Message types that are always needed regardless of logging
+        self.required_messages = {'WebcastRoomUserSeqMessage', 'WebcastControlMessage'}
+        self.speech_toggles = {
+            'WebcastChatMessage': 'speech_enabled',
+            'WebcastGiftMessage': 'gift_enabled',
+            'WebcastMemberMessage': 'welcome_enabled',
+            'WebcastSocialMessage': 'follow_enabled',
+        }
+        # Raw message types whose summaries are delivered to LIKE_SUMMARY / VIEWER_SUMMARY subscribers
+        self.summary_methods = {
+            'WebcastLikeMessage': LIKE_SUMMARY,
+            'WebcastRoomUserSeqMessage': VIEWER_SUMMARY,
+        }
+        self.subscribers = {}
+        self.aggregator = WindowAggregator(self._on_summary)
+
+    def subscribe(self, method, callback):
+        """Registers callback(method, message) for decoded messages of a type.
+
+        LIKE_SUMMARY and VIEWER_SUMMARY deliver one LikeSummary/ViewerSummary
+        per room and aggregation window instead of every raw message.
+        """
+        self.subscribers.setdefault(method, []).append(callback)
+
+    def unsubscribe(self, method, callback):
+        callbacks = self.subscribers.get(method)
+        if callbacks and callback in callbacks:
+            callbacks.remove(callback)
+            if not callbacks:
+                del self.subscribers[method]
+
+    def wants(self, method):
+        if method not in self.message_handlers:
+            return False
+        if method in self.required_messages or method in config.LOGGED_MESSAGES:
+            return True
+        if method in self.subscribers or self.summary_methods.get(method) in self.subscribers:
+            return True
+        toggle = self.speech_toggles.get(method)
+        return toggle is not None and getattr(self, toggle)
 
     def handle_message(self, method, payload):
-        handler = self.message_handlers.get(method)
-        if handler:
-            try:
-                handler(payload)
-            except Exception as e:
-                log.error(f"Error handling message {method}: {e}")
+        if not self.wants(method):
+            return
+        try:
+            message = self.message_handlers[method](payload)
+            for callback in self.subscribers.get(method, ()):
+                callback(method, message)
+        except Exception as e:
+            log.error(f"Error handling message {method}: {e}")
+
+    def _decode(self, message_class, payload):
+        decoder = FAST_DECODERS.get(message_class) if config.FAST_DECODE else None
+        if decoder:
+            return decoder(payload)
+        return message_class().parse(payload)
 
     def _parse_chat_msg(self, payload):
-        message = ChatMessage().parse(payload)
+        message = self._decode(ChatMessage, payload)
         user_name = message.user.nick_name
         content = message.content
         log.info(f"【聊天】{user_name}: {content}")
         if self.speech_enabled:
             text = f"{user_name}说：{content}。"
-            self.tts_manager.add_task(text, 0)
+            self.tts_manager.add_task(text, 0, category="chat")
+        return message
 
     def _parse_gift_msg(self, payload):
-        message = GiftMessage().parse(payload)
+        message = self._decode(GiftMessage, payload)
         user_name = message.user.nick_name
         gift_name = message.gift.name
         log.info(f"【礼物】{user_name} 送出 {gift_name}")
         if self.gift_enabled:
             text = f"感谢 {user_name} 送出的 {gift_name}！"
-            self.tts_manager.add_task(text, 1)
+            segments = (("感谢", True), (user_name, False), ("送出的", True), (f"{gift_name}！", True))
+            self.tts_manager.add_task(text, 1, category="gift", segments=segments)
+        return message
 
     def _parse_like_msg(self, payload):
-        message = LikeMessage().parse(payload)
-        user_name = message.user.nick_name
-        count = message.count
-        log.info(f"【点赞】{user_name} 点赞了 {count} 次")
+        message = self._decode(LikeMessage, payload)
+        self.aggregator.add(LIKE_SUMMARY, message)
+        return message
 
     def _parse_member_msg(self, payload):
-        message = MemberMessage().parse(payload)
+        message = self._decode(MemberMessage, payload)
         user_name = message.user.nick_name
         log.info(f"【成员】{user_name} 进入直播间！")
         if self.welcome_enabled:
             text = f"欢迎 {user_name} 进入直播间！"
-            self.tts_manager.add_task(text, 1)
+            segments = (("欢迎", True), (user_name, False), ("进入直播间！", True))
+            self.tts_manager.add_task(text, 1, category="welcome", name=user_name, segments=segments)
+        return message
 
     def _parse_social_msg(self, payload):
-        message = SocialMessage().parse(payload)
+        message = self._decode(SocialMessage, payload)
         user_name = message.user.nick_name
         log.info(f"【社交】{user_name} 关注了主播！")
         if self.follow_enabled:
             text = f"感谢 {user_name} 关注主播！"
-            self.tts_manager.add_task(text, 3)
+            segments = (("感谢", True), (user_name, False), ("关注主播！", True))
+            self.tts_manager.add_task(text, 3, category="follow", name=user_name, segments=segments)
+        return message
 
     def _parse_room_user_seq_msg(self, payload):
-        message = RoomUserSeqMessage().parse(payload)
-        current = message.total
-        self.gui_update_callback(current)
-        log.info(f"【统计】当前观众: {current}")
+        message = self._decode(RoomUserSeqMessage, payload)
+        self.aggregator.add(VIEWER_SUMMARY, message)
+        return message
+
+    def _on_summary(self, kind, summary):
+        try:
+            if kind == LIKE_SUMMARY:
+                if summary.messages == 1:
+                    user_name, count = summary.top(1)[0]
+                    log.info(f"【点赞】{user_name} 点赞了 {count} 次")
+                else:
+                    top = '，'.join(f"{name} {count} 次" for name, count in summary.top())
+                    log.info(f"【点赞】{len(summary.users)} 人点赞了 {summary.count} 次（{top}）")
+            else:
+                self.gui_update_callback(summary.total)
+                log.info(f"【统计】当前观众: {summary.total}")
+            for callback in self.subscribers.get(kind, ()):
+                callback(kind, summary)
+        except Exception as e:
+            log.error(f"Error handling {kind}: {e}")
 
     def _parse_fansclub_msg(self, payload):
-        message = FansclubMessage().parse(payload)
+        message = self._decode(FansclubMessage, payload)
         log.info(f"【粉丝团】{message.content}")
+        return message
 
     def _parse_control_msg(self, payload):
-        message = ControlMessage().parse(payload)
+        message = self._decode(ControlMessage, payload)
         if message.status == 3:
             log.info("直播间已结束。")
             # Here you might want to signal the main controller to stop everything.
+        return message
 
     def _parse_emoji_chat_msg(self, payload):
-        message = EmojiChatMessage().parse(payload)
+        message = self._decode(EmojiChatMessage, payload)
         log.info(f"【表情】{message.user.nick_name} 发送了一个表情。")
+        return message
 
     def _parse_room_msg(self, payload):
-        message = RoomMessage().parse(payload)
+        message = self._decode(RoomMessage, payload)
         log.info(f"【房间】房间消息: {message.common.room_id}")
+        return message
 
     def _parse_room_stats_msg(self, payload):
-        message = RoomStatsMessage().parse(payload)
+        message = self._decode(RoomStatsMessage, payload)
         log.info(f"【房间统计】{message.display_long}")
+        return message
 
     def _parse_rank_msg(self, payload):
-        message = RoomRankMessage().parse(payload)
+        message = self._decode(RoomRankMessage, payload)
         log.info(f"【排行】{message}。")
+        return message
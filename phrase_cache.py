@@ -0,0 +1,111 @@
+# phrase_cache.py
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+import config
+from logger import log
+
+class PhraseCache:
+    """LRU cache of synthesized MP3 audio keyed by (voice, text).
+
+    Memory use is bounded by ``max_bytes``; the least recently used phrases
+    are evicted first. With ``directory`` every stored phrase is also written
+    to ``<directory>/<voice>/<sha1>.mp3`` and read back on a memory miss, so
+    fixed phrases survive restarts.
+    """
+
+    def __init__(self, max_bytes=None, directory=None):
+        self.max_bytes = max_bytes or config.TTS_CACHE_MAX_BYTES
+        self.directory = directory if directory is not None else config.TTS_CACHE_DIR
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'stored': 0, 'evicted': 0, 'bytes_saved': 0}
+
+    def _path(self, voice, text):
+        digest = hashlib.sha1(text.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, voice, f"{digest}.mp3")
+
+    def get(self, voice, text):
+        key = (voice, text)
+        with self._lock:
+            audio = self._entries.get(key)
+            if audio is not None:
+                self._entries.move_to_end(key)
+                self.stats['hits'] += 1
+                self.stats['bytes_saved'] += len(audio)
+                return audio
+        audio = self._load(voice, text)
+        with self._lock:
+            if audio is None:
+                self.stats['misses'] += 1
+                return None
+            self.stats['hits'] += 1
+            self.stats['disk_hits'] += 1
+            self.stats['bytes_saved'] += len(audio)
+            self._insert(key, audio)
+        return audio
+
+    def put(self, voice, text, audio):
+        if not audio:
+            return
+        with self._lock:
+            self._insert((voice, text), audio)
+            self.stats['stored'] += 1
+        self._save(voice, text, audio)
+
+    def _insert(self, key, audio):
+        if len(audio) > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._bytes -= len(previous)
+        self._entries[key] = audio
+        self._bytes += len(audio)
+        while self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= len(evicted)
+            self.stats['evicted'] += 1
+
+    def _load(self, voice, text):
+        if not self.directory:
+            return None
+        path = self._path(voice, text)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except OSError as e:
+            log.warning(f"Ignoring unreadable cached phrase {path}: {e}")
+            return None
+
+    def _save(self, voice, text, audio):
+        if not self.directory:
+            return
+        path = self._path(voice, text)
+        tmp_path = f"{path}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                f.write(audio)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            log.error(f"Error saving cached phrase: {e}")
+
+    @property
+    def size(self):
+        return self._bytes
+
+    @property
+    def hit_rate(self):
+        lookups = self.stats['hits'] + self.stats['misses']
+        return self.stats['hits'] / lookups if lookups else 0.0
+
+    def report(self):
+        stats = self.stats
+        return (f"TTS phrase cache: {self.hit_rate:.0%} hit rate ({stats['hits']} hits, "
+                f"{stats['disk_hits']} from disk, {stats['misses']} misses), "
+                f"{stats['bytes_saved'] / 1024:.0f} KiB not re-synthesized, "
+                f"{len(self._entries)} phrases / {self._bytes / 1024:.0f} KiB held, {stats['evicted']} evicted")
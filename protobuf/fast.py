@@ -0,0 +1,361 @@
+# fast.py
+"""Hand-written decoders for the busiest Douyin message types.
+
+betterproto builds the full nested ``User``/``Common``/``Image``/``FansClub``
+tree for every message. These decoders walk the wire format directly and
+keep only the fields the app reads, in small ``__slots__`` records whose
+attribute names match the betterproto classes. Every other field is skipped
+by advancing the read position, without allocating anything for it.
+
+Records for absent sub-messages are shared empty instances; treat decoded
+records as read-only.
+"""
+from protobuf.douyin import ChatMessage, GiftMessage, LikeMessage, MemberMessage, RoomUserSeqMessage
+from protobuf.wire import WIRE_LENGTH, WIRE_VARINT, read_varint, skip_field, to_int64
+
+
+class FastCommon:
+    __slots__ = ('msg_id', 'room_id', 'create_time')
+
+    def __init__(self, msg_id=0, room_id=0, create_time=0):
+        self.msg_id = msg_id
+        self.room_id = room_id
+        self.create_time = create_time
+
+
+class FastUser:
+    __slots__ = ('id', 'nick_name')
+
+    def __init__(self, id=0, nick_name=''):
+        self.id = id
+        self.nick_name = nick_name
+
+
+class FastGift:
+    __slots__ = ('id', 'name', 'diamond_count')
+
+    def __init__(self, id=0, name='', diamond_count=0):
+        self.id = id
+        self.name = name
+        self.diamond_count = diamond_count
+
+
+class FastChatMessage:
+    __slots__ = ('common', 'user', 'content')
+
+
+class FastGiftMessage:
+    __slots__ = ('common', 'user', 'gift', 'gift_id', 'group_count', 'repeat_count', 'combo_count', 'group_id')
+
+
+class FastMemberMessage:
+    __slots__ = ('common', 'user')
+
+
+class FastLikeMessage:
+    __slots__ = ('common', 'user', 'count', 'total')
+
+
+class FastRoomUserSeqMessage:
+    __slots__ = ('common', 'total', 'total_pv_for_anchor')
+
+
+EMPTY_COMMON = FastCommon()
+EMPTY_USER = FastUser()
+EMPTY_GIFT = FastGift()
+
+
+def _read_bytes(buf, pos):
+    length, pos = read_varint(buf, pos)
+    return buf[pos:pos + length], pos + length
+
+
+def _read_str(buf, pos):
+    length, pos = read_varint(buf, pos)
+    return str(buf[pos:pos + length], 'utf-8'), pos + length
+
+
+def decode_common(buf):
+    common = FastCommon()
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        key, pos = read_varint(buf, pos)
+        field, wire_type = key >> 3, key & 7
+        if wire_type == WIRE_VARINT and field == 2:
+            common.msg_id, pos = read_varint(buf, pos)
+        elif wire_type == WIRE_VARINT and field == 3:
+            common.room_id, pos = read_varint(buf, pos)
+        elif wire_type == WIRE_VARINT and field == 4:
+            common.create_time, pos = read_varint(buf, pos)
+        else:
+            pos = skip_field(buf, pos, wire_type)
+    return common
+
+
+def decode_user(buf):
+    user = FastUser()
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        key, pos = read_varint(buf, pos)
+        field, wire_type = key >> 3, key & 7
+        if wire_type == WIRE_VARINT and field == 1:
+            user.id, pos = read_varint(buf, pos)
+        elif wire_type == WIRE_LENGTH and field == 3:
+            user.nick_name, pos = _read_str(buf, pos)
+        else:
+            pos = skip_field(buf, pos, wire_type)
+    return user
+
+
+def decode_gift_struct(buf):
+    gift = FastGift()
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        key, pos = read_varint(buf, pos)
+        field, wire_type = key >> 3, key & 7
+        if wire_type == WIRE_VARINT and field == 5:
+            gift.id, pos = read_varint(buf, pos)
+        elif wire_type == WIRE_VARINT and field == 12:
+            gift.diamond_count, pos = read_varint(buf, pos)
+        elif wire_type == WIRE_LENGTH and field == 16:
+            gift.name, pos = _read_str(buf, pos)
+        else:
+            pos = skip_field(buf, pos, wire_type)
+    return gift
+
+
+def decode_chat_message(buf):
+    buf = memoryview(buf)
+    message = FastChatMessage()
+    message.common = EMPTY_COMMON
+    message.user = EMPTY_USER
+    message.content = ''
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        key, pos = read_varint(buf, pos)
+        field, wire_type = key >> 3, key & 7
+        if wire_type == WIRE_LENGTH and field == 1:
+            value, pos = _read_bytes(buf, pos)
+            message.common = decode_common(value)
+        elif wire_type == WIRE_LENGTH and field == 2:
+            value, pos = _read_bytes(buf, pos)
+            message.user = decode_user(value)
+        elif wire_type == WIRE_LENGTH and field == 3:
+            message.content, pos = _read_str(buf, pos)
+        else:
+            pos = skip_field(buf, pos, wire_type)
+    return message
+
+
+def decode_gift_message(buf):
+    buf = memoryview(buf)
+    message = FastGiftMessage()
+    message.common = EMPTY_COMMON
+    message.user = EMPTY_USER
+    message.gift = EMPTY_GIFT
+    message.gift_id = 0
+    message.group_count = 0
+    message.repeat_count = 0
+    message.combo_count = 0
+    message.group_id = 0
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        key, pos = read_varint(buf, pos)
+        field, wire_type = key >> 3, key & 7
+        if wire_type == WIRE_LENGTH and field == 1:
+            value, pos = _read_bytes(buf, pos)
+            message.common = decode_common(value)
+        elif wire_type == WIRE_VARINT and field == 2:
+            message.gift_id, pos = read_varint(buf, pos)
+        elif wire_type == WIRE_VARINT and field == 4:
+            message.group_count, pos = read_varint(buf, pos)
+        elif wire_type == WIRE_VARINT and field == 5:
+            message.repeat_count, pos = read_varint(buf, pos)
+        elif wire_type == WIRE_VARINT and field == 6:
+            message.combo_count, pos = read_varint(buf, pos)
+        elif wire_type == WIRE_VARINT and field == 11:
+            message.group_id, pos = read_varint(buf, pos)
+        elif wire_type == WIRE_LENGTH and field == 7:
+            value, pos = _read_bytes(buf, pos)
+            message.user = decode_user(value)
+        elif wire_type == WIRE_LENGTH and field == 15:
+            value, pos = _read_bytes(buf, pos)
+            message.gift = decode_gift_struct(value)
+        else:
+            pos = skip_field(buf, pos, wire_type)
+    return message
+
+
+def decode_member_message(buf):
+    buf = memoryview(buf)
+    message = FastMemberMessage()
+    message.common = EMPTY_COMMON
+    message.user = EMPTY_USER
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        key, pos = read_varint(buf, pos)
+        field, wire_type = key >> 3, key & 7
+        if wire_type == WIRE_LENGTH and field == 1:
+            value, pos = _read_bytes(buf, pos)
+            message.common = decode_common(value)
+        elif wire_type == WIRE_LENGTH and field == 2:
+            value, pos = _read_bytes(buf, pos)
+            message.user = decode_user(value)
+        else:
+            pos = skip_field(buf, pos, wire_type)
+    return message
+
+
+def decode_like_message(buf):
+    buf = memoryview(buf)
+    message = FastLikeMessage()
+    message.common = EMPTY_COMMON
+    message.user = EMPTY_USER
+    message.count = 0
+    message.total = 0
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        key, pos = read_varint(buf, pos)
+        field, wire_type = key >> 3, key & 7
+        if wire_type == WIRE_LENGTH and field == 1:
+            value, pos = _read_bytes(buf, pos)
+            message.common = decode_common(value)
+        elif wire_type == WIRE_VARINT and field == 2:
+            message.count, pos = read_varint(buf, pos)
+        elif wire_type == WIRE_VARINT and field == 3:
+            message.total, pos = read_varint(buf, pos)
+        elif wire_type == WIRE_LENGTH and field == 5:
+            value, pos = _read_bytes(buf, pos)
+            message.user = decode_user(value)
+        else:
+            pos = skip_field(buf, pos, wire_type)
+    return message
+
+
+def decode_room_user_seq_message(buf):
+    buf = memoryview(buf)
+    message = FastRoomUserSeqMessage()
+    message.common = EMPTY_COMMON
+    message.total = 0
+    message.total_pv_for_anchor = ''
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        key, pos = read_varint(buf, pos)
+        field, wire_type = key >> 3, key & 7
+        if wire_type == WIRE_LENGTH and field == 1:
+            value, pos = _read_bytes(buf, pos)
+            message.common = decode_common(value)
+        elif wire_type == WIRE_VARINT and field == 3:
+            total, pos = read_varint(buf, pos)
+            message.total = to_int64(total)
+        elif wire_type == WIRE_LENGTH and field == 11:
+            message.total_pv_for_anchor, pos = _read_str(buf, pos)
+        else:
+            pos = skip_field(buf, pos, wire_type)
+    return message
+
+
+FAST_DECODERS = {
+    ChatMessage: decode_chat_message,
+    GiftMessage: decode_gift_message,
+    MemberMessage: decode_member_message,
+    LikeMessage: decode_like_message,
+    RoomUserSeqMessage: decode_room_user_seq_message,
+}
+
+# Attribute paths compared against betterproto by ``diff_against_betterproto``
+COMPARED_FIELDS = {
+    ChatMessage: ('common.msg_id', 'common.room_id', 'common.create_time', 'user.id', 'user.nick_name', 'content'),
+    GiftMessage: ('common.msg_id', 'common.room_id', 'common.create_time', 'user.id', 'user.nick_name',
+                  'gift.id', 'gift.name', 'gift.diamond_count', 'gift_id', 'group_count', 'repeat_count',
+                  'combo_count', 'group_id'),
+    MemberMessage: ('common.msg_id', 'common.room_id', 'common.create_time', 'user.id', 'user.nick_name'),
+    LikeMessage: ('common.msg_id', 'common.room_id', 'common.create_time', 'user.id', 'user.nick_name',
+                  'count', 'total'),
+    RoomUserSeqMessage: ('common.msg_id', 'common.room_id', 'common.create_time', 'total', 'total_pv_for_anchor'),
+}
+
+
+def _get_path(obj, path):
+    for name in path.split('.'):
+        obj = getattr(obj, name)
+    return obj
+
+
+def diff_against_betterproto(message_class, payload):
+    """Returns (field, fast value, betterproto value) for every mismatch."""
+    fast = FAST_DECODERS[message_class](payload)
+    reference = message_class().parse(bytes(payload))
+    mismatches = []
+    for path in COMPARED_FIELDS[message_class]:
+        fast_value = _get_path(fast, path)
+        reference_value = _get_path(reference, path)
+        if fast_value != reference_value:
+            mismatches.append((path, fast_value, reference_value))
+    return mismatches
+
+
+KIND_CLASSES = {
+    'chat': ChatMessage,
+    'gift': GiftMessage,
+    'member': MemberMessage,
+    'like': LikeMessage,
+    'seq': RoomUserSeqMessage,
+}
+
+
+def _recorded_payloads(path):
+    from protobuf.wire import scan_frame
+    from frame_capture import read_frames
+
+    classes = {f"Webcast{cls.__name__}": cls for cls in FAST_DECODERS}
+    for _, frame in read_frames(path):
+        for message in scan_frame(frame)[1].messages_list:
+            message_class = classes.get(message.method)
+            if message_class:
+                yield message_class, message.payload
+
+
+def _synthetic_payloads(count):
+    from protobuf.synthetic import build_payload, make_rng
+
+    rng = make_rng(42)
+    for kind, message_class in KIND_CLASSES.items():
+        yield message_class, b''
+        for _ in range(count):
+            yield message_class, build_payload(kind, rng)[1]
+
+
+if __name__ == '__main__':
+    # Differential check against betterproto:
+    #   python -m protobuf.fast [--count N]        synthetic messages
+    #   python -m protobuf.fast --capture FILE     frames recorded by frame_capture
+    import argparse
+    import sys
+    from collections import Counter
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=2000)
+    parser.add_argument('--capture')
+    args = parser.parse_args()
+
+    payloads = _recorded_payloads(args.capture) if args.capture else _synthetic_payloads(args.count)
+    checked = Counter()
+    failures = 0
+    for message_class, payload in payloads:
+        checked[message_class.__name__] += 1
+        for path, fast_value, reference_value in diff_against_betterproto(message_class, payload):
+            failures += 1
+            print(f"{message_class.__name__}.{path}: fast={fast_value!r} betterproto={reference_value!r}")
+    for name, count in sorted(checked.items()):
+        print(f"{name}: checked {count} payloads")
+    print(f"{failures} mismatches")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,120 @@
+# synthetic.py
+"""Builders for realistic-looking Douyin messages and frames.
+
+Used to exercise the decoders and the ingest path offline. Messages carry
+the nested avatar, fans club and pay grade data a real room sends, so the
+decoders see the same amount of data they would have to skip on a real
+connection.
+"""
+import gzip
+import random
+from protobuf.douyin import (
+    ChatMessage, Common, FansClub, FansClubData, FollowInfo, GiftMessage, GiftStruct, Image,
+    LikeMessage, MemberMessage, Message, PayGrade, PushFrame, Response, RoomUserSeqMessage,
+    SocialMessage, User,
+)
+
+NICK_CHARS = "小明红蓝星月云风花雪阿猫狗橙子abcXYZ_0123456789😀"
+GIFT_NAMES = ["小心心", "玫瑰", "抖音", "人气票", "棒棒糖", "嘉年华", "跑车"]
+CHAT_TEXTS = ["主播好", "666", "来了来了", "这个怎么卖", "哈哈哈哈哈", "晚上好呀", "点赞了"]
+
+METHODS = {
+    'chat': 'WebcastChatMessage',
+    'gift': 'WebcastGiftMessage',
+    'member': 'WebcastMemberMessage',
+    'like': 'WebcastLikeMessage',
+    'social': 'WebcastSocialMessage',
+    'seq': 'WebcastRoomUserSeqMessage',
+}
+
+
+def _image(rng):
+    return Image(
+        url_list_list=[f"https://p3.douyinpic.com/aweme/100x100/{rng.getrandbits(64):x}.jpeg" for _ in range(3)],
+        uri=f"{rng.getrandbits(64):x}",
+        height=100,
+        width=100,
+    )
+
+
+def build_user(rng):
+    nick_name = ''.join(rng.choice(NICK_CHARS) for _ in range(rng.randint(1, 12)))
+    return User(
+        id=rng.getrandbits(63),
+        short_id=rng.getrandbits(40),
+        nick_name=nick_name,
+        gender=rng.randint(0, 1),
+        level=rng.randint(0, 60),
+        avatar_thumb=_image(rng),
+        follow_info=FollowInfo(follower_count=rng.randint(0, 10000), follow_status=rng.randint(0, 2)),
+        pay_grade=PayGrade(level=rng.randint(0, 50), new_im_icon_with_level=_image(rng)),
+        fans_club=FansClub(data=FansClubData(club_name="粉丝团", level=rng.randint(0, 20))),
+        sec_uid=f"MS4wLjABAAAA{rng.getrandbits(128):x}",
+        id_str=str(rng.getrandbits(63)),
+    )
+
+
+def build_common(rng, method, room_id):
+    return Common(
+        method=method,
+        msg_id=rng.getrandbits(63),
+        room_id=room_id,
+        create_time=rng.getrandbits(41),
+        is_show_msg=True,
+        describe="",
+    )
+
+
+def build_payload(kind, rng, room_id=7392091211001140287):
+    """Returns (method, serialized payload, msg_id) for a message of the given kind."""
+    method = METHODS[kind]
+    common = build_common(rng, method, room_id)
+    user = build_user(rng)
+    if kind == 'chat':
+        message = ChatMessage(common=common, user=user, content=rng.choice(CHAT_TEXTS), background_image=_image(rng))
+    elif kind == 'gift':
+        name = rng.choice(GIFT_NAMES)
+        message = GiftMessage(
+            common=common,
+            gift_id=rng.randint(1, 5000),
+            group_count=1,
+            repeat_count=rng.randint(1, 99),
+            combo_count=rng.randint(1, 99),
+            user=user,
+            to_user=build_user(rng),
+            gift=GiftStruct(image=_image(rng), describe=f"送出{name}", id=rng.randint(1, 5000),
+                            diamond_count=rng.randint(1, 30000), name=name, icon=_image(rng)),
+            log_id=f"{rng.getrandbits(64):x}",
+        )
+    elif kind == 'member':
+        message = MemberMessage(common=common, user=user, member_count=rng.randint(1, 100000), action=1,
+                                background_image=_image(rng))
+    elif kind == 'like':
+        message = LikeMessage(common=common, user=user, count=rng.randint(1, 15), total=rng.randint(1, 10 ** 7))
+    elif kind == 'social':
+        message = SocialMessage(common=common, user=user, action=1, follow_count=rng.randint(1, 10 ** 6))
+    elif kind == 'seq':
+        message = RoomUserSeqMessage(common=common, total=rng.randint(1, 10 ** 5),
+                                     total_pv_for_anchor=f"{rng.randint(1, 999)}万")
+    else:
+        raise ValueError(f"Unknown message kind: {kind}")
+    return method, bytes(message), common.msg_id
+
+
+def build_frame(kinds, rng, log_id=0, need_ack=True):
+    """Builds one serialized PushFrame carrying a gzip Response with the given message kinds."""
+    messages = []
+    for kind in kinds:
+        method, payload, msg_id = build_payload(kind, rng)
+        messages.append(Message(method=method, payload=payload, msg_id=msg_id, msg_type=1))
+    response = Response(
+        messages_list=messages,
+        cursor=f"r-{log_id}",
+        internal_ext=f"internal_src:dim|wss_push_room_id:7392091211001140287|seq:{log_id}",
+        need_ack=need_ack,
+    )
+    return PushFrame(log_id=log_id, payload_type='msg', payload=gzip.compress(bytes(response))).SerializeToString()
+
+
+def make_rng(seed=0):
+    return random.Random(seed)
@@ -0,0 +1,195 @@
+# wire.py
+"""Minimal protobuf wire-format scanning for the WebSocket hot path.
+
+``scan_frame`` reads just enough of a ``PushFrame`` and its ``Response`` to
+ack the frame and route each ``Message`` by ``method``. Payloads stay as
+``memoryview`` slices of the decompressed buffer, so a message is only
+copied and decoded if someone actually consumes it.
+"""
+import gzip
+
+WIRE_VARINT = 0
+WIRE_FIXED64 = 1
+WIRE_LENGTH = 2
+WIRE_FIXED32 = 5
+
+
+def read_varint(buf, pos):
+    result = 0
+    shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7F) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+
+
+def to_int64(value):
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def skip_field(buf, pos, wire_type):
+    if wire_type == WIRE_VARINT:
+        while buf[pos] & 0x80:
+            pos += 1
+        return pos + 1
+    if wire_type == WIRE_LENGTH:
+        length, pos = read_varint(buf, pos)
+        return pos + length
+    if wire_type == WIRE_FIXED64:
+        return pos + 8
+    if wire_type == WIRE_FIXED32:
+        return pos + 4
+    raise ValueError(f"Unsupported wire type {wire_type}")
+
+
+class LazyPushFrame:
+    __slots__ = ('log_id', 'payload')
+
+    def __init__(self, log_id=0, payload=b''):
+        self.log_id = log_id
+        self.payload = payload
+
+
+class LazyMessage:
+    __slots__ = ('method', 'payload', 'msg_id')
+
+    def __init__(self, method='', payload=b'', msg_id=0):
+        self.method = method
+        self.payload = payload
+        self.msg_id = msg_id
+
+
+class LazyResponse:
+    __slots__ = ('messages_list', 'internal_ext', 'need_ack')
+
+    def __init__(self, messages_list, internal_ext='', need_ack=False):
+        self.messages_list = messages_list
+        self.internal_ext = internal_ext
+        self.need_ack = need_ack
+
+
+def scan_push_frame(buf):
+    buf = memoryview(buf)
+    log_id = 0
+    payload = b''
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        key, pos = read_varint(buf, pos)
+        field, wire_type = key >> 3, key & 7
+        if field == 2 and wire_type == WIRE_VARINT:
+            log_id, pos = read_varint(buf, pos)
+        elif field == 8 and wire_type == WIRE_LENGTH:
+            length, pos = read_varint(buf, pos)
+            payload = buf[pos:pos + length]
+            pos += length
+        else:
+            pos = skip_field(buf, pos, wire_type)
+    return LazyPushFrame(log_id, payload)
+
+
+def scan_message(buf):
+    method = ''
+    payload = b''
+    msg_id = 0
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        key, pos = read_varint(buf, pos)
+        field, wire_type = key >> 3, key & 7
+        if field == 1 and wire_type == WIRE_LENGTH:
+            length, pos = read_varint(buf, pos)
+            method = str(buf[pos:pos + length], 'utf-8')
+            pos += length
+        elif field == 2 and wire_type == WIRE_LENGTH:
+            length, pos = read_varint(buf, pos)
+            payload = buf[pos:pos + length]
+            pos += length
+        elif field == 3 and wire_type == WIRE_VARINT:
+            msg_id, pos = read_varint(buf, pos)
+            msg_id = to_int64(msg_id)
+        else:
+            pos = skip_field(buf, pos, wire_type)
+    return LazyMessage(method, payload, msg_id)
+
+
+def scan_common_msg_id(payload):
+    """Returns ``common.msg_id`` (field 1, then field 2) of a Webcast payload without decoding the rest, or 0."""
+    buf = memoryview(payload)
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        key, pos = read_varint(buf, pos)
+        field, wire_type = key >> 3, key & 7
+        if field == 1 and wire_type == WIRE_LENGTH:
+            length, pos = read_varint(buf, pos)
+            common = buf[pos:pos + length]
+            inner = 0
+            while inner < length:
+                key, inner = read_varint(common, inner)
+                field, wire_type = key >> 3, key & 7
+                if field == 2 and wire_type == WIRE_VARINT:
+                    msg_id, _ = read_varint(common, inner)
+                    return msg_id
+                inner = skip_field(common, inner, wire_type)
+            return 0
+        pos = skip_field(buf, pos, wire_type)
+    return 0
+
+
+def scan_response(buf):
+    buf = memoryview(buf)
+    messages = []
+    internal_ext = ''
+    need_ack = False
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        key, pos = read_varint(buf, pos)
+        field, wire_type = key >> 3, key & 7
+        if field == 1 and wire_type == WIRE_LENGTH:
+            length, pos = read_varint(buf, pos)
+            messages.append(scan_message(buf[pos:pos + length]))
+            pos += length
+        elif field == 5 and wire_type == WIRE_LENGTH:
+            length, pos = read_varint(buf, pos)
+            internal_ext = str(buf[pos:pos + length], 'utf-8')
+            pos += length
+        elif field == 9 and wire_type == WIRE_VARINT:
+            value, pos = read_varint(buf, pos)
+            need_ack = bool(value)
+        else:
+            pos = skip_field(buf, pos, wire_type)
+    return LazyResponse(messages, internal_ext, need_ack)
+
+
+def scan_response_header(buf):
+    """Returns (need_ack, internal_ext) without looking at the messages."""
+    buf = memoryview(buf)
+    internal_ext = ''
+    need_ack = False
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        key, pos = read_varint(buf, pos)
+        field, wire_type = key >> 3, key & 7
+        if field == 5 and wire_type == WIRE_LENGTH:
+            length, pos = read_varint(buf, pos)
+            internal_ext = str(buf[pos:pos + length], 'utf-8')
+            pos += length
+        elif field == 9 and wire_type == WIRE_VARINT:
+            value, pos = read_varint(buf, pos)
+            need_ack = bool(value)
+        else:
+            pos = skip_field(buf, pos, wire_type)
+    return need_ack, internal_ext
+
+
+def scan_frame(data):
+    """Lazy counterpart of parsing ``PushFrame`` then its gzip ``Response``."""
+    package = scan_push_frame(data)
+    response = scan_response(gzip.decompress(package.payload))
+    return package, response
@@ -0,0 +1,130 @@
+# reconnect.py
+import random
+import time
+import config
+from logger import log
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+class ReconnectBackoff:
+    """Exponential backoff with full jitter and a circuit breaker.
+
+    Every failed attempt, or a connection that dropped before lasting
+    ``stable_after`` seconds, doubles the delay ceiling up to ``max_delay``;
+    the actual delay is drawn uniformly below it so many rooms do not
+    reconnect in lockstep. After ``threshold`` consecutive failures the
+    breaker opens and the room waits ``cooldown`` seconds before a single
+    trial attempt (half-open). A stable connection closes the breaker and
+    resets the backoff.
+    """
+
+    def __init__(self, base=None, max_delay=None, multiplier=None, stable_after=None,
+                 threshold=None, cooldown=None, rng=None):
+        self.base = base or config.RECONNECT_DELAY
+        self.max_delay = max_delay or config.RECONNECT_MAX_DELAY
+        self.multiplier = multiplier or config.RECONNECT_MULTIPLIER
+        self.stable_after = stable_after if stable_after is not None else config.RECONNECT_STABLE_AFTER
+        self.threshold = threshold or config.CIRCUIT_BREAKER_THRESHOLD
+        self.cooldown = cooldown or config.CIRCUIT_BREAKER_COOLDOWN
+        self.rng = rng or random.Random()
+        self.failures = 0
+        self.state = CLOSED
+
+    def next_delay(self, uptime=0.0):
+        """Returns how long to wait before the next attempt, given how long the last connection lasted."""
+        if uptime >= self.stable_after:
+            self.failures = 0
+            self.state = CLOSED
+            return self.base * self.rng.random()
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.threshold:
+            self.state = OPEN
+            return self.cooldown
+        ceiling = min(self.max_delay, self.base * self.multiplier ** (self.failures - 1))
+        return ceiling * self.rng.random()
+
+    def attempting(self):
+        """Marks the start of an attempt; returns True if it is the breaker's half-open trial."""
+        if self.state == OPEN:
+            self.state = HALF_OPEN
+            return True
+        return False
+
+class ConnectionHealth:
+    """Connection metrics of one room, all based on time.monotonic()."""
+
+    def __init__(self, live_id):
+        self.live_id = live_id
+        self.attempts = 0
+        self.connects = 0
+        self.failures = 0
+        self.connect_latency = None
+        self.connect_latency_total = 0.0
+        self.connected_since = None
+        self.uptime_total = 0.0
+        self.last_uptime = 0.0
+        self.last_ack = None
+        self._attempt_started = None
+
+    def on_attempt(self):
+        self.attempts += 1
+        self._attempt_started = time.monotonic()
+
+    def on_connected(self):
+        now = time.monotonic()
+        self.connects += 1
+        self.connect_latency = now - self._attempt_started
+        self.connect_latency_total += self.connect_latency
+        self.connected_since = now
+        self.last_ack = now
+
+    def on_ack(self):
+        self.last_ack = time.monotonic()
+
+    def on_disconnected(self):
+        """Returns how long the connection that just ended was up (0 if it never connected)."""
+        if self.connected_since is None:
+            self.failures += 1
+            self.last_uptime = 0.0
+        else:
+            self.last_uptime = time.monotonic() - self.connected_since
+            self.uptime_total += self.last_uptime
+            self.connected_since = None
+        return self.last_uptime
+
+    @property
+    def reconnects(self):
+        return max(0, self.attempts - 1)
+
+    @property
+    def uptime(self):
+        return time.monotonic() - self.connected_since if self.connected_since is not None else 0.0
+
+    @property
+    def last_ack_age(self):
+        return time.monotonic() - self.last_ack if self.last_ack is not None else None
+
+    def snapshot(self):
+        return {
+            'connected': self.connected_since is not None,
+            'attempts': self.attempts,
+            'reconnects': self.reconnects,
+            'failed_attempts': self.failures,
+            'connect_latency': self.connect_latency,
+            'avg_connect_latency': self.connect_latency_total / self.connects if self.connects else None,
+            'uptime': self.uptime,
+            'total_uptime': self.uptime_total + self.uptime,
+            'last_ack_age': self.last_ack_age,
+        }
+
+def plan_reconnect(health, backoff, live_id):
+    """Records the end of a connection and returns the delay before the next attempt, logging why."""
+    uptime = health.on_disconnected()
+    delay = backoff.next_delay(uptime)
+    if backoff.state == OPEN:
+        log.warning(f"[{live_id}] {backoff.failures} failed attempts in a row, pausing reconnects for {delay:.0f} s")
+    else:
+        log.info(f"[{live_id}] Connection lasted {uptime:.1f} s, reconnecting in {delay:.1f} s")
+    return delay
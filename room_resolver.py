@@ -0,0 +1,147 @@
+# room_resolver.py
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+import config
+from utils import generateMsToken
+from logger import log
+
+ROOM_ID_PATTERN = re.compile(rb'roomId\\":\\"(\d+)\\"')
+
+class RoomResolver:
+    """Resolves ttwid cookies and live_id -> room_id for every room.
+
+    All requests share one keep-alive ``requests.Session``. The ttwid is
+    cached in memory for ``ttwid_ttl`` seconds and room ids are persisted to
+    ``cache_path`` so restarts do not re-download the live page. Room ids
+    change between broadcasts, so cached ones expire after ``room_id_ttl``
+    seconds and callers should ``invalidate`` a live_id whose connection fails.
+    """
+
+    def __init__(self, base_url=None, cache_path=None, ttwid_ttl=None, room_id_ttl=None, pool_size=None):
+        self.base_url = base_url or config.DOUYIN_LIVE_URL
+        self.cache_path = cache_path if cache_path is not None else config.ROOM_ID_CACHE_FILE
+        self.ttwid_ttl = ttwid_ttl if ttwid_ttl is not None else config.TTWID_TTL
+        self.room_id_ttl = room_id_ttl if room_id_ttl is not None else config.ROOM_ID_CACHE_TTL
+        self.pool_size = pool_size or config.HTTP_POOL_SIZE
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["User-Agent"] = config.USER_AGENT
+
+        self._lock = threading.Lock()
+        self._ttwid_lock = threading.Lock()
+        self._ttwid = None
+        self._ttwid_time = 0
+        self._room_ids = self._load_cache()
+
+    def _load_cache(self):
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return {}
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            log.warning(f"Ignoring unreadable room_id cache {self.cache_path}: {e}")
+            return {}
+
+    def _save_cache(self):
+        if not self.cache_path:
+            return
+        with self._lock:
+            data = json.dumps(self._room_ids, ensure_ascii=False)
+        tmp_path = f"{self.cache_path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(data)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            log.error(f"Error saving room_id cache: {e}")
+
+    def get_ttwid(self):
+        with self._ttwid_lock:
+            if self._ttwid and time.monotonic() - self._ttwid_time < self.ttwid_ttl:
+                return self._ttwid
+            try:
+                response = self.session.get(self.base_url, timeout=config.HTTP_TIMEOUT)
+                response.raise_for_status()
+                ttwid = response.cookies.get('ttwid')
+            except Exception as err:
+                log.error(f"Error getting ttwid: {err}")
+                return self._ttwid
+            if ttwid:
+                self._ttwid = ttwid
+                self._ttwid_time = time.monotonic()
+            return self._ttwid
+
+    def get_room_id(self, live_id):
+        with self._lock:
+            entry = self._room_ids.get(live_id)
+        if entry and time.time() - entry['time'] < self.room_id_ttl:
+            return entry['room_id']
+
+        room_id = self._fetch_room_id(live_id)
+        if room_id:
+            with self._lock:
+                self._room_ids[live_id] = {'room_id': room_id, 'time': time.time()}
+            self._save_cache()
+        return room_id
+
+    def _fetch_room_id(self, live_id):
+        headers = {
+            "cookie": f"ttwid={self.get_ttwid()}; msToken={generateMsToken()}; __ac_nonce=0123407cc00a9e438deb4",
+        }
+        try:
+            with self.session.get(self.base_url + live_id, headers=headers,
+                                  timeout=config.HTTP_TIMEOUT, stream=True) as response:
+                response.raise_for_status()
+                # Scan the page as it downloads and stop at the first match
+                # instead of pulling the whole HTML document.
+                tail = b''
+                for chunk in response.iter_content(chunk_size=16384):
+                    window = tail + chunk
+                    match = ROOM_ID_PATTERN.search(window)
+                    if match:
+                        return match.group(1).decode()
+                    tail = window[-64:]
+            log.error(f"Could not find room_id for live ID {live_id}.")
+            return None
+        except Exception as err:
+            log.error(f"Error getting room_id: {err}")
+            return None
+
+    def resolve_many(self, live_ids, max_workers=None):
+        """Resolves several live_ids concurrently over the shared session."""
+        self.get_ttwid()
+        live_ids = list(live_ids)
+        if not live_ids:
+            return {}
+        workers = min(max_workers or self.pool_size, len(live_ids))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return dict(zip(live_ids, executor.map(self.get_room_id, live_ids)))
+
+    def invalidate(self, live_id):
+        with self._lock:
+            removed = self._room_ids.pop(live_id, None)
+        if removed:
+            self._save_cache()
+
+    def close(self):
+        self.session.close()
+
+_resolver = None
+_resolver_lock = threading.Lock()
+
+def get_resolver():
+    global _resolver
+    with _resolver_lock:
+        if _resolver is None:
+            _resolver = RoomResolver()
+        return _resolver
@@ -0,0 +1,135 @@
+# room_resolver_check.py
+"""Checks RoomResolver against a local http.server stand-in for live.douyin.com.
+
+The stand-in hands out a new ttwid cookie on every request to ``/`` and
+serves ``/<live_id>`` pages with the room id embedded the way the real
+page does, with the match placed across the 16 KiB read boundary. Checks
+the ttwid TTL, the on-disk room_id cache (reuse across instances, expiry
+and invalidate), resolve_many and the not-found path, counting the
+requests the resolver makes.
+
+    python room_resolver_check.py
+"""
+import argparse
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from room_resolver import RoomResolver
+
+ROOMS = {'1001': '7392091211001140287', '1002': '7392091211001140288', '1003': '7392091211001140289'}
+
+
+class StandIn(BaseHTTPRequestHandler):
+    requests = {}
+    ttwids = 0
+    in_flight = 0
+    max_in_flight = 0
+    delay = 0.1
+    lock = threading.Lock()
+
+    def do_GET(self):
+        cls = type(self)
+        with cls.lock:
+            cls.requests[self.path] = cls.requests.get(self.path, 0) + 1
+            cls.in_flight += 1
+            cls.max_in_flight = max(cls.max_in_flight, cls.in_flight)
+        try:
+            if self.path == '/':
+                with cls.lock:
+                    cls.ttwids += 1
+                    ttwid = f"ttwid-{cls.ttwids}"
+                self.send_response(200)
+                self.send_header('Set-Cookie', f"ttwid={ttwid}; Path=/")
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            time.sleep(cls.delay)
+            room_id = ROOMS.get(self.path.lstrip('/'))
+            marker = f'roomId\\":\\"{room_id}\\"'.encode() if room_id else b''
+            body = b'x' * (16384 - 8) + marker + b'y' * 4096
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with cls.lock:
+                cls.in_flight -= 1
+
+    def log_message(self, *args):
+        pass
+
+    @classmethod
+    def count(cls, path):
+        with cls.lock:
+            return cls.requests.get(path, 0)
+
+
+def check(name, condition):
+    print(f"    {'ok  ' if condition else 'FAIL'} {name}")
+    return condition
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.parse_args()
+    logging.getLogger().setLevel(logging.CRITICAL)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/"
+    cache_path = os.path.join(tempfile.mkdtemp(), 'room_ids.json')
+    results = []
+
+    print("ttwid")
+    resolver = RoomResolver(base_url=base_url, cache_path=cache_path, ttwid_ttl=0.5, pool_size=4)
+    first = resolver.get_ttwid()
+    second = resolver.get_ttwid()
+    results.append(check("cookie is read from the response", first == 'ttwid-1'))
+    results.append(check("reused within the TTL", second == first and StandIn.count('/') == 1))
+    time.sleep(0.6)
+    results.append(check("refetched after the TTL", resolver.get_ttwid() == 'ttwid-2' and StandIn.count('/') == 2))
+
+    print("resolve_many")
+    start = time.monotonic()
+    resolved = resolver.resolve_many(list(ROOMS) + ['404'])
+    elapsed = time.monotonic() - start
+    results.append(check("room ids found across the read boundary",
+                         all(resolved[live_id] == room_id for live_id, room_id in ROOMS.items())))
+    results.append(check("missing room id resolves to None", resolved['404'] is None))
+    results.append(check(f"pages fetched concurrently ({StandIn.max_in_flight} at once, {elapsed * 1000:.0f} ms)",
+                         StandIn.max_in_flight > 1 and elapsed < StandIn.delay * len(resolved)))
+
+    print("on-disk cache")
+    with open(cache_path, encoding='utf-8') as f:
+        saved = json.load(f)
+    results.append(check("resolved ids written to disk",
+                         {live_id: entry['room_id'] for live_id, entry in saved.items()} == ROOMS))
+    resolver.close()
+    fetched = StandIn.count('/1001')
+    restarted = RoomResolver(base_url=base_url, cache_path=cache_path)
+    results.append(check("reused by a new instance without a request",
+                         restarted.get_room_id('1001') == ROOMS['1001'] and StandIn.count('/1001') == fetched))
+    restarted.invalidate('1001')
+    with open(cache_path, encoding='utf-8') as f:
+        results.append(check("invalidate removes the id from disk", '1001' not in json.load(f)))
+    results.append(check("invalidated id is fetched again",
+                         restarted.get_room_id('1001') == ROOMS['1001'] and StandIn.count('/1001') == fetched + 1))
+    restarted.close()
+    expired = RoomResolver(base_url=base_url, cache_path=cache_path, room_id_ttl=0)
+    fetched = StandIn.count('/1002')
+    results.append(check("expired id is fetched again",
+                         expired.get_room_id('1002') == ROOMS['1002'] and StandIn.count('/1002') == fetched + 1))
+    expired.close()
+
+    server.shutdown()
+    print(f"{sum(results)}/{len(results)} checks passed")
+    raise SystemExit(0 if all(results) else 1)
+
+
+if __name__ == '__main__':
+    main()
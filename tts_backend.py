@@ -0,0 +1,135 @@
+# tts_backend.py
+import asyncio
+import io
+import random
+import zlib
+from functools import lru_cache
+import numpy as np
+import soundfile as sf
+import edge_tts
+import config
+from audio_sink import parse_mp3_header
+from logger import log
+
+# sndfile.h: sf_command(SFC_SET_BITRATE_MODE) takes an int SF_BITRATE_MODE_*, libsndfile >= 1.1.0
+SFC_SET_BITRATE_MODE = 0x1305
+SF_BITRATE_MODE_CONSTANT = 0
+
+class EdgeTTSBackend:
+    """Synthesizes through the Microsoft edge-tts service.
+
+    Backends expose ``stream(text, voice)``, an async iterator of MP3 chunks
+    in the order they should be played.
+    """
+
+    async def stream(self, text, voice):
+        tts = edge_tts.Communicate(
+            text,
+            voice,
+            proxy=config.TTS_PROXY if config.USE_TTS_PROXY else None,
+        )
+        async for chunk in tts.stream():
+            if chunk["type"] == "audio":
+                yield chunk["data"]
+
+@lru_cache(maxsize=256)
+def render_phrase(text, voice, samplerate=24000, seconds_per_char=0.18):
+    """Deterministic MP3 stand-in for speech: one short tone per character, pitched by voice and character."""
+    base = 150 + zlib.crc32(voice.encode('utf-8')) % 150
+    per_char = int(samplerate * seconds_per_char)
+    t = np.arange(per_char) / samplerate
+    envelope = np.sin(np.pi * t / seconds_per_char) ** 2
+    bursts = []
+    for char in text or ' ':
+        frequency = base * (1 + (zlib.crc32(char.encode('utf-8')) % 12) / 12)
+        bursts.append(0.3 * envelope * np.sin(2 * np.pi * frequency * t))
+    buf = io.BytesIO()
+    with _open_cbr_mp3(buf, samplerate) as f:
+        f.write(np.concatenate(bursts).astype('float32'))
+    return _strip_info_frame(buf.getvalue()), len(text or ' ') * seconds_per_char
+
+def _version(text):
+    return tuple(int(part) for part in text.split('.')[:2] if part.isdigit())
+
+def _open_cbr_mp3(buf, samplerate):
+    """Opens a mono MP3 SoundFile for writing at a constant bitrate like edge-tts; libsndfile defaults to VBR.
+
+    soundfile >= 0.13 takes ``bitrate_mode``, applied together with a
+    ``compression_level`` (0.75 gives edge-tts's 48 kbps at 24 kHz). The
+    pinned 0.12 has no public way, so there the mode is set through its
+    sf_command binding, only for that release and a libsndfile that knows
+    the command. Otherwise the file keeps the default mode, which libmpg123
+    decodes less exactly when split.
+    """
+    try:
+        return sf.SoundFile(buf, 'w', samplerate, 1, format='MP3', compression_level=0.75, bitrate_mode='CONSTANT')
+    except TypeError:  # soundfile < 0.13
+        pass
+    f = sf.SoundFile(buf, 'w', samplerate, 1, format='MP3')
+    if _version(sf.__version__) == (0, 12) and _version(sf.__libsndfile_version__) >= (1, 1):
+        # the command returns 0 whether or not it applied, so there is nothing to check
+        mode = sf._ffi.new('int*', SF_BITRATE_MODE_CONSTANT)
+        sf._snd.sf_command(f._file, SFC_SET_BITRATE_MODE, mode, sf._ffi.sizeof('int'))
+    else:
+        _warn_default_bitrate()
+    return f
+
+@lru_cache(maxsize=1)
+def _warn_default_bitrate():
+    log.warning(f"soundfile {sf.__version__} / libsndfile {sf.__libsndfile_version__} cannot set a constant "
+                "MP3 bitrate, the offline TTS stand-in writes the default mode")
+
+def _strip_info_frame(audio):
+    """Drops the LAME Xing/Info header frame; edge-tts streams are bare MPEG frames."""
+    header = parse_mp3_header(audio, 0)
+    if header is not None and (b'Xing' in audio[:header[0]] or b'Info' in audio[:header[0]]):
+        return audio[header[0]:]
+    return audio
+
+class LocalTTSBackend:
+    """Offline stand-in for edge-tts with tunable service behaviour.
+
+    Each request waits ``latency`` ± ``jitter`` seconds, fails with
+    probability ``failure_rate`` and otherwise streams ``render_phrase``
+    audio in ``chunk_bytes`` pieces, ``speedup`` times faster than real time.
+    The random draws come from ``seed``, so a run can be repeated.
+    """
+
+    def __init__(self, latency=None, jitter=None, failure_rate=None, chunk_bytes=2048, speedup=4.0, seed=0):
+        self.latency = config.LOCAL_TTS_LATENCY if latency is None else latency
+        self.jitter = config.LOCAL_TTS_JITTER if jitter is None else jitter
+        self.failure_rate = config.LOCAL_TTS_FAILURE_RATE if failure_rate is None else failure_rate
+        self.chunk_bytes = chunk_bytes
+        self.speedup = speedup
+        self._rng = random.Random(seed)
+        self._active = 0
+        self.stats = {'requests': 0, 'failures': 0, 'max_concurrent': 0}
+
+    async def stream(self, text, voice):
+        self.stats['requests'] += 1
+        self._active += 1
+        self.stats['max_concurrent'] = max(self.stats['max_concurrent'], self._active)
+        try:
+            delay = max(0.0, self.latency + self._rng.uniform(-self.jitter, self.jitter))
+            fail = self._rng.random() < self.failure_rate
+            await asyncio.sleep(delay)
+            if fail:
+                self.stats['failures'] += 1
+                raise ConnectionError(f"Simulated TTS failure for {text!r}")
+            audio, duration = await asyncio.get_running_loop().run_in_executor(None, render_phrase, text, voice)
+            chunk_delay = duration * self.chunk_bytes / len(audio) / self.speedup
+            for offset in range(0, len(audio), self.chunk_bytes):
+                if offset:
+                    await asyncio.sleep(chunk_delay)
+                yield audio[offset:offset + self.chunk_bytes]
+        finally:
+            self._active -= 1
+
+def create_backend(name=None):
+    """Builds the backend named by ``name`` or TTS_BACKEND: edge or local."""
+    name = name or config.TTS_BACKEND
+    if name == 'edge':
+        return EdgeTTSBackend()
+    if name == 'local':
+        return LocalTTSBackend()
+    raise ValueError(f"Unknown TTS backend: {name}")
@@ -0,0 +1,143 @@
+# tts_loadtest.py
+"""TTS load test against the offline stand-in backend.
+
+Feeds synthetic room messages through MessageHandler into a real
+TTSManager + TTSScheduler at a Poisson message rate. Synthesis goes to a
+LocalTTSBackend with the given latency, jitter and failure rate, and
+playback to a realtime NullSink. Reports queue wait, synthesis time, time
+from enqueue to first audio, the silence between consecutive utterances
+while more were waiting, and how many announcements were dropped.
+
+    python tts_loadtest.py --rate 3 --duration 60 --latency 0.4 --jitter 0.2 --failure-rate 0.05
+"""
+import argparse
+import logging
+import threading
+import time
+import config
+from audio_sink import NullSink
+from benchmark import parse_mix, percentile
+from message_handler import MessageHandler
+from protobuf.synthetic import build_payload, make_rng
+from tts_backend import LocalTTSBackend
+from tts_manager import TTSManager, consumer_thread_worker
+from tts_scheduler import TTSScheduler
+from logger import log
+
+
+def build_messages(mix, rate, duration, seed):
+    """Returns [(arrival offset in seconds, method, payload)] for a Poisson stream of messages."""
+    rng = make_rng(seed)
+    kinds = list(mix)
+    weights = [mix[kind] for kind in kinds]
+    messages = []
+    offset = rng.expovariate(rate)
+    while offset < duration:
+        method, payload, _ = build_payload(rng.choices(kinds, weights)[0], rng)
+        messages.append((offset, method, payload))
+        offset += rng.expovariate(rate)
+    return messages
+
+
+def settled(scheduler, tts):
+    spoken = sum(stats['spoken'] for stats in scheduler.stats.values())
+    return not any(scheduler.depth().values()) and len(tts.timings) >= spoken
+
+
+def summarize(name, values, unit=1000):
+    if not values:
+        return f"    {name:<16} -"
+    return (f"    {name:<16} p50 {percentile(values, 0.5) * unit:8.0f} ms   "
+            f"p95 {percentile(values, 0.95) * unit:8.0f} ms   max {max(values) * unit:8.0f} ms")
+
+
+def playback_gaps(timings):
+    """Silence between one utterance ending and the next starting, counted only while the next was already queued."""
+    played = sorted((t for t in timings if not t.failed and t.first_audio), key=lambda t: t.play_start)
+    return [
+        current.first_audio - previous.play_end
+        for previous, current in zip(played, played[1:])
+        if current.queued < previous.play_end
+    ]
+
+
+def report(args, messages, scheduler, tts, backend, sink, elapsed):
+    stats = scheduler.stats
+    queued = sum(s['queued'] for s in stats.values())
+    dropped_full = sum(s['dropped_full'] for s in stats.values())
+    dropped_stale = sum(s['dropped_stale'] for s in stats.values())
+    coalesced = sum(s['coalesced'] for s in stats.values())
+    timings = list(tts.timings)
+    failed = sum(t.failed for t in timings)
+    ok = [t for t in timings if not t.failed]
+
+    print(f"\n{len(messages)} messages in {elapsed:.1f} s ({len(messages) / elapsed:.2f}/s), "
+          f"{queued} TTS items queued, {len(timings)} utterances, {failed} failed")
+    print(f"    dropped: {dropped_full} queue full, {dropped_stale} stale "
+          f"({(dropped_full + dropped_stale) / max(queued, 1):.1%}), {coalesced} coalesced")
+    for category, s in stats.items():
+        print(f"    {category:<8} queued {s['queued']:5d}  spoken {s['spoken']:5d}  "
+              f"dropped {s['dropped_full'] + s['dropped_stale']:5d}  coalesced {s['coalesced']:5d}")
+    print(summarize('queue wait', [t.queue_wait for t in timings]))
+    print(summarize('synthesis', [t.synthesis_time for t in ok if t.synthesis_time is not None]))
+    print(summarize('first audio', [t.time_to_first_audio for t in ok]))
+    print(summarize('playback gap', playback_gaps(timings)))
+    print(f"    backend: {backend.stats['requests']} requests ({backend.stats['max_concurrent']} at once), "
+          f"{backend.stats['failures']} failed; "
+          f"{sink.seconds:.1f} s of audio played, {sink.underruns} stream underruns")
+    if tts.cache is not None:
+        print(f"    {tts.cache.report()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rate', type=float, default=2.0, help="room messages per second")
+    parser.add_argument('--duration', type=float, default=30.0, help="seconds of messages to generate")
+    parser.add_argument('--mix', default='chat=50,member=30,gift=10,social=10')
+    parser.add_argument('--latency', type=float, default=config.LOCAL_TTS_LATENCY)
+    parser.add_argument('--jitter', type=float, default=config.LOCAL_TTS_JITTER)
+    parser.add_argument('--failure-rate', type=float, default=config.LOCAL_TTS_FAILURE_RATE)
+    parser.add_argument('--speedup', type=float, default=4.0, help="backend streaming speed relative to real time")
+    parser.add_argument('--depth', type=int, default=config.TTS_PIPELINE_DEPTH, help="1 = serial consumer thread")
+    parser.add_argument('--concurrency', type=int, default=config.TTS_CONCURRENCY, help="TTS requests in parallel")
+    parser.add_argument('--no-stream', action='store_true', help="wait for whole utterances before playing")
+    parser.add_argument('--no-cache', action='store_true')
+    parser.add_argument('--drain', type=float, default=30.0, help="seconds to wait for the queue to empty")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--log', action='store_true', help="keep per-utterance logging enabled")
+    args = parser.parse_args()
+
+    if not args.log:
+        logging.getLogger().setLevel(logging.CRITICAL)
+    config.TTS_CACHE_ENABLED = not args.no_cache
+    config.TTS_CONCURRENCY = args.concurrency
+    messages = build_messages(parse_mix(args.mix), args.rate, args.duration, args.seed)
+
+    backend = LocalTTSBackend(args.latency, args.jitter, args.failure_rate, speedup=args.speedup, seed=args.seed)
+    sink = NullSink(realtime=True)
+    scheduler = TTSScheduler()
+    tts = TTSManager(scheduler, sink, streaming=not args.no_stream, backend=backend, history=len(messages) + 1)
+    handler = MessageHandler(tts, lambda count: None)
+    handler.speech_enabled = handler.gift_enabled = handler.follow_enabled = handler.welcome_enabled = True
+    if args.depth > 1:
+        tts.start_pipeline(args.depth)
+    else:
+        threading.Thread(target=consumer_thread_worker, args=(scheduler,), daemon=True).start()
+
+    start = time.monotonic()
+    for offset, method, payload in messages:
+        delay = start + offset - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        handler.handle_message(method, payload)
+    deadline = time.monotonic() + args.drain
+    while not settled(scheduler, tts) and time.monotonic() < deadline:
+        time.sleep(0.1)
+    elapsed = time.monotonic() - start
+    scheduler.close()
+    log.setLevel(logging.INFO)
+    report(args, messages, scheduler, tts, backend, sink, elapsed)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,17 +1,62 @@
 # tts_manager.py
 import asyncio
-import os
+import queue
 import threading
-import uuid
-from queue import Queue
-import edge_tts
-from playsound import playsound
+import time
+from collections import deque
 import config
+from audio_sink import Mp3StreamDecoder, create_sink, decode_audio
+from phrase_cache import PhraseCache
+from tts_backend import create_backend
+from tts_scheduler import TTSItem, TTSScheduler
 from logger import log
 
+class UtteranceTiming:
+    """time.monotonic() stamps of one utterance on its way through TTSManager."""
+
+    __slots__ = ('text', 'category', 'queued', 'synthesis_start', 'synthesis_end',
+                 'play_start', 'first_audio', 'play_end', 'failed')
+
+    def __init__(self, text, category, queued):
+        self.text = text
+        self.category = category
+        self.queued = queued
+        self.synthesis_start = self.synthesis_end = None
+        self.play_start = self.first_audio = self.play_end = None
+        self.failed = False
+
+    @property
+    def queue_wait(self):
+        return self.synthesis_start - self.queued
+
+    @property
+    def synthesis_time(self):
+        return self.synthesis_end - self.synthesis_start if self.synthesis_end else None
+
+    @property
+    def first_audio_latency(self):
+        return (self.first_audio or self.play_end) - self.play_start
+
+    @property
+    def time_to_first_audio(self):
+        """From being queued to the first sample reaching the sink."""
+        return (self.first_audio or self.play_end) - self.queued
+
+    @property
+    def total_latency(self):
+        return self.play_end - self.play_start
+
 class TTSManager:
-    def __init__(self, task_queue: Queue):
+    def __init__(self, task_queue: TTSScheduler, sink=None, streaming=None, cache=None, backend=None, history=200):
         self.task_queue = task_queue
+        self.sink = sink or create_sink()
+        self.backend = backend or create_backend()
+        self.streaming = config.TTS_STREAMING if streaming is None else streaming
+        if cache is None and config.TTS_CACHE_ENABLED:
+            cache = PhraseCache()
+        self.cache = cache
+        self.timings = deque(maxlen=history)  # UtteranceTiming of the most recent utterances
+        self._requests = None  # asyncio.Semaphore, created on the event loop
         self.loop = asyncio.new_event_loop()
         self.thread = threading.Thread(target=self._start_event_loop, daemon=True)
         self.thread.start()
@@ -20,56 +65,251 @@ class TTSManager:
         asyncio.set_event_loop(self.loop)
         self.loop.run_forever()
 
-    async def _text_to_speech_async(self, text, voice, output_path):
+    async def _text_to_speech_async(self, text, voice, on_audio):
+        """Hands each MP3 chunk of one utterance to on_audio as the backend sends it.
+
+        A failed attempt is only retried while no audio has been handed out.
+        At most TTS_CONCURRENCY requests run at once across all voices.
+        """
+        if self._requests is None:
+            self._requests = asyncio.Semaphore(config.TTS_CONCURRENCY)
         for attempt in range(config.TTS_MAX_RETRIES):
+            sent = False
             try:
-                tts = edge_tts.Communicate(
-                    text,
-                    voice,
-                    proxy=config.TTS_PROXY if config.USE_TTS_PROXY else None,
-                )
-                await tts.save(output_path)
-                if os.path.exists(output_path):
-                    return
-                else:
-                    raise FileNotFoundError(f"Failed to generate audio file: {output_path}")
+                async with self._requests:
+                    async for chunk in self.backend.stream(text, voice):
+                        on_audio(chunk)
+                        sent = True
+                return
             except Exception as e:
                 log.error(f"Attempt {attempt + 1} failed: {e}")
-                if attempt < config.TTS_MAX_RETRIES - 1:
-                    await asyncio.sleep(config.TTS_RETRY_DELAY)
-                else:
+                if sent or attempt == config.TTS_MAX_RETRIES - 1:
                     raise
+                await asyncio.sleep(config.TTS_RETRY_DELAY)
+
+    def _lookup(self, text, voice, segments):
+        """Returns [(fragment, cacheable, cached MP3 or None)] of an utterance, or None without a cache.
+
+        Runs on the thread starting the synthesis, since a memory miss reads
+        the phrase from disk and must not stall the event loop.
+        """
+        if self.cache is None:
+            return None
+        if segments is None or not config.TTS_SEGMENT_CACHE:
+            segments = ((text, len(text) <= config.TTS_CACHE_MAX_TEXT),)
+        return [(fragment, cacheable, self.cache.get(voice, fragment) if cacheable else None)
+                for fragment, cacheable in segments]
 
-    def _play_speech(self, text, voice_index):
+    async def _speak_async(self, text, voice, lookups, on_audio):
+        """Like _text_to_speech_async, but serves the cached phrases _lookup found.
+
+        With segment caching the utterance is produced fragment by fragment;
+        edge-tts MP3 clips can simply be concatenated, so cached fragments
+        and freshly synthesized user names are spliced at the byte level.
+        """
+        if lookups is None:
+            await self._text_to_speech_async(text, voice, on_audio)
+            return
+        # Missing fragments after the first are fetched while the earlier ones
+        # play, so a cached "欢迎" is not followed by a gap for the user name
+        fetches = [
+            asyncio.ensure_future(self._fetch_async(fragment, voice)) if audio is None and index else None
+            for index, (fragment, _, audio) in enumerate(lookups)
+        ]
         try:
-            os.makedirs(config.AUDIO_OUTPUT_DIR, exist_ok=True)
-            unique_id = str(uuid.uuid4())
-            output_file = os.path.join(config.AUDIO_OUTPUT_DIR, f"speech_{unique_id}.mp3")
-            voice = config.TTS_VOICES[voice_index]
-
-            future = asyncio.run_coroutine_threadsafe(
-                self._text_to_speech_async(text, voice, output_file), self.loop
-            )
-            future.result()  # Wait for the async function to complete
-
-            playsound(output_file)
-            log.info(f"Speech generated and played: {output_file}")
+            for (fragment, cacheable, audio), fetch in zip(lookups, fetches):
+                if audio is not None:
+                    on_audio(audio)
+                    continue
+                if fetch is not None:
+                    audio = await fetch
+                    on_audio(audio)
+                else:
+                    collected = bytearray()
+
+                    def collect(chunk):
+                        collected.extend(chunk)
+                        on_audio(chunk)
+
+                    await self._text_to_speech_async(fragment, voice, collect)
+                    audio = bytes(collected)
+                if cacheable:
+                    # written to disk off the loop; playback does not wait for it
+                    self.loop.run_in_executor(None, self.cache.put, voice, fragment, audio)
+        finally:
+            for fetch in fetches:
+                if fetch is not None:
+                    fetch.cancel()
+
+    async def _fetch_async(self, text, voice):
+        audio = bytearray()
+        await self._text_to_speech_async(text, voice, audio.extend)
+        return bytes(audio)
+
+    async def _synthesize_async(self, text, voice, lookups, timing):
+        audio = bytearray()
+        await self._speak_async(text, voice, lookups, audio.extend)
+        timing.synthesis_end = time.monotonic()
+        return await self.loop.run_in_executor(None, decode_audio, bytes(audio))
+
+    async def _stream_async(self, text, voice, lookups, chunks, timing, on_ready):
+        def put(chunk):
+            if chunks.empty():
+                on_ready()
+            chunks.put(chunk)
+
+        try:
+            await self._speak_async(text, voice, lookups, put)
+            timing.synthesis_end = time.monotonic()
+            chunks.put(None)
+        except Exception as e:
+            chunks.put(e)
+        on_ready()
+
+    def _synthesize(self, item, timing, on_ready=None):
+        """Looks up cached phrases of item here, then starts its synthesis on the event loop.
+
+        Returns a queue of MP3 chunks (ended by None) when streaming, else a
+        future resolving to (samples, samplerate). ``on_ready`` is called
+        from the event loop once there is something to play (or an error).
+        """
+        voice = config.TTS_VOICES[item.voice_index]
+        on_ready = on_ready or (lambda: None)
+        timing.synthesis_start = time.monotonic()
+        lookups = self._lookup(item.text, voice, item.segments)
+        if self.streaming:
+            chunks = queue.Queue()
+            coroutine = self._stream_async(item.text, voice, lookups, chunks, timing, on_ready)
+            asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+            return chunks
+        coroutine = self._synthesize_async(item.text, voice, lookups, timing)
+        future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+        future.add_done_callback(lambda _: on_ready())
+        return future
+
+    def _play(self, pending, timing):
+        """Plays what _synthesize returned and logs time to first audio and total latency."""
+        timing.play_start = time.monotonic()
+        try:
+            if self.streaming:
+                timing.first_audio = self._play_stream(pending)
+            else:
+                samples, samplerate = pending.result()
+                timing.first_audio = time.monotonic()
+                self.sink.play(samples, samplerate)
         except Exception as e:
+            timing.failed = True
             log.error(f"Error during speech playback: {e}")
         finally:
-            if os.path.exists(output_file):
-                try:
-                    os.remove(output_file)
-                except OSError as e:
-                    log.error(f"Error deleting file: {e}")
+            timing.play_end = time.monotonic()
+            self.timings.append(timing)
+        if not timing.failed:
+            log.info(f"Speech played: {timing.text} (first audio {timing.first_audio_latency * 1000:.0f} ms, "
+                     f"total {timing.total_latency * 1000:.0f} ms)")
 
-    def add_task(self, text, voice_index):
+    def _play_stream(self, chunks):
+        """Decodes chunks as they arrive and writes them to a sink stream; returns when audio first reached it."""
+        decoder = Mp3StreamDecoder()
+        stream = None
+        first_audio = None
         try:
-            self.task_queue.put(lambda: self._play_speech(text, voice_index), timeout=1)
-        except Queue.Full:
-            log.warning(f"Task queue is full, discarding TTS task: {text}")
+            while True:
+                chunk = chunks.get()
+                if isinstance(chunk, Exception):
+                    raise chunk
+                samples = decoder.flush() if chunk is None else decoder.feed(chunk)
+                if samples is not None and len(samples):
+                    if stream is None:
+                        stream = self.sink.open_stream(decoder.samplerate, decoder.channels)
+                        first_audio = time.monotonic()
+                    stream.write(samples)
+                if chunk is None:
+                    break
+            if stream is not None:
+                stream.finish()
+        finally:
+            if stream is not None:
+                stream.close()
+        return first_audio
+
+    def _play_speech(self, item):
+        timing = UtteranceTiming(item.text, item.category, item.created)
+        self._play(self._synthesize(item, timing), timing)
+
+    def start_pipeline(self, depth=None):
+        """Plays tasks from the queue while the next ones are already being synthesized.
+
+        Up to ``depth`` utterances are in flight at once, counting the one
+        playing, and up to TTS_CONCURRENCY of them are synthesized in
+        parallel on the event loop. With TTS_REORDER_PLAYBACK the player
+        takes the oldest utterance that is ready to play, so a slow request
+        does not hold up other voices; each voice is still heard in the
+        order it was queued. Without it playback is strictly in queue order.
+        """
+        self._slots = threading.Semaphore(depth or config.TTS_PIPELINE_DEPTH)
+        self._in_flight = []  # [(voice_index, pending, timing, ready event)] in queue order
+        self._in_flight_cond = threading.Condition()
+        self._pipeline_closed = False
+        threading.Thread(target=self._synthesis_worker, daemon=True).start()
+        threading.Thread(target=self._playback_worker, daemon=True).start()
+
+    def _synthesis_worker(self):
+        while True:
+            self._slots.acquire()
+            item = self.task_queue.get()
+            if item is None:
+                with self._in_flight_cond:
+                    self._pipeline_closed = True
+                    self._in_flight_cond.notify_all()
+                return
+            timing = UtteranceTiming(item.text, item.category, item.created)
+            ready = threading.Event()
+            pending = self._synthesize(item, timing, lambda ready=ready: self._mark_ready(ready))
+            with self._in_flight_cond:
+                self._in_flight.append((item.voice_index, pending, timing, ready))
+                self._in_flight_cond.notify_all()
+
+    def _mark_ready(self, ready):
+        with self._in_flight_cond:
+            ready.set()
+            self._in_flight_cond.notify_all()
+
+    def _next_playable(self):
+        blocked = set()
+        for index, (voice_index, pending, timing, ready) in enumerate(self._in_flight):
+            if voice_index in blocked:
+                continue
+            if ready.is_set():
+                return self._in_flight.pop(index)
+            if not config.TTS_REORDER_PLAYBACK:
+                return None
+            blocked.add(voice_index)
+        return None
+
+    def _playback_worker(self):
+        while True:
+            with self._in_flight_cond:
+                entry = self._next_playable()
+                while entry is None:
+                    if self._pipeline_closed and not self._in_flight:
+                        return
+                    self._in_flight_cond.wait()
+                    entry = self._next_playable()
+            _, pending, timing, _ = entry
+            try:
+                self._play(pending, timing)
+            finally:
+                self._slots.release()
+                self.task_queue.task_done()
+
+    def add_task(self, text, voice_index, category="chat", name=None, segments=None):
+        self.task_queue.put(TTSItem(category, voice_index, text, name, self._play_speech, segments))
+
+    def report_cache(self):
+        if self.cache is not None:
+            log.info(self.cache.report())
 
-def consumer_thread_worker(task_queue: Queue):
+def consumer_thread_worker(task_queue: TTSScheduler):
     """A worker function for the consumer thread to process tasks from the queue."""
     while True:
         try:
@@ -0,0 +1,147 @@
+# tts_scheduler.py
+import threading
+import time
+from collections import deque
+import config
+from logger import log
+
+class TTSItem:
+    """One announcement; calling it runs ``action(item)``. ``segments``
+    optionally splits ``text`` into (fragment, cacheable) pairs so fixed
+    fragments can be reused."""
+
+    __slots__ = ('category', 'voice_index', 'text', 'name', 'created', 'action', 'segments')
+
+    def __init__(self, category, voice_index, text, name=None, action=None, segments=None):
+        self.category = category
+        self.voice_index = voice_index
+        self.text = text
+        self.name = name
+        self.created = time.monotonic()
+        self.action = action
+        self.segments = segments
+
+    def __call__(self):
+        self.action(self)
+
+class TTSScheduler:
+    """Priority queue of TTS items with one bounded lane per category.
+
+    ``get`` serves the highest-priority lane first and merges queued
+    items of coalescing categories into one announcement
+    (e.g. "欢迎 A、B、C 进入直播间！"). Items older than their category's
+    max age are dropped from every lane on each ``put`` and ``get``, and a
+    full lane drops its oldest item.
+    It keeps the ``get``/``task_done`` interface of ``queue.Queue`` so
+    ``consumer_thread_worker`` can drain it.
+    """
+
+    def __init__(self, priorities=None, capacity=None, max_age=None, coalesce=None, coalesce_max=None):
+        self.priorities = priorities or config.TTS_PRIORITIES
+        self.capacity = capacity or config.TTS_CLASS_CAPACITY
+        self.max_age = max_age or config.TTS_MAX_AGE
+        self.coalesce = coalesce if coalesce is not None else config.TTS_COALESCE
+        self.coalesce_max = coalesce_max or config.TTS_COALESCE_MAX
+        self._lanes = {category: deque() for category in self.priorities}
+        self._cond = threading.Condition()
+        self._closed = False
+        self.stats = {
+            category: {'queued': 0, 'spoken': 0, 'dropped_full': 0, 'dropped_stale': 0, 'coalesced': 0}
+            for category in self.priorities
+        }
+
+    def put(self, item):
+        lane = self._lanes.get(item.category)
+        if lane is None:
+            raise ValueError(f"Unknown TTS category: {item.category}")
+        with self._cond:
+            self._drop_stale(time.monotonic())
+            stats = self.stats[item.category]
+            if len(lane) >= self.capacity.get(item.category, 100):
+                dropped = lane.popleft()
+                stats['dropped_full'] += 1
+                log.warning(f"TTS {item.category} queue is full, discarding: {dropped.text}")
+            lane.append(item)
+            stats['queued'] += 1
+            self._cond.notify()
+
+    def get(self):
+        """Blocks until an item is ready; returns None once the scheduler is closed."""
+        with self._cond:
+            while True:
+                if self._closed:
+                    return None
+                item = self._pop_ready()
+                if item is not None:
+                    return item
+                self._cond.wait()
+
+    def _drop_stale(self, now):
+        """Drops expired items from every lane, so they neither count as depth
+        nor wait behind busier, higher-priority lanes to be discarded."""
+        for category, lane in self._lanes.items():
+            max_age = self.max_age.get(category)
+            if max_age is None:
+                continue
+            # lanes are in arrival order, so the expired items are at the front
+            while lane and now - lane[0].created > max_age:
+                lane.popleft()
+                self.stats[category]['dropped_stale'] += 1
+
+    def _pop_ready(self):
+        now = time.monotonic()
+        self._drop_stale(now)
+        for category in self.priorities:
+            lane = self._lanes[category]
+            stats = self.stats[category]
+            max_age = self.max_age.get(category)
+            if lane:
+                item = lane.popleft()
+                stats['spoken'] += 1
+                template = self.coalesce.get(category)
+                if template and item.name is not None and lane:
+                    return self._coalesce(item, lane, template, stats, now, max_age)
+                return item
+        return None
+
+    def _coalesce(self, item, lane, template, stats, now, max_age):
+        names = [item.name]
+        while lane and len(names) < self.coalesce_max:
+            other = lane.popleft()
+            if max_age is not None and now - other.created > max_age:
+                stats['dropped_stale'] += 1
+            elif other.name is not None and other.voice_index == item.voice_index:
+                names.append(other.name)
+                stats['coalesced'] += 1
+            else:
+                lane.appendleft(other)
+                break
+        if len(names) == 1:
+            return item
+        joined = '、'.join(names)
+        segments = None
+        if item.segments is not None:
+            prefix, _, suffix = template.partition('{names}')
+            segments = ((prefix.strip(), True), (joined, False), (suffix.strip(), True))
+        merged = TTSItem(item.category, item.voice_index, template.format(names=joined),
+                         action=item.action, segments=segments)
+        merged.created = item.created
+        return merged
+
+    def task_done(self):
+        pass
+
+    def clear(self):
+        with self._cond:
+            for lane in self._lanes.values():
+                lane.clear()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def depth(self):
+        with self._cond:
+            self._drop_stale(time.monotonic())
+            return {category: len(lane) for category, lane in self._lanes.items()}
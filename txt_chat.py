@@ -7,10 +7,14 @@ from typing import Optional
 import os
 import uuid
 import cn2an
+import threading
+from chattts_server import ChatTTSServer
 
 
 class TTSModel:
     _instance = None
+    _server = None
+    _server_lock = threading.Lock()
 
     def __new__(cls):
         if cls._instance is None:
@@ -27,6 +31,15 @@ class TTSModel:
         tts_model.load(compile=False)  # 提高性能(使用GPU时需要关闭)
         print("TTS 模型已加载")
 
+    @classmethod
+    def server(cls):
+        """返回共享的批处理服务，并发的请求在同一个批次中生成，新请求在其他请求结束时加入。"""
+        with cls._server_lock:
+            if cls._server is None:
+                cls._server = ChatTTSServer(TTSModel().chat)
+                cls._server.start()
+            return cls._server
+
 
 def generate_tts_audio(
         text: str,
@@ -69,17 +82,11 @@ def generate_tts_audio(
     if spk_emb is None:
         spk_emb = tts_model.sample_random_speaker()
     # print(spk_emb)
-    # 设置生成的参数
-    params_infer_code = ChatTTS.Chat.InferCodeParams(
-        spk_emb=spk_static,  # 使用随机生成或指定的音色
-        temperature=temperature,  # 自定义生成温度
-    )
-
-    # 生成语音
-    wavs = tts_model.infer(check_txt, skip_refine_text=True, params_infer_code=params_infer_code)
+    # 生成语音，与同时到达的其他请求合并为一个批次
+    wav = TTSModel.server().synthesize(check_txt, spk_static, temperature)
 
     # 确保音频数据为 2D 张量 (channels, samples)
-    wavs_tensor = torch.tensor(wavs[0]).unsqueeze(0)  # 在第 0 维添加一个维度，表示单声道
+    wavs_tensor = torch.tensor(wav).unsqueeze(0)  # 在第 0 维添加一个维度，表示单声道
 
     # 保存生成的语音到文件
     torchaudio.save(output_file, wavs_tensor, sample_rate)
@@ -4,7 +4,7 @@ import time
 import edge_tts
 import threading
 from playsound import playsound
-import os
+import io
 import sounddevice as sd
 import soundfile as sf
 import asyncio
@@ -16,9 +16,9 @@ use_proxy = False
 MAX_RETRIES = 3  # 最大重试次数
 RETRY_DELAY = 1  # 每次重试之间的延迟（秒）
 
-def synchronous_text_to_speech(v_num, text, output_path):
+def synchronous_text_to_speech(v_num, text):
     """
-    使用 edge_tts 进行同步文本转语音的实现。
+    使用 edge_tts 进行同步文本转语音的实现，返回内存中的 MP3 数据。
     """
     voices = [
         "zh-CN-XiaoxiaoNeural",
@@ -30,19 +30,23 @@ def synchronous_text_to_speech(v_num, text, output_path):
     ]
     voice = voices[v_num]  # 固定选择声音
 
+    async def collect(tts):
+        audio = bytearray()
+        async for chunk in tts.stream():
+            if chunk["type"] == "audio":
+                audio += chunk["data"]
+        return bytes(audio)
+
     for attempt in range(MAX_RETRIES):
         try:
             # 创建一个事件循环用于运行 edge_tts 的异步调用
             loop = asyncio.new_event_loop()
             asyncio.set_event_loop(loop)
             tts = edge_tts.Communicate(text, voice, proxy=PROXY if use_proxy else None)
-            loop.run_until_complete(tts.save(output_path))
-            loop.close()
-
-            if os.path.exists(output_path):
-                return  # 成功生成音频文件，退出重试
-            else:
-                raise FileNotFoundError(f"生成失败: {output_path}")
+            try:
+                return loop.run_until_complete(collect(tts))
+            finally:
+                loop.close()
         except Exception as e:
             print(f"第 {attempt + 1} 次尝试失败: {e}")
             if attempt < MAX_RETRIES - 1:  # 如果不是最后一次重试
@@ -51,19 +55,16 @@ def synchronous_text_to_speech(v_num, text, output_path):
             else:
                 raise  # 达到最大重试次数，抛出异常
 
-def play_speech_thread(text, output_mp3, v_num):
+def play_speech_thread(text, v_num=0, device_id=None):
+    """合成并直接在内存中解码播放，不再写临时 MP3 文件"""
     try:
-        os.makedirs(os.path.dirname(output_mp3), exist_ok=True)
-        synchronous_text_to_speech(v_num, text, output_mp3)
-        play_audio_with_playsound(output_mp3)
-        print(f"语音已生成并播放：{output_mp3}")
+        audio = synchronous_text_to_speech(v_num, text)
+        data, samplerate = sf.read(io.BytesIO(audio), dtype='float32')
+        sd.play(data, samplerate, device=device_id)
+        sd.wait()  # 等待播放结束
+        print(f"语音已生成并播放：{text}")
     except Exception as e:
         print(f"播放时发生错误: {e}")
-    finally:
-        try:
-            os.remove(output_mp3)
-        except OSError as e:
-            print(f"删除文件时出错: {e}")
 
 def play_audio_with_playsound(wav_file):
     playsound(wav_file)
@@ -86,5 +87,4 @@ def play_audio(wav_file, device_id=4):
 
 if __name__ == '__main__':
     txt = "你好，欢迎使用文本转语音系统！"
-    output_file = "msic/output.mp3"
-    threading.Thread(target=play_speech_thread, args=(txt, output_file)).start()
+    threading.Thread(target=play_speech_thread, args=(txt,)).start()
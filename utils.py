@@ -2,14 +2,19 @@
 import codecs
 import hashlib
 import os
+import queue
 import random
 import string
 import subprocess
 import sys
+import threading
+import time
 import urllib.parse
+from collections import OrderedDict
 from contextlib import contextmanager
 from unittest.mock import patch
 from py_mini_racer import MiniRacer
+import config
 from logger import log
 
 @contextmanager
@@ -23,34 +28,136 @@ def patched_popen_encoding(encoding='utf-8'):
     with patch.object(subprocess.Popen, '__init__', new_popen_init):
         yield
 
-def generateSignature(wss, script_file='sign.js'):
+SIGN_PARAMS = ("live_id,aid,version_code,webcast_sdk_version,"
+               "room_id,sub_room_id,sub_channel_id,did_rule,"
+               "user_unique_id,device_platform,device_type,ac,"
+               "identity").split(',')
+
+def _script_path(script_file):
     if getattr(sys, 'frozen', False):
         base_path = sys._MEIPASS
     else:
         base_path = os.path.dirname(__file__)
+    return os.path.join(base_path, script_file)
 
-    script_path = os.path.join(base_path, script_file)
-    params = ("live_id,aid,version_code,webcast_sdk_version,"
-              "room_id,sub_room_id,sub_channel_id,did_rule,"
-              "user_unique_id,device_platform,device_type,ac,"
-              "identity").split(',')
+def signature_md5(wss):
     wss_params = urllib.parse.urlparse(wss).query.split('&')
     wss_maps = {i.split('=')[0]: i.split("=")[-1] for i in wss_params}
-    tpl_params = [f"{i}={wss_maps.get(i, '')}" for i in params]
+    tpl_params = [f"{i}={wss_maps.get(i, '')}" for i in SIGN_PARAMS]
     param = ','.join(tpl_params)
     md5 = hashlib.md5()
     md5.update(param.encode())
-    md5_param = md5.hexdigest()
+    return md5.hexdigest()
 
-    with codecs.open(script_path, 'r', encoding='utf8') as f:
-        script = f.read()
+class Signer:
+    """Signs WebSocket URLs with sign.js kept loaded in warm MiniRacer contexts.
 
-    ctx = MiniRacer()
-    ctx.eval(script)
+    Contexts are built lazily up to ``pool_size`` and reused, so only the first
+    signature pays for starting V8 and evaluating the script. Signatures are
+    memoized per parameter MD5 because reconnects to the same room sign the
+    same parameters again. sign.js mixes the current time into its output, so
+    memoized signatures expire after ``cache_ttl`` seconds.
+    """
 
-    try:
-        signature = ctx.call("get_sign", md5_param)
+    def __init__(self, script_file='sign.js', pool_size=1, cache_size=256, cache_ttl=60):
+        self.script_path = _script_path(script_file)
+        self.pool_size = pool_size
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self._script = None
+        self._contexts = queue.Queue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self.stats = {
+            'calls': 0,
+            'cache_hits': 0,
+            'contexts_built': 0,
+            'build_ms': 0.0,
+            'sign_ms': 0.0,
+            'last_ms': 0.0,
+        }
+
+    def _build_context(self):
+        start = time.perf_counter()
+        if self._script is None:
+            with codecs.open(self.script_path, 'r', encoding='utf8') as f:
+                self._script = f.read()
+        ctx = MiniRacer()
+        ctx.eval(self._script)
+        elapsed = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self.stats['contexts_built'] += 1
+            self.stats['build_ms'] += elapsed
+        log.info(f"Loaded sign.js into a new V8 context in {elapsed:.1f} ms")
+        return ctx
+
+    def _acquire(self):
+        try:
+            return self._contexts.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            can_build = self._created < self.pool_size
+            if can_build:
+                self._created += 1
+        if can_build:
+            try:
+                return self._build_context()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        return self._contexts.get()
+
+    def warm_up(self):
+        """Builds the first context ahead of time so the first connect is fast."""
+        self._contexts.put(self._acquire())
+
+    def sign_md5(self, md5_param):
+        start = time.perf_counter()
+        with self._lock:
+            self.stats['calls'] += 1
+            cached = self._cache.get(md5_param)
+            if cached is not None and time.monotonic() - cached[1] < self.cache_ttl:
+                self._cache.move_to_end(md5_param)
+                self.stats['cache_hits'] += 1
+                return cached[0]
+
+        ctx = self._acquire()
+        try:
+            signature = ctx.call("get_sign", md5_param)
+        finally:
+            self._contexts.put(ctx)
+
+        elapsed = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self._cache[md5_param] = (signature, time.monotonic())
+            self._cache.move_to_end(md5_param)
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            self.stats['sign_ms'] += elapsed
+            self.stats['last_ms'] = elapsed
+        log.debug(f"Generated signature in {elapsed:.1f} ms")
         return signature
+
+    def sign(self, wss):
+        return self.sign_md5(signature_md5(wss))
+
+_signers = {}
+_signers_lock = threading.Lock()
+
+def get_signer(script_file='sign.js'):
+    with _signers_lock:
+        signer = _signers.get(script_file)
+        if signer is None:
+            signer = Signer(script_file, pool_size=config.SIGNER_POOL_SIZE, cache_ttl=config.SIGNATURE_CACHE_TTL)
+            _signers[script_file] = signer
+        return signer
+
+def generateSignature(wss, script_file='sign.js'):
+    try:
+        return get_signer(script_file).sign(wss)
     except Exception as e:
         log.error(f"Error generating signature: {e}")
         return None
@@ -2,42 +2,105 @@
 import gzip
 import threading
 import websocket
-import requests
-import re
 from protobuf.douyin import PushFrame, Response
+from protobuf.wire import scan_frame, scan_push_frame, scan_response_header
 import config
-from utils import generateSignature, generateMsToken
+from utils import generateSignature
+from room_resolver import get_resolver
+from frame_capture import open_capture
+from ingest_pipeline import IngestPipeline
+from reconnect import ConnectionHealth, ReconnectBackoff, plan_reconnect
+from message_dedup import MessageDedup
 from logger import log
 
+def parse_frame(message):
+    if config.LAZY_DECODE:
+        return scan_frame(message)
+    package = PushFrame().parse(message)
+    response = Response().parse(gzip.decompress(package.payload))
+    return package, response
+
+def dispatch_frame(message, on_message_callback):
+    package, response = parse_frame(message)
+    for msg in response.messages_list:
+        on_message_callback(msg.method, msg.payload)
+    return package, response
+
+def receive_frame(message):
+    """Does only what acking needs: returns (log_id, response bytes, need_ack, internal_ext)."""
+    package = scan_push_frame(message)
+    response_bytes = gzip.decompress(package.payload)
+    need_ack, internal_ext = scan_response_header(response_bytes)
+    return package.log_id, response_bytes, need_ack, internal_ext
+
+def build_ack(log_id, internal_ext):
+    return PushFrame(
+        log_id=log_id,
+        payload_type='ack',
+        payload=internal_ext.encode('utf-8')
+    ).SerializeToString()
+
+def build_wss_url(room_id):
+    wss_url = config.WSS_URL_TEMPLATE.format(room_id=room_id)
+    signature = generateSignature(wss_url)
+    return wss_url + f"&signature={signature}"
+
+def build_headers(ttwid):
+    return {
+        "cookie": f"ttwid={ttwid}",
+        'user-agent': config.USER_AGENT,
+    }
+
 class WebSocketClient:
-    def __init__(self, live_id, on_message_callback):
+    def __init__(self, live_id, on_message_callback, pipeline=None):
         self.live_id = live_id
         self.on_message_callback = on_message_callback
+        self.owns_pipeline = pipeline is None
+        self.pipeline = pipeline or IngestPipeline()
         self.ws = None
         self.timer = None
-        self.reconnect_lock = threading.Lock()
+        self.health = ConnectionHealth(live_id)
+        self.backoff = ReconnectBackoff()
+        self.dedup = MessageDedup()
+        self._stopped = threading.Event()
         self.__ttwid = None
         self.__room_id = None
+        self.recorder = open_capture(live_id)
 
     def start(self):
-        threading.Thread(target=self._connect, daemon=True).start()
+        self.pipeline.start()
+        self._stopped.clear()
+        threading.Thread(target=self._supervise, daemon=True).start()
 
     def stop(self):
+        self._stopped.set()
         if self.ws:
             self.ws.close()
         if self.timer:
             self.timer.cancel()
+        if self.recorder:
+            self.recorder.close()
+        if self.owns_pipeline:
+            self.pipeline.stop()
+
+    def _supervise(self):
+        """Connects, waits for the connection to end and reconnects with backoff until stopped."""
+        while not self._stopped.is_set():
+            if self.backoff.attempting():
+                # The trial after a pause re-resolves the room; the broadcast may have restarted
+                get_resolver().invalidate(self.live_id)
+                self.__room_id = None
+            self.health.on_attempt()
+            self._connect()
+            if self._stopped.is_set():
+                break
+            self._stopped.wait(plan_reconnect(self.health, self.backoff, self.live_id))
 
     def _connect(self):
+        """Runs one connection until it closes; the ttwid, room_id and signature are reused across calls."""
         try:
-            wss_url = config.WSS_URL_TEMPLATE.format(room_id=self.room_id)
-            signature = generateSignature(wss_url)
-            wss_url += f"&signature={signature}"
-
-            headers = {
-                "cookie": f"ttwid={self.ttwid}",
-                'user-agent': config.USER_AGENT,
-            }
+            wss_url = build_wss_url(self.room_id)
+            headers = build_headers(self.ttwid)
             self.ws = websocket.WebSocketApp(
                 wss_url,
                 header=headers,
@@ -52,24 +115,22 @@ class WebSocketClient:
             log.error(f"Failed to connect: {e}")
 
     def _on_open(self, ws):
-        log.info("WebSocket connected.")
+        self.health.on_connected()
+        log.info(f"WebSocket connected in {self.health.connect_latency * 1000:.0f} ms.")
         self._reset_timer()
 
     def _on_message(self, ws, message):
-        package = PushFrame().parse(message)
-        response = Response().parse(gzip.decompress(package.payload))
-
-        if response.need_ack:
-            ack = PushFrame(
-                log_id=package.log_id,
-                payload_type='ack',
-                payload=response.internal_ext.encode('utf-8')
-            ).SerializeToString()
+        if self.recorder:
+            self.recorder.record(message)
+        log_id, response_bytes, need_ack, internal_ext = receive_frame(message)
+
+        if need_ack:
+            ack = build_ack(log_id, internal_ext)
             ws.send(ack, websocket.ABNF.OPCODE_BINARY)
+            self.health.on_ack()
             self._reset_timer()
 
-        for msg in response.messages_list:
-            self.on_message_callback(msg.method, msg.payload)
+        self.pipeline.submit(response_bytes, self.on_message_callback, self.dedup)
 
     def _on_error(self, ws, error):
         log.error(f"WebSocket error: {error}")
@@ -86,45 +147,18 @@ class WebSocketClient:
         self.timer.start()
 
     def _handle_timeout(self):
-        with self.reconnect_lock:
-            log.warning(f"No message received for {config.MESSAGE_TIMEOUT} seconds, reconnecting...")
-            if self.ws:
-                self.ws.close()
-            self._connect()
+        log.warning(f"No message received for {config.MESSAGE_TIMEOUT} seconds, reconnecting...")
+        if self.ws:
+            self.ws.close()
 
     @property
     def ttwid(self):
-        if self.__ttwid:
-            return self.__ttwid
-        headers = {"User-Agent": config.USER_AGENT}
-        try:
-            response = requests.get(config.DOUYIN_LIVE_URL, headers=headers)
-            response.raise_for_status()
-            self.__ttwid = response.cookies.get('ttwid')
-            return self.__ttwid
-        except Exception as err:
-            log.error(f"Error getting ttwid: {err}")
-            return None
+        if not self.__ttwid:
+            self.__ttwid = get_resolver().get_ttwid()
+        return self.__ttwid
 
     @property
     def room_id(self):
-        if self.__room_id:
-            return self.__room_id
-        url = config.DOUYIN_LIVE_URL + self.live_id
-        headers = {
-            "User-Agent": config.USER_AGENT,
-            "cookie": f"ttwid={self.ttwid}; msToken={generateMsToken()}; __ac_nonce=0123407cc00a9e438deb4",
-        }
-        try:
-            response = requests.get(url, headers=headers)
-            response.raise_for_status()
-            match = re.search(r'roomId\\":\\"(\d+)\\"', response.text)
-            if match:
-                self.__room_id = match.group(1)
-                return self.__room_id
-            else:
-                log.error("Could not find room_id.")
-                return None
-        except Exception as err:
-            log.error(f"Error getting room_id: {err}")
-            return None
+        if not self.__room_id:
+            self.__room_id = get_resolver().get_room_id(self.live_id)
+        return self.__room_id